@@ -0,0 +1,231 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Bulk operation worker.
+
+:class:`~adapters.executor.CloudifyProcessExecutor` can run a group of ready tasks that call the
+same plugin function in a single worker process started with this module as its entry point,
+rather than starting a process per task. Each task still gets its own ARIA operation context, and
+goes through the process executor decorators (and so through its own context adapter and Cloudify
+context scope) as it would in a worker of its own. Its start, success or failure are reported to
+the executor individually, so retries and aborts apply to the task alone.
+
+The tasks run on ``ARIA_CLOUDIFY_BULK_THREADS`` threads, one per task if unset (set it to 1 to run
+them sequentially). Module state, such as cloud clients a plugin caches, is shared between them.
+
+A worker that has to exit before its tasks end (see :func:`abandon`) reports the tasks it still runs
+or holds queued first, with :class:`WorkerAbandoned`, so that the executor retries them.
+"""
+
+import os
+import sys
+import pickle
+import threading
+import traceback
+
+import aria
+from aria.extension import process_executor
+from aria.orchestrator.exceptions import TaskRetryException
+from aria.orchestrator.workflows.executor import process
+from aria.utils import imports
+
+
+BULK_THREADS_ENV = 'ARIA_CLOUDIFY_BULK_THREADS'
+
+
+class WorkerAbandoned(TaskRetryException):
+    """
+    The bulk worker running or holding a task exited, since another of its tasks could not be
+    stopped.
+    """
+
+
+def main(arguments_paths):
+    """
+    Runs the tasks whose process executor arguments were written to ``arguments_paths``.
+    """
+    for arguments_path in arguments_paths:
+        with open(arguments_path, 'rb') as f:
+            _tasks.put(pickle.loads(f.read()))
+        # Temporary files created by the executor
+        os.remove(arguments_path)
+
+    threads = int(os.environ.get(BULK_THREADS_ENV) or 0) or len(arguments_paths)
+    loader = _Loader()
+    workers = [threading.Thread(target=_worker, args=(_tasks, loader))
+               for _ in range(min(threads, len(arguments_paths)))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def abandon(task_id, exception):
+    """
+    Reports the task ``task_id`` of the bulk worker failed with ``exception``, and every other task
+    the worker runs or holds queued with :class:`WorkerAbandoned`, for the worker to exit. Tasks
+    stop being run or reported. Returns False, reporting nothing, outside of a bulk worker.
+    """
+    return _tasks.abandon(task_id, exception)
+
+
+def run_task(arguments, loader, messenger=None):
+    """
+    Runs a single task as ARIA's process executor subprocess would.
+    """
+    if messenger is None:
+        messenger = process._Messenger(task_id=arguments['task_id'], port=arguments['port'])
+    context_dict = arguments['context']
+    try:
+        ctx = loader.instantiate(context_dict)
+    except BaseException as e:
+        messenger.failed(e)
+        return
+
+    try:
+        messenger.started()
+        task_func = loader.load(arguments['function'], arguments['strict_loading'])
+        task_func(ctx=ctx, **arguments['operation_arguments'])
+        ctx.close()
+        messenger.succeeded()
+    except BaseException as e:
+        ctx.close()
+        messenger.failed(e)
+
+
+def _worker(tasks, loader):
+    while True:
+        task = tasks.next()
+        if task is None:
+            return
+        arguments, messenger = task
+        try:
+            run_task(arguments, loader, messenger)
+        except BaseException:
+            # Failing to report one task must not keep the others from running
+            traceback.print_exc()
+        finally:
+            tasks.done(arguments['task_id'])
+
+
+class _Tasks(object):
+    """
+    The tasks of a bulk worker: queued ones, and the messengers of running ones.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queued = []
+        self._running = {}
+        self._abandoned = False
+
+    def put(self, arguments):
+        with self._lock:
+            self._queued.append(arguments)
+
+    def next(self):
+        with self._lock:
+            if self._abandoned or not self._queued:
+                return None
+            arguments = self._queued.pop(0)
+            messenger = _Messenger(task_id=arguments['task_id'], port=arguments['port'])
+            self._running[arguments['task_id']] = messenger
+            return arguments, messenger
+
+    def done(self, task_id):
+        with self._lock:
+            self._running.pop(task_id, None)
+
+    def abandon(self, task_id, exception):
+        with self._lock:
+            if task_id not in self._running:
+                return False
+            self._abandoned = True
+            messengers = [_Messenger(task_id=arguments['task_id'], port=arguments['port'])
+                          for arguments in self._queued]
+            messengers.extend(messenger for other_id, messenger in self._running.items()
+                              if other_id != task_id)
+            abandoned = self._running[task_id]
+            self._queued = []
+        abandoned.failed(exception)
+        for messenger in messengers:
+            try:
+                messenger.failed(WorkerAbandoned(
+                    'Worker exited, abandoning task {0}'.format(task_id), retry_interval=0))
+            except BaseException:
+                # Reporting the others goes on, as the worker is about to exit anyway
+                traceback.print_exc()
+        return True
+
+
+class _Messenger(process._Messenger):
+    """
+    Reports a task at most until it ends: the worker may report a running task failed when
+    abandoning it, and the task must not report again.
+    """
+
+    def __init__(self, task_id, port):
+        super(_Messenger, self).__init__(task_id=task_id, port=port)
+        self._lock = threading.Lock()
+        self._ended = False
+
+    def _send_message(self, type, exception=None):
+        with self._lock:
+            if self._ended:
+                return
+            self._ended = type != 'started'
+            super(_Messenger, self)._send_message(type, exception)
+
+
+class _Loader(object):
+    """
+    Loads and decorates task functions once per worker, for all the tasks calling them, and
+    instantiates task contexts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._functions = {}
+        self._extensions_installed = False
+
+    def instantiate(self, context_dict):
+        # Loading the task model unpickles its executor class. cPickle finds modules another thread
+        # is still importing in sys.modules, before they define it.
+        with self._lock:
+            return context_dict['context_cls'].instantiate_from_dict(**context_dict['context'])
+
+    def load(self, function, strict_loading):
+        with self._lock:
+            if function not in self._functions:
+                task_func = imports.load_attribute(function)
+                if not self._extensions_installed:
+                    aria.install_aria_extensions(strict_loading)
+                    self._extensions_installed = True
+                for decorate in process_executor.decorate():
+                    task_func = decorate(task_func)
+                self._functions[function] = task_func
+            return self._functions[function]
+
+
+# The tasks of the worker, when the process is one
+_tasks = _Tasks()
+
+
+if __name__ == '__main__':
+    # Through the package module, whose tasks operations abandon
+    from adapters import bulk
+    bulk.main(sys.argv[1:])
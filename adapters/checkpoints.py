@@ -0,0 +1,94 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Operation checkpoints that survive retries.
+
+A retried operation runs again from the top, so multi-step operations (e.g. create an instance,
+tag it, attach a volume) either repeat their early steps or query the cloud to find out how far
+the previous attempt got. With ``ctx.operation.checkpoint(name, value)``, an operation saves
+progress markers as it goes, and later attempts read them back from ``ctx.operation.checkpoints``.
+
+Markers are kept in a small JSON file per execution and task in the plugin work directory of the
+service (``ctx.plugin_workdir``), written atomically, which is much cheaper than updating runtime
+properties in storage. Operations of tasks without a plugin have no such directory, and can't keep
+checkpoints. Markers are removed once the operation is settled: when it succeeds, when it is
+aborted, or when it fails with no attempts left.
+"""
+
+import os
+
+from . import utils
+
+
+CHECKPOINTS_DIR = 'checkpoints'
+
+
+class Checkpoints(object):
+
+    def __init__(self, path):
+        self._path = path
+        self._markers = None
+
+    @classmethod
+    def of(cls, ctx):
+        """
+        The checkpoints of the task of the operation context ``ctx``.
+        """
+        workdir = ctx.plugin_workdir
+        if workdir is None:
+            raise ValueError('Task {0} has no plugin work directory to keep checkpoints in'
+                             .format(ctx.task.id))
+        return cls(os.path.join(workdir, CHECKPOINTS_DIR, str(ctx.task.execution.id),
+                                '{0}.json'.format(ctx.task.id)))
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def markers(self):
+        """
+        Markers by name; a copy, changes are made with :meth:`save`.
+        """
+        if self._markers is None:
+            self._markers = utils.read_json(self._path, default=None) or {}
+        return dict(self._markers)
+
+    def save(self, name, value=True):
+        """
+        Saves a marker, of a JSON serializable ``value``.
+        """
+        markers = self.markers
+        markers[name] = value
+        utils.write_json(self._path, markers)
+        self._markers = markers
+
+    def clear(self):
+        self._markers = {}
+        try:
+            os.remove(self._path)
+            # Until the last task of the execution is settled
+            os.rmdir(os.path.dirname(self._path))
+        except OSError:
+            pass
+
+
+def available(ctx):
+    """
+    Whether the operation of ``ctx`` can keep checkpoints.
+    """
+    return ctx.task.plugin is not None
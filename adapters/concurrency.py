@@ -0,0 +1,207 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Adaptive worker concurrency.
+
+A fixed worker limit is too low when operations mostly wait on cloud APIs, and too high once
+storage write contention becomes the bottleneck. With ``adaptive_workers=(min, max)`` (or
+``ARIA_CLOUDIFY_ADAPTIVE_WORKERS=min:max``), :class:`~adapters.executor.CloudifyProcessExecutor`
+adjusts its worker limit within these bounds instead, with a :class:`ConcurrencyController`.
+
+The extension measures every operation's wall time, CPU time, the time it spent waiting for a CPU
+(on Linux), and the time it spent committing to storage, and leaves them in a file per task in
+``ARIA_CLOUDIFY_TASK_USAGE_DIR``, which the executor reads as the task ends. Every ``WINDOW``
+tasks, the controller aims the limit at the number of tasks keeping the host's CPUs busy, given the
+share of a CPU a task used while not waiting for one, and backs off while storage commits take more
+than ``STORAGE_THRESHOLD`` of the tasks' time. The limit at most doubles or halves per adjustment.
+"""
+
+import os
+import sys
+import time
+import weakref
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from sqlalchemy import event
+
+from . import utils
+
+
+ADAPTIVE_WORKERS_ENV = 'ARIA_CLOUDIFY_ADAPTIVE_WORKERS'
+TASK_USAGE_DIR_ENV = 'ARIA_CLOUDIFY_TASK_USAGE_DIR'
+
+# Linux value, missing from Python 2's resource module
+_RUSAGE_THREAD = 1
+
+# Storage session: [seconds spent in commits, start of the commit in progress]
+_commit_times = weakref.WeakKeyDictionary()
+
+
+class ConcurrencyController(object):
+
+    # Number of finished tasks the limit is adjusted on
+    WINDOW = 10
+    # Share of the tasks' time spent in storage commits past which storage is considered contended
+    STORAGE_THRESHOLD = 0.2
+    # Largest factor the limit changes by per adjustment
+    MAX_FACTOR = 2.0
+    # Lowest CPU share a task is assumed to use, bounding the target on idle tasks
+    MIN_CPU_SHARE = 0.01
+
+    def __init__(self, min_workers, max_workers, cpus=None):
+        self._min_workers = max(1, min_workers)
+        self._max_workers = max(self._min_workers, max_workers)
+        self._cpus = cpus or multiprocessing.cpu_count()
+        self._limit = max(self._min_workers, min(self._max_workers, self._cpus))
+        self._samples = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls):
+        value = os.environ.get(ADAPTIVE_WORKERS_ENV)
+        if not value:
+            return None
+        min_workers, max_workers = value.split(':')
+        return cls(int(min_workers), int(max_workers))
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @property
+    def bounds(self):
+        return self._min_workers, self._max_workers
+
+    def observe(self, wall_time, cpu_time, storage_time, cpu_wait=0):
+        """
+        Accounts for a finished task, and returns the worker limit.
+        """
+        with self._lock:
+            self._samples.append((wall_time, cpu_time, storage_time, cpu_wait))
+            if len(self._samples) >= self.WINDOW:
+                samples, self._samples = self._samples, []
+                self._limit = self._adjust(samples)
+            return self._limit
+
+    def _adjust(self, samples):
+        # Waiting for a CPU stretches tasks as the limit grows past the CPUs, and would
+        # otherwise pass for I/O wait that more tasks could overlap
+        run_time = sum(sample[0] - sample[3] for sample in samples)
+        if run_time <= 0:
+            return self._limit
+        cpu_share = sum(sample[1] for sample in samples) / run_time
+        storage_share = sum(sample[2] for sample in samples) / run_time
+        if storage_share > self.STORAGE_THRESHOLD:
+            target = self._limit * (1 - storage_share)
+        else:
+            target = self._cpus / max(cpu_share, self.MIN_CPU_SHARE)
+        target = min(self._limit * self.MAX_FACTOR, max(self._limit / self.MAX_FACTOR, target))
+        return max(self._min_workers, min(self._max_workers, int(round(target))))
+
+
+@contextmanager
+def usage_report(task_id, model):
+    """
+    Measures the operation run in the block, and leaves its usage for the executor in
+    ``ARIA_CLOUDIFY_TASK_USAGE_DIR``.
+    """
+    directory = utils.env_path(TASK_USAGE_DIR_ENV)
+    if directory is None:
+        yield
+        return
+
+    session = model.node._session
+    if not event.contains(session, 'before_commit', _commit_started):
+        event.listen(session, 'before_commit', _commit_started)
+        event.listen(session, 'after_commit', _commit_ended)
+        event.listen(session, 'after_rollback', _commit_ended)
+    commit_times = _commit_times.setdefault(session, [0.0, None])
+    start_storage_time = commit_times[0]
+    start_cpu_time = cpu_time()
+    start_cpu_wait = cpu_wait()
+    start = time.time()
+    try:
+        yield
+    finally:
+        utils.write_json(usage_path(directory, task_id), {
+            'wall_time': time.time() - start,
+            'cpu_time': cpu_time() - start_cpu_time,
+            'storage_time': commit_times[0] - start_storage_time,
+            'cpu_wait': cpu_wait() - start_cpu_wait})
+
+
+def read_usage(directory, task_id):
+    """
+    Reads and removes the usage left by a task, as (wall time, CPU time, storage time, CPU wait);
+    ``None`` if it left none.
+    """
+    path = usage_path(directory, task_id)
+    usage = utils.read_json(path)
+    if usage is None:
+        return None
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return usage['wall_time'], usage['cpu_time'], usage['storage_time'], usage['cpu_wait']
+
+
+def usage_path(directory, task_id):
+    return os.path.join(directory, '{0}.json'.format(task_id))
+
+
+def cpu_time():
+    """
+    CPU time of the calling thread where the platform tells it (tasks of bulk workers run in
+    threads), and of the process otherwise.
+    """
+    if resource is None:
+        times = os.times()
+        return times[0] + times[1]
+    usage = resource.getrusage(_RUSAGE_THREAD if sys.platform.startswith('linux')
+                               else resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def cpu_wait():
+    """
+    Time the calling thread spent runnable but waiting for a CPU, where the platform tells it
+    (Linux scheduler statistics), and zero otherwise.
+    """
+    try:
+        with open('/proc/thread-self/schedstat') as f:
+            return int(f.read().split()[1]) / 1e9
+    except (IOError, OSError, IndexError, ValueError):
+        return 0.0
+
+
+def _commit_started(session):
+    _commit_times.setdefault(session, [0.0, None])[1] = time.time()
+
+
+def _commit_ended(session):
+    commit_times = _commit_times.get(session)
+    if commit_times is not None and commit_times[1] is not None:
+        commit_times[0] += time.time() - commit_times[1]
+        commit_times[1] = None
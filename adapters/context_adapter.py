@@ -16,8 +16,13 @@
 
 import os
 import tempfile
+from contextlib import contextmanager
 
 from aria.orchestrator.context import operation
+from aria.storage import exceptions as storage_exceptions
+
+from . import (checkpoints, deadlines, metrics, ratelimit, resources, scratch, tracing, utils,
+               versions)
 
 
 DEPLOYMENT = 'deployment'
@@ -27,19 +32,32 @@ RELATIONSHIP_INSTANCE = 'relationship-instance'
 
 class CloudifyContextAdapter(object):
 
-    def __init__(self, ctx):
+    def __init__(self, ctx, record=None):
+        """
+        :param record: the task's :class:`~adapters.records.TaskRecord`, if it was compiled with
+         one; static properties are then served from it rather than from storage
+        """
         self._ctx = ctx
-        self._blueprint = BlueprintAdapter(ctx)
-        self._deployment = DeploymentAdapter(ctx)
-        self._operation = OperationAdapter(ctx)
+        self._record = record
+        self._blueprint = BlueprintAdapter(ctx, record)
+        self._deployment = DeploymentAdapter(ctx, record)
+        self._operation = OperationAdapter(ctx, record)
         self._bootstrap_context = BootstrapAdapter(ctx)
-        self._plugin = PluginAdapter(ctx)
+        self._plugin = PluginAdapter(ctx, record)
         self._agent = CloudifyAgentAdapter()
         self._node = None
         self._node_instance = None
         self._source = None
         self._target = None
-        if isinstance(ctx, operation.NodeOperationContext):
+        if record is not None:
+            # Nodes are only loaded from storage once their state is accessed
+            if record.node is not None:
+                self._node = NodeAdapter(ctx, record=record.node)
+                self._instance = NodeInstanceAdapter(ctx, node_id=record.node.instance_id)
+            elif record.source is not None:
+                self._source = RelationshipTargetAdapter(ctx, record=record.source)
+                self._target = RelationshipTargetAdapter(ctx, record=record.target)
+        elif isinstance(ctx, operation.NodeOperationContext):
             self._node = NodeAdapter(ctx, ctx.node_template, ctx.node)
             self._instance = NodeInstanceAdapter(ctx, ctx.node)
         elif isinstance(ctx, operation.RelationshipOperationContext):
@@ -115,10 +133,14 @@ class CloudifyContextAdapter(object):
 
     @property
     def execution_id(self):
+        if self._record is not None:
+            return self._record.execution_id
         return self._ctx.task.execution.id
 
     @property
     def workflow_id(self):
+        if self._record is not None:
+            return self._record.workflow_id
         return self._ctx.task.execution.workflow_name
 
     @property
@@ -131,6 +153,8 @@ class CloudifyContextAdapter(object):
 
     @property
     def task_name(self):
+        if self._record is not None:
+            return self._record.task_name
         return self._ctx.task.function
 
     @property
@@ -152,30 +176,93 @@ class CloudifyContextAdapter(object):
     def provider_context(self):
         return {}
 
+    @tracing.traced('get_resource')
     def get_resource(self, resource_path):
-        return self._ctx.get_resource(resource_path)
+        return resources.get_resource(self._ctx, resource_path)
 
+    @tracing.traced('get_resource_and_render')
     def get_resource_and_render(self, resource_path, template_variables=None):
-        return self._ctx.get_resource_and_render(resource_path, variables=template_variables)
-
-    def download_resource(self, resource_path, target_path=None):
-        target_path = self._get_target_path(target_path, resource_path)
-        self._ctx.download_resource(
-            destination=target_path,
-            path=resource_path
-        )
-        return target_path
+        return resources.get_resource_and_render(self._ctx, resource_path,
+                                                 variables=template_variables)
+
+    @tracing.traced('download_resource')
+    def download_resource(self, resource_path, target_path=None, keep=False):
+        """
+        :param keep: without ``target_path``, whether the downloaded file must outlive the
+         operation; it is otherwise removed when the operation ends, with managed scratch space
+         (see :mod:`adapters.scratch`)
+        """
+        def download(destination):
+            resources.download_resource(
+                self._ctx,
+                destination=destination,
+                path=resource_path
+            )
+        chunks = resources.iter_resource(self._ctx, resource_path)
+        return self._download(download, chunks, resource_path, target_path, keep)
 
+    @tracing.traced('download_resource_and_render')
     def download_resource_and_render(self,
                                      resource_path,
                                      target_path=None,
-                                     template_variables=None):
+                                     template_variables=None,
+                                     keep=False):
+        """
+        :param keep: as for :meth:`download_resource`
+        """
+        def download(destination):
+            resources.download_resource_and_render(
+                self._ctx,
+                destination=destination,
+                path=resource_path,
+                variables=template_variables
+            )
+        chunks = resources.iter_resource_and_render(self._ctx, resource_path, template_variables)
+        return self._download(download, chunks, resource_path, target_path, keep)
+
+    def iter_resource(self, resource_path, chunk_size=resources.CHUNK_SIZE):
+        """
+        Streaming variant of ``get_resource``, yielding the resource in chunks.
+        """
+        return resources.iter_resource(self._ctx, resource_path, chunk_size)
+
+    def iter_resource_and_render(self,
+                                 resource_path,
+                                 template_variables=None,
+                                 chunk_size=resources.CHUNK_SIZE):
+        """
+        Streaming variant of ``get_resource_and_render``, yielding the rendered resource in chunks.
+        """
+        return resources.iter_resource_and_render(
+            self._ctx, resource_path, template_variables, chunk_size)
+
+    @contextmanager
+    def throttle(self, endpoint=None):
+        """
+        Holds the block back until the rate limits of a cloud endpoint allow a call, and counts it
+        as a call in flight to the endpoint until it ends (see :mod:`adapters.ratelimit`). Yields
+        the number of seconds waited.
+
+        :param endpoint: defaults to the endpoint the node (or the relationship source node) talks
+         to, according to its properties
+        """
+        limiter = ratelimit.RateLimiter.from_environment()
+        if limiter is None:
+            yield 0
+            return
+        if endpoint is None:
+            node = self._node or (self._source.node if self._source else None)
+            endpoint = ratelimit.endpoint(node.properties) if node else None
+        with limiter.acquire(endpoint) as waited:
+            yield waited
+
+    def _download(self, download, chunks, resource_path, target_path, keep):
+        space = scratch.current(self._ctx)
+        if not target_path and not keep and space is not None:
+            # Streamed, for scratch quotas to be enforced as the file is written
+            return space.create(chunks, suffix=os.path.basename(resource_path))
         target_path = self._get_target_path(target_path, resource_path)
-        self._ctx.download_resource_and_render(
-            destination=target_path,
-            path=resource_path,
-            variables=template_variables
-        )
+        download(target_path)
         return target_path
 
     @staticmethod
@@ -204,37 +291,48 @@ class CloudifyContextAdapter(object):
 
 class BlueprintAdapter(object):
 
-    def __init__(self, ctx):
+    def __init__(self, ctx, record=None):
         self._ctx = ctx
+        self._record = record
 
     @property
     def id(self):
+        if self._record is not None:
+            return self._record.blueprint_id
         return self._ctx.service_template.id
 
 
 class DeploymentAdapter(object):
 
-    def __init__(self, ctx):
+    def __init__(self, ctx, record=None):
         self._ctx = ctx
+        self._record = record
 
     @property
     def id(self):
+        if self._record is not None:
+            return self._record.deployment_id
         return self._ctx.service.id
 
 
 class NodeAdapter(object):
 
-    def __init__(self, ctx, node_template, node):
+    def __init__(self, ctx, node_template=None, node=None, record=None):
         self._ctx = ctx
         self._node_template = node_template
-        self._node = node
+        self._loaded_node = node
+        self._record = record
 
     @property
     def id(self):
+        if self._record is not None:
+            return self._record.id
         return self._node_template.id
 
     @property
     def name(self):
+        if self._record is not None:
+            return self._record.name
         return self._node_template.name
 
     @property
@@ -243,31 +341,66 @@ class NodeAdapter(object):
 
     @property
     def type(self):
+        if self._record is not None:
+            return self._record.type
         return self._node_template.type.name
 
     @property
     def type_hierarchy(self):
-        # We needed to modify the type hierarchy to be a list of strings that include the word
-        # 'cloudify' in each one of them instead of 'aria', since in the Cloudify AWS plugin, that
-        # we currently wish to support, if we want to attach an ElasticIP to a node, this node's
-        # type_hierarchy property must be a list of strings only, and it must contain either the
-        # string 'cloudify.aws.nodes.Instance', or the string 'cloudify.aws.nodes.Interface'.
-        # In any other case, we won't be able to attach an ElasticIP to a node using the Cloudify
-        # AWS plugin.
-        type_hierarchy_names = [type_.name for type_ in self._node_template.type.hierarchy
-                                if type_.name is not None]
-        return [type_name.replace('aria', 'cloudify') for type_name in type_hierarchy_names]
+        if self._record is not None:
+            return list(self._record.type_hierarchy)
+        return utils.cloudify_type_hierarchy(self._node_template.type)
+
+    @property
+    def _node(self):
+        if self._loaded_node is None:
+            self._loaded_node = self._ctx.model.node.get(self._record.instance_id)
+        return self._loaded_node
 
 
 class NodeInstanceAdapter(object):
 
-    def __init__(self, ctx, node):
+    # How many times update() re-applies changes through on_conflict before giving up
+    MAX_CONFLICT_RETRIES = 10
+
+    def __init__(self, ctx, node=None, node_id=None):
         self._ctx = ctx
-        self._node = node
+        self._loaded_node = node
+        self._node_id = node.id if node is not None else node_id
+        self._version = None
+        self._version_read = False
+        self._version_store = versions.NodeVersion.from_environment(self._node_id)
 
     @property
     def id(self):
-        return self._node.id
+        return self._node_id
+
+    @property
+    def version(self):
+        """
+        The number of writes of the node instance as of its loading or last write, or None when
+        versions are not kept.
+        """
+        if self._version_store is None:
+            return None
+        self._read_version()
+        return self._version_store.caught_up(self._version)
+
+    @property
+    def _node(self):
+        # Read first, so that a write meanwhile makes the version look outdated, not current
+        self._read_version()
+        if self._loaded_node is None:
+            self._loaded_node = self._ctx.model.node.get(self._node_id)
+        return self._loaded_node
+
+    def _read_version(self):
+        # Node instances loaded along with others (relationship targets) have their version read
+        # as they are first used, before their runtime properties are lazily loaded
+        if not self._version_read:
+            if self._version_store is not None:
+                self._version = self._version_store.current
+            self._version_read = True
 
     @property
     def runtime_properties(self):
@@ -277,21 +410,72 @@ class NodeInstanceAdapter(object):
     def runtime_properties(self, value):
         self._node.attributes = value
 
+    @tracing.traced('NodeInstanceAdapter.update')
     def update(self, on_conflict=None):
-        self._ctx.model.node.update(self._node)
-
+        """
+        Writes the node instance, provided nobody else updated it since it was loaded.
+
+        On a conflict, if ``on_conflict`` is given the instance is refreshed, ``on_conflict`` is
+        called with the fresh runtime properties to re-apply its changes on top of them, and the
+        write is attempted again. Otherwise :class:`NodeInstanceConflictError` is raised.
+        """
+        for _ in range(self.MAX_CONFLICT_RETRIES):
+            try:
+                return self._update()
+            except NodeInstanceConflictError:
+                if on_conflict is None:
+                    raise
+            _record_conflict()
+            self.refresh(force=True)
+            on_conflict(self.runtime_properties)
+        return self._update()
+
+    @tracing.traced('NodeInstanceAdapter.refresh')
     def refresh(self, force=False):
-        self._ctx.model.node.refresh(self._node)
+        """
+        Reloads the node instance from storage, unless versions are kept and nobody wrote it since
+        it was loaded (or ``force`` is set).
+        """
+        node = self._node
+        version = None
+        if self._version_store is not None:
+            version = self._version_store.current
+            if not force and version == self.version:
+                return
+        self._ctx.model.node.refresh(node)
+        self._version = version
 
     @property
     def host_ip(self):
         return self._node.host_address
 
     @property
+    @tracing.traced('NodeInstanceAdapter.relationships')
     def relationships(self):
         return [RelationshipAdapter(self._ctx, relationship=relationship) for
                 relationship in self._node.outbound_relationships]
 
+    def _update(self):
+        node = self._node
+        if self._version_store is None:
+            self._ctx.model.node.update(node)
+            return
+        with self._version_store.held() as version:
+            if version != self.version:
+                raise NodeInstanceConflictError(self.id, self.version)
+            self._ctx.model.node.update(node)
+            # Advanced by the commit, unless nothing changed
+            self._version = self._version_store.current
+
+
+class NodeInstanceConflictError(storage_exceptions.StorageError):
+
+    def __init__(self, node_id, version):
+        super(NodeInstanceConflictError, self).__init__(
+            'Node instance {0} was modified since version {1} was loaded'.format(node_id, version))
+        self.node_id = node_id
+        self.version = version
+
 
 class RelationshipAdapter(object):
 
@@ -313,25 +497,25 @@ class RelationshipAdapter(object):
 
 class RelationshipTargetAdapter(object):
 
-    def __init__(self, ctx, node_template, node):
+    def __init__(self, ctx, node_template=None, node=None, record=None):
         self._ctx = ctx
-        self.node = NodeAdapter(ctx, node_template=node_template, node=node)
-        self.instance = NodeInstanceAdapter(ctx, node=node)
+        self.node = NodeAdapter(ctx, node_template=node_template, node=node, record=record)
+        self.instance = NodeInstanceAdapter(
+            ctx, node=node, node_id=record.instance_id if record is not None else None)
 
 
 class OperationAdapter(object):
 
-    def __init__(self, ctx):
+    def __init__(self, ctx, record=None):
         self._ctx = ctx
+        self._record = record
+        self._checkpoints = None
 
     @property
     def name(self):
-        # We needed to modify the operation's 'name' property in order to support the Cloudify AWS
-        # plugin. It can't use ARIA's operation naming convention, as any operation we want to run
-        # using the Cloudify AWS plugin must have its name in the format:
-        # '<something>.<operation_name>'.
-        aria_name = self._ctx.task.name
-        return aria_name.split('@')[0].replace(':', '.')
+        if self._record is not None:
+            return self._record.operation_name
+        return utils.operation_name(self._ctx.task.name)
 
     @property
     def retry_number(self):
@@ -339,15 +523,55 @@ class OperationAdapter(object):
 
     @property
     def max_retries(self):
+        if self._record is not None:
+            return self._record.max_retries
         task = self._ctx.task
         if task.max_attempts == task.INFINITE_RETRIES:
             return task.INFINITE_RETRIES
         else:
             return task.max_attempts - 1 if task.max_attempts > 0 else 0
 
+    @property
+    def cancelled(self):
+        """
+        Whether the operation ran past its deadline and is asked to stop (see
+        :mod:`adapters.deadlines`).
+        """
+        deadline = deadlines.current(self._ctx)
+        return deadline is not None and deadline.cancelled
+
+    @property
+    def remaining_time(self):
+        """
+        Seconds left until the operation's deadline, or ``None`` if it has none.
+        """
+        deadline = deadlines.current(self._ctx)
+        return deadline.remaining() if deadline is not None else None
+
+    @property
+    def checkpoints(self):
+        """
+        Progress markers saved with :meth:`checkpoint` by this attempt of the operation and the
+        previous ones, by name (see :mod:`adapters.checkpoints`).
+        """
+        return self._get_checkpoints().markers
+
+    def checkpoint(self, name, value=True):
+        """
+        Saves a progress marker, of a JSON serializable ``value``, for later attempts of the
+        operation to read back from :attr:`checkpoints`. Markers are removed once the operation
+        succeeds. Operations of tasks without a plugin can't save markers (``ValueError``).
+        """
+        self._get_checkpoints().save(name, value)
+
     def retry(self, message=None, retry_after=None):
         self._ctx.task.retry(message, retry_after)
 
+    def _get_checkpoints(self):
+        if self._checkpoints is None:
+            self._checkpoints = checkpoints.Checkpoints.of(self._ctx)
+        return self._checkpoints
+
 
 class BootstrapAdapter(object):
 
@@ -368,20 +592,27 @@ class CloudifyAgentAdapter(object):
 
 class PluginAdapter(object):
 
-    def __init__(self, ctx):
+    def __init__(self, ctx, record=None):
         self._ctx = ctx
         self._plugin = None
+        self._record = record.plugin if record is not None else None
 
     @property
     def name(self):
+        if self._record is not None:
+            return self._record.name
         return self._ctx.task.plugin.name
 
     @property
     def package_name(self):
+        if self._record is not None:
+            return self._record.package_name
         return self._plugin_attr('package_name')
 
     @property
     def package_version(self):
+        if self._record is not None:
+            return self._record.package_version
         return self._plugin_attr('package_version')
 
     @property
@@ -401,6 +632,12 @@ class PluginAdapter(object):
         return getattr(self._plugin, attr, None)
 
 
+def _record_conflict():
+    store = metrics.MetricsStore.from_environment()
+    if store is not None:
+        store.inc(metrics.NODE_INSTANCE_CONFLICTS_TOTAL, {})
+
+
 class _Stub(object):
     def __getattr__(self, _):
         return None
@@ -0,0 +1,216 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Per-operation deadlines.
+
+Set ``ARIA_CLOUDIFY_OPERATION_TIMEOUTS`` to a JSON file mapping plugin names, Cloudify operation
+names (e.g. ``cloudify.interfaces.lifecycle.create``) or ``<plugin>:<operation>`` pairs to timeouts
+in seconds; ``*`` sets a default. The most specific entry applies.
+
+An operation running past its timeout is first asked to stop: ``ctx.operation.cancelled`` becomes
+true, for operations that poll it between steps. If it is still running
+``ARIA_CLOUDIFY_TIMEOUT_GRACE`` seconds later, it is interrupted: with a ``SIGALRM`` when it runs in
+the main thread of its worker (which also breaks out of blocking socket calls), and with an
+asynchronous exception otherwise (effective once control returns to Python code). If even that
+fails to stop it within another grace period, the timeout is reported to the executor directly and
+the worker is abandoned: it exits when the operation runs in its main thread, and a bulk worker (see
+:mod:`adapters.bulk`) first reports its other tasks, queued or running, for the executor to retry
+them, and exits too.
+
+Either way, the operation ends with :class:`OperationTimeout`, a retry request whose interval
+backs off exponentially with the number of attempts.
+"""
+
+import os
+import time
+import ctypes
+import signal
+import weakref
+import threading
+from contextlib import contextmanager
+
+from aria.orchestrator.exceptions import TaskRetryException
+from aria.orchestrator.workflows.executor import process
+
+from . import (bulk, utils)
+
+
+OPERATION_TIMEOUTS_ENV = 'ARIA_CLOUDIFY_OPERATION_TIMEOUTS'
+TIMEOUT_GRACE_ENV = 'ARIA_CLOUDIFY_TIMEOUT_GRACE'
+# Set by CloudifyProcessExecutor, so that abandoned operations can still be reported
+EXECUTOR_PORT_ENV = 'ARIA_CLOUDIFY_EXECUTOR_PORT'
+
+DEFAULT_GRACE = 30
+RETRY_BACKOFF = 30
+MAX_RETRY_BACKOFF = 600
+
+# Operation context: its running deadline
+_deadlines = weakref.WeakKeyDictionary()
+
+
+class OperationTimeout(TaskRetryException):
+    pass
+
+
+class DeadlineInterrupt(BaseException):
+    """
+    Raised inside an operation to interrupt it. It is a ``BaseException`` so that operations
+    catching ``Exception`` don't swallow it, and is turned into :class:`OperationTimeout`.
+    """
+
+
+class Deadline(object):
+
+    def __init__(self, timeout, grace=DEFAULT_GRACE, retry_number=0):
+        self.timeout = timeout
+        self.grace = grace
+        self.retry_after = min(RETRY_BACKOFF * 2 ** retry_number, MAX_RETRY_BACKOFF)
+        self.expires_at = None
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._running = False
+
+    @classmethod
+    def from_environment(cls, plugin, operation, retry_number=0):
+        timeouts = load_timeouts()
+        if not timeouts:
+            return None
+        seconds = timeout(timeouts, plugin, operation)
+        if seconds is None:
+            return None
+        grace = float(os.environ.get(TIMEOUT_GRACE_ENV) or DEFAULT_GRACE)
+        return cls(seconds, grace=grace, retry_number=retry_number)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def remaining(self):
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.time(), 0)
+
+    def error(self):
+        return OperationTimeout(
+            'Operation timed out after {0} seconds'.format(self.timeout),
+            retry_interval=self.retry_after)
+
+    @contextmanager
+    def enforced(self, ctx, task_id=None):
+        """
+        Enforces the deadline on the block, which runs the operation of ``ctx``. ``task_id``
+        allows reporting the timeout to the executor if the operation can't be interrupted.
+        """
+        thread = threading.current_thread()
+        use_signal = hasattr(signal, 'setitimer') and isinstance(thread, threading._MainThread)
+        timers = [threading.Timer(self.timeout, self._cancel)]
+        if not use_signal:
+            timers.append(threading.Timer(self.timeout + self.grace, self._interrupt,
+                                          args=(thread.ident, )))
+        port = os.environ.get(EXECUTOR_PORT_ENV)
+        if task_id is not None and port:
+            timers.append(threading.Timer(self.timeout + 2 * self.grace, self._abandon,
+                                          args=(task_id, int(port), use_signal)))
+
+        _deadlines[ctx] = self
+        self.expires_at = time.time() + self.timeout
+        self._running = True
+        if use_signal:
+            previous_handler = signal.signal(signal.SIGALRM, self._alarm)
+            signal.setitimer(signal.ITIMER_REAL, self.timeout + self.grace)
+        for timer in timers:
+            timer.daemon = True
+            timer.start()
+        try:
+            yield self
+        except TaskRetryException:
+            raise
+        except BaseException:
+            # Whatever the operation failed with once cancelled, it failed since it timed out
+            if self.cancelled:
+                raise self.error()
+            raise
+        finally:
+            with self._lock:
+                self._running = False
+            for timer in timers:
+                timer.cancel()
+            if use_signal:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, previous_handler)
+            _deadlines.pop(ctx, None)
+
+    def _cancel(self):
+        self._cancelled.set()
+
+    def _alarm(self, *_):
+        if self._running:
+            self._cancelled.set()
+            raise DeadlineInterrupt()
+
+    def _interrupt(self, thread_id):
+        with self._lock:
+            if self._running:
+                self._cancelled.set()
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(thread_id),
+                                                           ctypes.py_object(DeadlineInterrupt))
+
+    def _abandon(self, task_id, port, exit_worker):
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+        error = self.error()
+        if bulk.abandon(task_id, error):
+            # The other tasks of the bulk worker were reported too, and won't run
+            os._exit(1)
+        process._Messenger(task_id=task_id, port=port).failed(error)
+        if exit_worker:
+            # The worker runs nothing else, and its operation is stuck in a blocking call
+            os._exit(1)
+
+
+def enabled():
+    return utils.env_path(OPERATION_TIMEOUTS_ENV) is not None
+
+
+def current(ctx):
+    """
+    The deadline enforced on the operation of ``ctx``, if any.
+    """
+    return _deadlines.get(ctx)
+
+
+def load_timeouts():
+    path = utils.env_path(OPERATION_TIMEOUTS_ENV)
+    if path is None:
+        return None
+    return utils.read_json(path)
+
+
+def timeout(timeouts, plugin, operation):
+    """
+    Looks up the timeout of an operation, from the most specific entry of ``timeouts``.
+    """
+    keys = [operation, '*']
+    if plugin:
+        keys[0:0] = ['{0}:{1}'.format(plugin, operation)]
+        keys.insert(-1, plugin)
+    for key in keys:
+        if timeouts.get(key) is not None:
+            return float(timeouts[key])
+    return None
@@ -0,0 +1,192 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Historical operation durations, used as scheduling hints.
+
+Setting ``ARIA_CLOUDIFY_DURATIONS_DB`` to a file path makes every successful operation record its
+duration there, keyed by its translated operation name and node type. The store keeps a rolling
+window of the latest samples per key and serves percentiles out of it.
+:func:`scheduling_hints` turns them into critical path priorities for a workflow's tasks, so that
+tasks heading long chains can be launched first.
+"""
+
+import os
+import time
+import sqlite3
+
+from . import utils
+
+
+DURATIONS_DB_ENV = 'ARIA_CLOUDIFY_DURATIONS_DB'
+
+# Estimate used for operations with no history
+DEFAULT_ESTIMATE = 1.0
+
+
+class DurationStore(object):
+
+    WINDOW = 100
+
+    def __init__(self, path, window=WINDOW):
+        self._path = path
+        self._window = window
+        self._connection = None
+
+    @classmethod
+    def from_environment(cls):
+        path = utils.env_path(DURATIONS_DB_ENV)
+        return cls(path) if path else None
+
+    def record(self, operation, node_type, duration):
+        with self._connect() as connection:
+            connection.execute('INSERT INTO samples (operation, node_type, duration, recorded_at) '
+                               'VALUES (?, ?, ?, ?)',
+                               (operation, node_type or '', duration, time.time()))
+            # Keep a rolling window of samples per key
+            connection.execute('DELETE FROM samples WHERE operation = ? AND node_type = ? AND '
+                               'id NOT IN (SELECT id FROM samples WHERE operation = ? AND '
+                               'node_type = ? ORDER BY id DESC LIMIT ?)',
+                               (operation, node_type or '', operation, node_type or '',
+                                self._window))
+
+    def samples(self, operation, node_type):
+        with self._connect() as connection:
+            return [row[0] for row in connection.execute(
+                'SELECT duration FROM samples WHERE operation = ? AND node_type = ? ORDER BY id',
+                (operation, node_type or ''))]
+
+    def percentile(self, operation, node_type, percent):
+        """
+        Returns the ``percent`` percentile of the recorded durations, or ``None`` if there are
+        none.
+        """
+        return percentile(self.samples(operation, node_type), percent)
+
+    def estimate(self, operation, node_type, percent=50, default=DEFAULT_ESTIMATE):
+        result = self.percentile(operation, node_type, percent)
+        if result is None:
+            # Fall back to the operation's durations on any node type
+            with self._connect() as connection:
+                result = percentile([row[0] for row in connection.execute(
+                    'SELECT duration FROM samples WHERE operation = ?', (operation, ))], percent)
+        return default if result is None else result
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            utils.makedirs(os.path.dirname(os.path.abspath(self._path)))
+            # Workers write concurrently; wait for the database lock rather than fail
+            self._connection = sqlite3.connect(self._path, timeout=30)
+            with self._connection:
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS samples ('
+                    'id INTEGER PRIMARY KEY AUTOINCREMENT, operation TEXT NOT NULL, '
+                    'node_type TEXT NOT NULL, duration REAL NOT NULL, recorded_at REAL NOT NULL)')
+                self._connection.execute(
+                    'CREATE INDEX IF NOT EXISTS samples_key ON samples (operation, node_type)')
+        return self._connection
+
+
+def percentile(values, percent):
+    """
+    Returns the ``percent`` percentile of ``values`` with linear interpolation, or ``None`` if
+    there are no values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * percent / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def critical_path_priorities(tasks):
+    """
+    Computes, for every task, the estimated duration of the longest chain of tasks it heads
+    (itself included). Launching ready tasks by descending priority starts the critical path first.
+
+    :param tasks: dict of task id to ``(estimated duration, ids of the tasks it depends on)``
+    :return: dict of task id to priority
+    """
+    dependents = dict((task_id, []) for task_id in tasks)
+    for task_id, (_, dependencies) in tasks.items():
+        for dependency in dependencies:
+            dependents[dependency].append(task_id)
+
+    priorities = {}
+    for task_id in _reverse_topological_order(tasks, dependents):
+        estimate = tasks[task_id][0]
+        priorities[task_id] = estimate + max(
+            [priorities[dependent] for dependent in dependents[task_id]] or [0])
+    return priorities
+
+
+def scheduling_hints(execution_tasks, store, percent=50):
+    """
+    Returns critical path priorities for the tasks of an ARIA execution, estimating operation
+    durations from ``store``. Stub tasks are estimated to take no time.
+    """
+    tasks = {}
+    for task in execution_tasks:
+        if task._stub_type or not task.function:
+            estimate = 0
+        else:
+            estimate = store.estimate(utils.operation_name(task.name), _node_type(task), percent)
+        tasks[task.id] = (estimate, [dependency.id for dependency in task.dependencies])
+    return critical_path_priorities(tasks)
+
+
+def node_type(ctx):
+    """
+    The type name of the actor of an operation context's task.
+    """
+    return _node_type(ctx.task)
+
+
+def _node_type(task):
+    if task.node is not None:
+        return task.node.node_template.type.name
+    elif task.relationship is not None:
+        return task.relationship.type.name if task.relationship.type else None
+    return None
+
+
+def _reverse_topological_order(tasks, dependents):
+    order = []
+    visited = set()
+    for root in tasks:
+        if root in visited:
+            continue
+        # Iterative post-order traversal, so that long chains don't hit the recursion limit
+        stack = [(root, iter(dependents[root]))]
+        visited.add(root)
+        while stack:
+            task_id, children = stack[-1]
+            for child in children:
+                if child not in visited:
+                    visited.add(child)
+                    stack.append((child, iter(dependents[child])))
+                    break
+            else:
+                stack.pop()
+                order.append(task_id)
+    return order
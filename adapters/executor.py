@@ -0,0 +1,398 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Process executor for workflows running Cloudify plugins.
+
+ARIA's extension points only reach into the operation subprocess, so the features that need the
+dispatching side live in this subclass of ARIA's process executor. Use it wherever
+``ProcessExecutor`` would be used (graph compilation and engine).
+
+ARIA starts a subprocess for every task as soon as it is ready. With ``max_workers`` set, tasks
+beyond that many running ones wait in an admission queue instead, and start as running ones end.
+The queue is ordered by critical path priority when operation durations are recorded (see
+:mod:`adapters.durations`), and first in, first out otherwise.
+
+With ``bulk_size`` set, queued tasks calling the same plugin function are started together, up to
+that many in a single worker process (see :mod:`adapters.bulk`). Since the engine dispatches the
+tasks that became ready together in a burst, tasks are held for ``BULK_WINDOW`` seconds before
+starting to let the burst be grouped. Terminating a task stops its whole worker, and the other
+tasks it was running fail with :class:`WorkerTerminated`.
+
+With service shares configured (see :mod:`adapters.fairshare`), queued tasks start in fair share
+order between services instead, so that a large install can't hold every worker while smaller
+deployments wait. As each execution builds its own executor, the executors on the host take turns
+through shared admission state, and ``max_workers`` still limits the workers of each.
+
+With ``adaptive_workers`` set, the worker limit is adjusted within bounds to what running tasks
+are observed to need (see :mod:`adapters.concurrency`).
+
+With ``input_threshold`` set, operation inputs larger than that many bytes once encoded are passed
+to operation subprocesses in shared blob files, written once for all the tasks and retries with
+the same input (see :mod:`adapters.inputs`).
+"""
+
+import os
+import sys
+import time
+import pickle
+import tempfile
+import shutil
+import itertools
+import threading
+import subprocess
+from collections import namedtuple
+
+from aria.orchestrator.workflows.executor import process
+
+from . import (bulk, concurrency, deadlines, durations, fairshare, inputs, prefetch, versions)
+
+
+MAX_WORKERS_ENV = 'ARIA_CLOUDIFY_MAX_WORKERS'
+BULK_SIZE_ENV = 'ARIA_CLOUDIFY_BULK_SIZE'
+
+# Seconds ready tasks are held to be grouped, under the engine's 0.1 second polling interval
+BULK_WINDOW = 0.05
+
+# A task waiting for a worker. Tasks are started from the engine thread, and from the listener
+# thread as running ones end, so everything a subprocess needs is prepared before queueing.
+_Entry = namedtuple('_Entry', ['priority', 'sequence', 'task_id', 'ctx', 'arguments_path', 'env',
+                               'bulk_key', 'service', 'queued_at'])
+
+
+class WorkerTerminated(Exception):
+    """
+    The worker running a task was stopped to terminate another task it was running.
+    """
+
+
+class CloudifyProcessExecutor(process.ProcessExecutor):
+
+    def __init__(self, prefetch_workers=None, max_workers=None, bulk_size=None,
+                 bulk_threads=None, input_threshold=None, service_shares=None,
+                 adaptive_workers=None, *args, **kwargs):
+        """
+        :param prefetch_workers: number of threads prefetching operation resources into a local
+         cache; defaults to ``ARIA_CLOUDIFY_PREFETCH_WORKERS``, and prefetching is off if 0 or unset
+        :param max_workers: maximum number of operation subprocesses running at once; defaults to
+         ``ARIA_CLOUDIFY_MAX_WORKERS``, and there is no limit if 0 or unset
+        :param bulk_size: maximum number of tasks calling the same plugin function run by a single
+         subprocess; defaults to ``ARIA_CLOUDIFY_BULK_SIZE``, and every task gets a subprocess of
+         its own if 0 or unset
+        :param bulk_threads: number of threads running the tasks of a bulk subprocess, 1 to run
+         them sequentially; defaults to ``ARIA_CLOUDIFY_BULK_THREADS``, or a thread per task
+        :param input_threshold: size in bytes of the encoded operation inputs passed in shared blob
+         files; defaults to ``ARIA_CLOUDIFY_INPUT_BLOB_THRESHOLD``, and inputs are passed with the
+         other task arguments if 0 or unset
+        :param service_shares: service name patterns to their ``weight`` and ``max_workers``
+         shares of the workers; defaults to the content of ``ARIA_CLOUDIFY_SERVICE_SHARES``, and
+         tasks start in priority order regardless of their service if unset
+        :param adaptive_workers: (minimum, maximum) bounds of a worker limit adjusted to the
+         observed load, overriding ``max_workers``; defaults to ``ARIA_CLOUDIFY_ADAPTIVE_WORKERS``
+         (``<minimum>:<maximum>``), and the worker limit is fixed if unset
+        """
+        super(CloudifyProcessExecutor, self).__init__(*args, **kwargs)
+        if max_workers is None:
+            max_workers = int(os.environ.get(MAX_WORKERS_ENV) or 0)
+        self._max_workers = max_workers or None
+        if adaptive_workers is None:
+            self._concurrency = concurrency.ConcurrencyController.from_environment()
+        else:
+            self._concurrency = concurrency.ConcurrencyController(*adaptive_workers)
+        self._usage_dir = None
+        if self._concurrency is not None:
+            self._max_workers = self._concurrency.limit
+            self._usage_dir = tempfile.mkdtemp(prefix='aria-task-usage-')
+        self._versions_dir = versions.create_directory()
+        if bulk_size is None:
+            bulk_size = int(os.environ.get(BULK_SIZE_ENV) or 0)
+        self._bulk_size = bulk_size if bulk_size > 1 else None
+        self._bulk_threads = bulk_threads
+        self._admission_timer = None
+        if service_shares is None:
+            service_shares = fairshare.load_shares()
+        self._host_admission = fairshare.HostAdmission.from_environment(service_shares)
+        if self._host_admission is not None:
+            service_shares = self._host_admission.shares
+        self._pending = fairshare.AdmissionQueue(service_shares)
+        # Task id: service name of started tasks
+        self._task_services = {}
+        self._sequence = itertools.count()
+        self._admission_lock = threading.Lock()
+        self._duration_store = durations.DurationStore.from_environment()
+        # Execution id: dict of task id to critical path priority
+        self._priorities = {}
+        if prefetch_workers is None:
+            prefetch_workers = int(os.environ.get(prefetch.PREFETCH_WORKERS_ENV) or 0)
+        self._prefetcher = prefetch.Prefetcher(workers=prefetch_workers) \
+            if prefetch_workers else None
+        # Execution id: dict of task id to the tasks that depend on it
+        self._dependents = {}
+        if input_threshold is None:
+            self._input_store = inputs.InputStore.from_environment()
+        else:
+            self._input_store = inputs.InputStore(input_threshold) if input_threshold > 0 else None
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    @property
+    def bulk_size(self):
+        return self._bulk_size
+
+    def close(self):
+        with self._admission_lock:
+            pending = self._pending.clear()
+            if self._admission_timer is not None:
+                self._admission_timer.cancel()
+        for entry in pending:
+            _remove(entry.arguments_path)
+        super(CloudifyProcessExecutor, self).close()
+        if self._host_admission is not None:
+            self._host_admission.close()
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+        if self._duration_store is not None:
+            self._duration_store.close()
+        if self._input_store is not None:
+            self._input_store.close()
+        if self._usage_dir is not None:
+            shutil.rmtree(self._usage_dir, ignore_errors=True)
+        shutil.rmtree(self._versions_dir, ignore_errors=True)
+
+    def terminate(self, task_id):
+        with self._admission_lock:
+            pending = self._pending.remove(task_id)
+        for entry in pending:
+            _remove(entry.arguments_path)
+        task = self._tasks.get(task_id)
+        super(CloudifyProcessExecutor, self).terminate(task_id)
+        if task is None:
+            return
+        # Tasks run in bulk end with their worker, and won't report back
+        for other_id, other in list(self._tasks.items()):
+            if other.proc is task.proc:
+                other = self._remove_task(other_id)
+                if other is not None:
+                    self._task_failed(other.ctx, exception=WorkerTerminated(
+                        'Worker stopped to terminate task {0}'.format(task_id)))
+
+    def _execute(self, ctx):
+        self._check_closed()
+        if self._prefetcher is not None:
+            # The task's own resources are fetched while its subprocess starts, and those of
+            # the tasks it unblocks while it runs
+            self._prefetcher.prefetch(ctx)
+            for task in self._get_dependents(ctx.task):
+                self._prefetcher.prefetch(ctx, task)
+
+        # Temporary file used to pass arguments to the started subprocess
+        file_descriptor, arguments_path = tempfile.mkstemp(prefix='executor-', suffix='.json')
+        os.close(file_descriptor)
+        with open(arguments_path, 'wb') as f:
+            f.write(pickle.dumps(self._create_arguments_dict(ctx)))
+        env = self._construct_subprocess_env(task=ctx.task)
+
+        entry = _Entry(priority=self._priority(ctx.task), sequence=next(self._sequence),
+                       task_id=ctx.task.id, ctx=ctx, arguments_path=arguments_path, env=env,
+                       bulk_key=self._bulk_key(ctx.task), service=ctx.service.name,
+                       queued_at=time.time())
+        with self._admission_lock:
+            self._pending.push(entry)
+            if self._bulk_size is None:
+                self._admit()
+            else:
+                self._admit_later(BULK_WINDOW)
+
+    def _remove_task(self, task_id):
+        task = super(CloudifyProcessExecutor, self)._remove_task(task_id)
+        if task is not None:
+            if self._input_store is not None:
+                self._input_store.forget(task_id)
+            limit = self._observe_usage(task_id)
+            with self._admission_lock:
+                if limit is not None:
+                    self._max_workers = limit
+                service = self._task_services.pop(task_id, None)
+                if self._host_admission is not None and service is not None and \
+                        not any(other.proc is task.proc for other in self._tasks.values()):
+                    self._host_admission.release(service)
+                self._admit()
+        return task
+
+    def _observe_usage(self, task_id):
+        """
+        Feeds the usage of a finished task to the concurrency controller; returns the new worker
+        limit, if adaptive.
+        """
+        if self._concurrency is None:
+            return None
+        usage = concurrency.read_usage(self._usage_dir, task_id)
+        if usage is None:
+            return None
+        limit = self._concurrency.observe(*usage)
+        if limit != self._max_workers:
+            self.logger.debug('Worker limit set to {0}'.format(limit))
+        return limit
+
+    def _admit(self):
+        admitted = []
+        while True:
+            available = not self._stopped and \
+                (self._max_workers is None or self._workers() < self._max_workers)
+            if self._host_admission is None:
+                entries = self._pending.pop(self._service_workers(), self._bulk_size) \
+                    if available else []
+            else:
+                # Called without a worker available too, to record that no task waits for one
+                service = self._host_admission.acquire(self._pending.waiting() if available
+                                                       else {})
+                entries = self._pending.pop(bulk_size=self._bulk_size, service=service) \
+                    if service is not None else []
+            if not entries:
+                break
+            arguments_paths = [os.path.expanduser(os.path.expandvars(entry.arguments_path))
+                               for entry in entries]
+            if len(entries) == 1:
+                command = [os.path.expanduser(os.path.expandvars(process.__file__))]
+            else:
+                command = ['-m', bulk.__name__]
+            # Asynchronously start the operations in a subprocess
+            proc = subprocess.Popen([sys.executable] + command + arguments_paths,
+                                    env=entries[0].env)
+            for entry in entries:
+                self._tasks[entry.task_id] = process._Task(ctx=entry.ctx, proc=proc)
+                self._task_services[entry.task_id] = entry.service
+            admitted.extend(entries)
+        if admitted:
+            now = time.time()
+            try:
+                fairshare.observe_waits([(entry.service, now - entry.queued_at)
+                                         for entry in admitted])
+            except BaseException as e:
+                self.logger.debug('Failed recording queue waits: {0}'.format(e))
+        if self._host_admission is not None and len(self._pending) and available:
+            # Tasks wait for workers of other executors to end
+            self._admit_later(fairshare.POLL_INTERVAL)
+
+    def _admit_later(self, delay):
+        if self._admission_timer is None:
+            self._admission_timer = threading.Timer(delay, self._admit_delayed)
+            self._admission_timer.daemon = True
+            self._admission_timer.start()
+
+    def _admit_delayed(self):
+        with self._admission_lock:
+            self._admission_timer = None
+            if not self._stopped:
+                self._admit()
+
+    def _workers(self):
+        # Tasks run in bulk share their worker
+        return len(set(task.proc for task in self._tasks.values()))
+
+    def _service_workers(self):
+        """
+        Service name: number of workers running its tasks, when sharing workers between services.
+        """
+        if self._pending.shares is None:
+            return None
+        procs = {}
+        for task_id, service in self._task_services.items():
+            task = self._tasks.get(task_id)
+            if task is not None:
+                procs.setdefault(service, set()).add(task.proc)
+        return dict((service, len(service_procs)) for service, service_procs in procs.items())
+
+    def _bulk_key(self, task):
+        """
+        Tasks with the same bulk key may run in the same worker: they call the same function, in
+        the same plugin environment.
+        """
+        if self._bulk_size is None:
+            return None
+        return task.function, task.plugin_fk
+
+    def _priority(self, task):
+        """
+        Heap priority of a task: its critical path priority, negated.
+        """
+        if self._max_workers is None or self._duration_store is None:
+            return 0
+        execution_id = task.execution.id
+        priorities = self._priorities.get(execution_id)
+        if priorities is None:
+            priorities = self._priorities[execution_id] = durations.scheduling_hints(
+                task.execution.tasks, self._duration_store)
+        return -priorities.get(task.id, 0)
+
+    def _create_arguments_dict(self, ctx):
+        if self._input_store is None:
+            return super(CloudifyProcessExecutor, self)._create_arguments_dict(ctx)
+        return {
+            'task_id': ctx.task.id,
+            'function': ctx.task.function,
+            'operation_arguments': self._input_store.arguments(ctx.task),
+            'port': self._server_port,
+            'context': ctx.serialization_dict,
+            'strict_loading': self._strict_loading
+        }
+
+    def _construct_subprocess_env(self, task):
+        env = super(CloudifyProcessExecutor, self)._construct_subprocess_env(task)
+        env[deadlines.EXECUTOR_PORT_ENV] = str(self._server_port)
+        env[versions.EXECUTOR_VERSIONS_DIR_ENV] = self._versions_dir
+        if self._usage_dir is not None:
+            env[concurrency.TASK_USAGE_DIR_ENV] = self._usage_dir
+        if self._prefetcher is not None:
+            env[prefetch.RESOURCE_CACHE_ENV] = self._prefetcher.directory
+        if self._bulk_threads is not None:
+            env[bulk.BULK_THREADS_ENV] = str(self._bulk_threads)
+        return env
+
+    def _get_dependents(self, task):
+        """
+        The operation tasks that directly depend on ``task``, looking through stub tasks.
+        """
+        execution_id = task.execution.id
+        dependents = self._dependents.get(execution_id)
+        if dependents is None:
+            dependents = self._dependents[execution_id] = {}
+            for execution_task in task.execution.tasks:
+                for dependency in execution_task.dependencies:
+                    dependents.setdefault(dependency.id, []).append(execution_task)
+
+        result = []
+        visited = set()
+        pending = list(dependents.get(task.id, []))
+        while pending:
+            dependent = pending.pop()
+            if dependent.id in visited:
+                continue
+            visited.add(dependent.id)
+            if dependent._stub_type:
+                pending.extend(dependents.get(dependent.id, []))
+            else:
+                result.append(dependent)
+        return result
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
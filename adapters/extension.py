@@ -14,12 +14,18 @@
 # under the License.
 #
 
+import time
+import datetime
 from functools import wraps
 from contextlib import contextmanager
 
 from aria import extension as aria_extension
+from aria.orchestrator.context import operation
+from aria.orchestrator.exceptions import (TaskAbortException, TaskRetryException)
 
-from .context_adapter import CloudifyContextAdapter
+from . import (checkpoints, concurrency, deadlines, durations, inputs, memory, metrics,
+               recording, records, scratch, tracing, validation, versions)
+from .context_adapter import (CloudifyContextAdapter, OperationAdapter)
 
 
 @aria_extension.process_executor
@@ -29,42 +35,110 @@ class CloudifyExecutorExtension(object):
         def decorator(function):
             @wraps(function)
             def wrapper(ctx, **operation_inputs):
-                # We assume that any Cloudify-based plugin would use the plugins-common, thus two
-                # different paths are created
-                is_cloudify_dependent = ctx.task.plugin and any(
-                    'cloudify_plugins_common' in w for w in ctx.task.plugin.wheels)
-
-                if is_cloudify_dependent:
-                    from cloudify import context
-                    from cloudify.exceptions import (NonRecoverableError, RecoverableError)
-
-                    with ctx.model.instrument(*ctx.INSTRUMENTATION_FIELDS):
-                        # We need to create a new class dynamically, since CloudifyContextAdapter
-                        # doesn't exist at runtime
-                        ctx_adapter = type('_CloudifyContextAdapter',
-                                           (CloudifyContextAdapter, context.CloudifyContext),
-                                           {}, )(ctx)
-
-                        exception = None
-                        with _push_cfy_ctx(ctx_adapter, operation_inputs):
-                            try:
-                                function(ctx=ctx_adapter, **operation_inputs)
-                            except NonRecoverableError as e:
-                                ctx.task.abort(str(e))
-                            except RecoverableError as e:
-                                ctx.task.retry(str(e), retry_interval=e.retry_after)
-                            except BaseException as e:
-                                # Keep exception and raise it outside of "with", because
-                                # contextmanager does not allow raising exceptions
-                                exception = e
-                        if exception is not None:
-                            raise exception
-                else:
-                    function(ctx=ctx, **operation_inputs)
+                operation_inputs.update(
+                    inputs.load(operation_inputs.pop(inputs.BLOB_INPUTS_ARGUMENT, None)))
+                record = records.load(operation_inputs.pop(records.TASK_RECORD_ARGUMENT, None))
+                if versions.enabled():
+                    versions.track_writes()
+                with _operation_scope(ctx, record):
+                    _run_memoized(function, ctx, operation_inputs, record)
             return wrapper
         return decorator
 
 
+@contextmanager
+def _operation_scope(ctx, record):
+    """
+    Everything operations run within, outermost first.
+    """
+    with concurrency.usage_report(ctx.task.id, ctx.model):
+        with _record_outcome(ctx, record):
+            with _trace_operation(ctx, record):
+                with _track_memory(ctx, record):
+                    with _manage_scratch(ctx):
+                        with _settle_checkpoints(ctx, record):
+                            with _enforce_deadline(ctx, record):
+                                yield
+
+
+def _run_memoized(function, ctx, operation_inputs, record=None):
+    cache = validation.ValidationCache.from_environment()
+    memoized = _validation(ctx, operation_inputs, record) if cache is not None else None
+    if memoized is not None:
+        key, details = memoized
+        entry = cache.get(key)
+        if entry is not None:
+            ctx.logger.info(
+                'Skipping {0}: it succeeded with the same node properties and plugin at {1}'
+                .format(details['operation'],
+                        datetime.datetime.utcfromtimestamp(entry['validated_at']).isoformat()))
+            return
+
+    _run_operation(function, ctx, operation_inputs, record)
+    if memoized is not None:
+        cache.add(key, **details)
+
+
+def _validation(ctx, operation_inputs, record):
+    """
+    The validation cache key and details of the operation, if it is a node creation validation.
+    """
+    function = ctx.task.function
+    operation_name = OperationAdapter(ctx, record).name
+    if not isinstance(ctx, operation.NodeOperationContext) or \
+            not validation.is_validation(function, operation_name):
+        return None
+    plugin = ctx.task.plugin
+    details = {'operation': operation_name,
+               'node': ctx.node.name,
+               'package_name': plugin.package_name if plugin else None,
+               'package_version': plugin.package_version if plugin else None}
+    properties = dict((name, prop.value) for name, prop in ctx.node.properties.items())
+    key = validation.key(function, operation_name, details['package_name'],
+                         details['package_version'], properties, operation_inputs)
+    return key, details
+
+
+def _run_operation(function, ctx, operation_inputs, record=None):
+    # We assume that any Cloudify-based plugin would use the plugins-common, thus two
+    # different paths are created
+    is_cloudify_dependent = ctx.task.plugin and any(
+        'cloudify_plugins_common' in w for w in ctx.task.plugin.wheels)
+
+    if is_cloudify_dependent:
+        from cloudify import context
+        from cloudify.exceptions import (NonRecoverableError, RecoverableError)
+
+        with ctx.model.instrument(*ctx.INSTRUMENTATION_FIELDS):
+            recorder = recording.Recorder.from_environment(ctx.task.function, operation_inputs)
+            bases = (CloudifyContextAdapter, context.CloudifyContext)
+            if recorder is not None:
+                bases = (recording.RecordingAdapterMixin, ) + bases
+            # We need to create a new class dynamically, since CloudifyContextAdapter
+            # doesn't exist at runtime
+            adapter_cls = type('_CloudifyContextAdapter', bases, {'_recorder': recorder}, )
+            ctx_adapter = adapter_cls(ctx, record)
+
+            with _record_interactions(ctx, recorder):
+                exception = None
+                with tracing.traced_context('_push_cfy_ctx',
+                                            _push_cfy_ctx(ctx_adapter, operation_inputs)):
+                    try:
+                        function(ctx=ctx_adapter, **operation_inputs)
+                    except NonRecoverableError as e:
+                        ctx.task.abort(str(e))
+                    except RecoverableError as e:
+                        ctx.task.retry(str(e), retry_interval=e.retry_after)
+                    except BaseException as e:
+                        # Keep exception and raise it outside of "with", because
+                        # contextmanager does not allow raising exceptions
+                        exception = e
+                if exception is not None:
+                    raise exception
+    else:
+        function(ctx=ctx, **operation_inputs)
+
+
 @contextmanager
 def _push_cfy_ctx(ctx, params):
     from cloudify import state
@@ -90,3 +164,155 @@ def _push_cfy_ctx(ctx, params):
             yield state.current_ctx.get_ctx()
         finally:
             state.current_ctx.set(original_ctx, original_params)
+
+
+@contextmanager
+def _record_outcome(ctx, record):
+    metrics_store = metrics.MetricsStore.from_environment()
+    durations_store = durations.DurationStore.from_environment()
+    if metrics_store is None and durations_store is None:
+        yield
+        return
+
+    outcome = metrics.SUCCESS
+    start = time.time()
+    try:
+        yield
+    except BaseException as e:
+        outcome = _outcome(e)
+        raise
+    finally:
+        duration = time.time() - start
+        # Recording must never change the outcome of the operation itself
+        try:
+            if metrics_store is not None:
+                plugin = ctx.task.plugin
+                metrics_store.record_operation(plugin=plugin.name if plugin else None,
+                                               operation=OperationAdapter(ctx, record).name,
+                                               outcome=outcome,
+                                               duration=duration)
+        except BaseException as e:
+            ctx.logger.debug('Failed recording operation metrics: {0}'.format(e))
+        try:
+            # Failed attempts would skew the estimates of how long operations take
+            if durations_store is not None and outcome == metrics.SUCCESS:
+                durations_store.record(operation=OperationAdapter(ctx, record).name,
+                                       node_type=durations.node_type(ctx),
+                                       duration=duration)
+                durations_store.close()
+        except BaseException as e:
+            ctx.logger.debug('Failed recording operation duration: {0}'.format(e))
+
+
+@contextmanager
+def _trace_operation(ctx, record):
+    if not tracing.enabled():
+        yield
+        return
+
+    task = ctx.task
+    args = {'execution_id': task.execution.id, 'task_id': task.id}
+    if task.node:
+        args['node_id'] = task.node.id
+    elif task.relationship:
+        args.update(relationship_id=task.relationship.id,
+                    source_node_id=task.relationship.source_node.id,
+                    target_node_id=task.relationship.target_node.id)
+    with tracing.operation_span(OperationAdapter(ctx, record).name, **args):
+        yield
+
+
+@contextmanager
+def _track_memory(ctx, record):
+    tracker = memory.MemoryTracker.from_environment()
+    if tracker is None:
+        yield
+        return
+
+    with tracker.track(OperationAdapter(ctx, record).name, task_id=ctx.task.id,
+                       logger=ctx.logger):
+        yield
+
+
+@contextmanager
+def _manage_scratch(ctx):
+    space = scratch.ScratchSpace.from_environment()
+    if space is None:
+        yield
+        return
+
+    with space.managed(ctx):
+        yield
+
+
+@contextmanager
+def _settle_checkpoints(ctx, record):
+    """
+    Removes the checkpoints of the operation unless it is to be attempted again.
+    """
+    if not checkpoints.available(ctx):
+        yield
+        return
+
+    try:
+        yield
+    except TaskRetryException:
+        raise
+    except TaskAbortException:
+        checkpoints.Checkpoints.of(ctx).clear()
+        raise
+    except BaseException:
+        operation_adapter = OperationAdapter(ctx, record)
+        if operation_adapter.max_retries != ctx.task.INFINITE_RETRIES and \
+                operation_adapter.retry_number >= operation_adapter.max_retries:
+            checkpoints.Checkpoints.of(ctx).clear()
+        raise
+    else:
+        checkpoints.Checkpoints.of(ctx).clear()
+
+
+@contextmanager
+def _enforce_deadline(ctx, record):
+    if not deadlines.enabled():
+        yield
+        return
+
+    plugin = ctx.task.plugin
+    operation_adapter = OperationAdapter(ctx, record)
+    deadline = deadlines.Deadline.from_environment(plugin=plugin.name if plugin else None,
+                                                   operation=operation_adapter.name,
+                                                   retry_number=operation_adapter.retry_number)
+    if deadline is None:
+        yield
+        return
+    with deadline.enforced(ctx, task_id=ctx.task.id):
+        yield
+
+
+@contextmanager
+def _record_interactions(ctx, recorder):
+    if recorder is None:
+        yield
+        return
+
+    try:
+        yield
+    except BaseException as e:
+        recorder.finish(_outcome(e), message=str(e))
+        raise
+    else:
+        recorder.finish(metrics.SUCCESS)
+    finally:
+        try:
+            recorder.save('{0}-{1}'.format(ctx.task.id, ctx.task.attempts_count))
+        except BaseException as e:
+            ctx.logger.debug('Failed saving operation recording: {0}'.format(e))
+
+
+def _outcome(exception):
+    if isinstance(exception, TaskAbortException):
+        return metrics.ABORT
+    elif isinstance(exception, TaskRetryException):
+        return metrics.RETRY
+    else:
+        return metrics.ERROR
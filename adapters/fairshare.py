@@ -0,0 +1,305 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Fair sharing of executor workers between services.
+
+When many services run on the same executor, a large install can take every worker while the
+tasks of small deployments wait behind it. Set ``ARIA_CLOUDIFY_SERVICE_SHARES`` to a JSON file
+mapping service names to shares, e.g.::
+
+    {"*": {"weight": 1, "max_workers": 16},
+     "production-*": {"weight": 4}}
+
+and :class:`AdmissionQueue` keeps the tasks waiting for a worker in a queue per service, starting
+the next task from the service with the fewest workers for its ``weight`` (1 by default), and
+never from one already running ``max_workers`` workers (no limit by default). Keys may be
+shell-style patterns, and the longest matching key applies. Within a service, tasks keep their
+critical path priority order.
+
+Each ARIA execution builds an executor of its own, so services share the host's workers between
+executors rather than within one. With shares configured, the executors on a host coordinate
+through :class:`HostAdmission`: they record the workers they run by service and the services they
+have tasks waiting for in a state file in ``ARIA_CLOUDIFY_ADMISSION_DIR`` (a directory in the
+system temporary directory by default), updated under a file lock, and the next worker on the host
+goes to the waiting service with the fewest workers on the host for its weight. ``max_workers``
+shares then hold for the host, and ``ARIA_CLOUDIFY_HOST_WORKERS`` limits the number of workers of
+all the executors on the host (no limit by default; setting it also turns coordination on without
+shares). Executors waiting on other executors check for a free worker every ``POLL_INTERVAL``
+seconds.
+
+Time tasks wait for a worker is observed in the ``aria_cloudify_queue_wait_seconds`` histogram,
+by service, when metrics are enabled.
+"""
+
+import os
+import time
+import heapq
+import fnmatch
+import tempfile
+import itertools
+from contextlib import contextmanager
+
+from . import (metrics, utils)
+
+
+SERVICE_SHARES_ENV = 'ARIA_CLOUDIFY_SERVICE_SHARES'
+ADMISSION_DIR_ENV = 'ARIA_CLOUDIFY_ADMISSION_DIR'
+HOST_WORKERS_ENV = 'ARIA_CLOUDIFY_HOST_WORKERS'
+
+# Seconds between attempts of executors waiting for a worker freed by other executors
+POLL_INTERVAL = 0.1
+
+QUEUE_WAIT_SECONDS = 'aria_cloudify_queue_wait_seconds'
+
+metrics.register(QUEUE_WAIT_SECONDS, metrics.HISTOGRAM,
+                 'Time operation tasks spent waiting for a worker.')
+
+_executor_ids = itertools.count()
+
+
+class AdmissionQueue(object):
+    """
+    Tasks waiting for a worker. Entries are ordered tuples with ``sequence``, ``task_id``,
+    ``service``, ``bulk_key`` and ``queued_at`` attributes.
+    """
+
+    def __init__(self, shares=None):
+        """
+        :param shares: service name patterns to shares, or ``None`` to keep all the tasks in a
+         single queue
+        """
+        self._shares = shares
+        # Service (None without shares): heap of entries
+        self._queues = {}
+
+    @property
+    def shares(self):
+        return self._shares
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def push(self, entry):
+        key = entry.service if self._shares is not None else None
+        heapq.heappush(self._queues.setdefault(key, []), entry)
+
+    def waiting(self):
+        """
+        Service names to the time the next task of the service to start was queued.
+        """
+        return dict((key, queue[0].queued_at) for key, queue in self._queues.items())
+
+    def pop(self, workers=None, bulk_size=None, service=None):
+        """
+        Removes the next task to start from the queue, along with up to ``bulk_size - 1`` tasks
+        of the same service with the same bulk key, in priority order.
+
+        :param workers: service names to the number of workers they are running
+        :param service: service to start the task of, rather than the one whose turn it is
+        :return: list of entries, empty if no task may start
+        """
+        if service is not None:
+            selected = (service, self._queues[service]) if service in self._queues else None
+        else:
+            selected = self._next(workers or {})
+        if selected is None:
+            return []
+        key, queue = selected
+        entries = [heapq.heappop(queue)]
+        if bulk_size and bulk_size > 1:
+            bulk = sorted(entry for entry in queue
+                          if entry.bulk_key == entries[0].bulk_key)[:bulk_size - 1]
+            if bulk:
+                task_ids = set(entry.task_id for entry in bulk)
+                queue[:] = [entry for entry in queue if entry.task_id not in task_ids]
+                heapq.heapify(queue)
+                entries.extend(bulk)
+        if not queue:
+            del self._queues[key]
+        return entries
+
+    def remove(self, task_id):
+        """
+        Removes the queued entries of ``task_id`` and returns them.
+        """
+        removed = []
+        for key, queue in self._queues.items():
+            entries = [entry for entry in queue if entry.task_id == task_id]
+            if entries:
+                removed.extend(entries)
+                queue[:] = [entry for entry in queue if entry.task_id != task_id]
+                heapq.heapify(queue)
+                if not queue:
+                    del self._queues[key]
+        return removed
+
+    def clear(self):
+        """
+        Empties the queue and returns its entries.
+        """
+        queues, self._queues = self._queues, {}
+        return [entry for queue in queues.values() for entry in queue]
+
+    def _next(self, workers):
+        if self._shares is None:
+            return (None, self._queues[None]) if None in self._queues else None
+        best = None
+        for service, queue in self._queues.items():
+            weight, max_workers = share(self._shares, service)
+            running = workers.get(service, 0)
+            if max_workers is not None and running >= max_workers:
+                continue
+            # Fewest workers for the weight first, then the longest waiting
+            rank = (float(running) / weight, queue[0].sequence)
+            if best is None or rank < best[0]:
+                best = rank, (service, queue)
+        return best[1] if best is not None else None
+
+
+class HostAdmission(object):
+    """
+    Worker admission shared by the executors on a host.
+    """
+
+    # Seconds after which the waiting services an executor recorded are ignored, unless recorded
+    # again
+    STALE_AFTER = 5
+
+    def __init__(self, directory, shares=None, max_workers=None):
+        """
+        :param directory: directory of the state file
+        :param shares: service name patterns to shares
+        :param max_workers: maximum number of workers of all the executors
+        """
+        self._path = os.path.join(directory, 'admission.json')
+        self._lock_path = os.path.join(directory, 'admission.lock')
+        self._shares = shares or {}
+        self._max_workers = max_workers
+        self._id = '{0}-{1}'.format(os.getpid(), next(_executor_ids))
+
+    @classmethod
+    def from_environment(cls, shares):
+        max_workers = int(os.environ.get(HOST_WORKERS_ENV) or 0) or None
+        if shares is None and max_workers is None:
+            return None
+        directory = utils.env_path(ADMISSION_DIR_ENV) or \
+            os.path.join(tempfile.gettempdir(), 'aria-cloudify-admission')
+        return cls(directory, shares, max_workers)
+
+    @property
+    def shares(self):
+        return self._shares
+
+    def acquire(self, waiting):
+        """
+        Records the services the executor has tasks waiting for, and takes a worker for the
+        service whose task starts next on the host, if it is one of them.
+
+        :param waiting: service names to the time their next task was queued
+        :return: service name, or ``None`` if no task of the executor may start
+        """
+        with self._state() as executors:
+            now = time.time()
+            own = executors.setdefault(self._id, {'workers': {}})
+            own.update(pid=os.getpid(), updated=now, waiting=waiting)
+            workers = {}
+            for executor in executors.values():
+                for service, count in executor['workers'].items():
+                    workers[service] = workers.get(service, 0) + count
+            if self._max_workers is not None and sum(workers.values()) >= self._max_workers:
+                return None
+            best = None
+            for executor_id, executor in executors.items():
+                if now - executor['updated'] > self.STALE_AFTER:
+                    continue
+                for service, queued_at in executor['waiting'].items():
+                    weight, max_workers = share(self._shares, service)
+                    running = workers.get(service, 0)
+                    if max_workers is not None and running >= max_workers:
+                        continue
+                    # Executors only take turns for limited workers
+                    if executor_id != self._id and \
+                            self._max_workers is None and max_workers is None:
+                        continue
+                    # Fewest workers for the weight first, then the longest waiting
+                    rank = (float(running) / weight, queued_at)
+                    if best is None or rank < best[0]:
+                        best = rank, executor_id, service
+            if best is None or best[1] != self._id:
+                return None
+            service = best[2]
+            own['workers'][service] = own['workers'].get(service, 0) + 1
+            return service
+
+    def release(self, service):
+        """
+        Gives back a worker of ``service`` taken by the executor.
+        """
+        with self._state() as executors:
+            own = executors.get(self._id)
+            if own is None:
+                return
+            count = own['workers'].get(service, 0) - 1
+            if count > 0:
+                own['workers'][service] = count
+            else:
+                own['workers'].pop(service, None)
+
+    def close(self):
+        with self._state() as executors:
+            executors.pop(self._id, None)
+
+    @contextmanager
+    def _state(self):
+        with utils.file_lock(self._lock_path):
+            # Executors of processes that died hold no workers anymore
+            executors = dict((key, value) for key, value
+                             in (utils.read_json(self._path, default=None) or {}).items()
+                             if utils.process_alive(value['pid']))
+            yield executors
+            utils.write_json(self._path, executors)
+
+
+def load_shares():
+    path = utils.env_path(SERVICE_SHARES_ENV)
+    if path is None:
+        return None
+    return utils.read_json(path)
+
+
+def share(shares, service):
+    """
+    The weight and worker limit (``None`` for no limit) of ``service``, from the longest key of
+    ``shares`` matching its name.
+    """
+    matching = [key for key in shares if fnmatch.fnmatchcase(service, key)]
+    if not matching:
+        return 1.0, None
+    entry = shares[max(matching, key=len)]
+    return float(entry.get('weight') or 1), entry.get('max_workers') or None
+
+
+def observe_waits(waits):
+    """
+    Observes the time tasks waited for a worker, given (service name, seconds) pairs.
+    """
+    store = metrics.MetricsStore.from_environment()
+    if store is None or not waits:
+        return
+    with store.batch() as batch:
+        for service, waited in waits:
+            batch.observe(QUEUE_WAIT_SECONDS, {'service': service}, waited)
@@ -0,0 +1,156 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Compact transport of large operation inputs.
+
+ARIA's process executor pickles the arguments of every task into a file (with the text protocol)
+that the operation subprocess reads back whole, and does it again for every retry. Large inputs,
+such as the AWS plugin's ``RunInstancesParameters`` with their block device mappings and network
+interfaces, make that a noticeable part of dispatching.
+
+:class:`InputStore` encodes the inputs larger than a threshold once, with the binary pickle
+protocol, into content-addressed blob files, shared by all the tasks (and retries) with the same
+encoded input. Tasks ship references to their blobs in a reserved argument, and the extension maps
+the blobs and decodes them in the operation subprocess as the operation starts (eagerly: operations
+get their inputs as plain keyword arguments, which lazy proxies would not pass for). Arguments
+reserved for the extension itself, such as the task record, are always passed as usual.
+"""
+
+import os
+import sys
+import mmap
+import shutil
+import hashlib
+import tempfile
+import threading
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from . import (records, utils)
+
+
+INPUT_BLOB_THRESHOLD_ENV = 'ARIA_CLOUDIFY_INPUT_BLOB_THRESHOLD'
+
+# Reserved task argument name; the extension takes it out of the operation inputs
+BLOB_INPUTS_ARGUMENT = '_cloudify_blob_inputs'
+
+# Marks arguments below the threshold, which are passed as usual
+_INLINE = object()
+
+# Arguments the extension takes out before loading the blobs
+_RESERVED_ARGUMENTS = frozenset([records.TASK_RECORD_ARGUMENT, BLOB_INPUTS_ARGUMENT])
+
+
+class InputStore(object):
+
+    def __init__(self, threshold, directory=None):
+        """
+        :param threshold: size in bytes of the encoded inputs that are passed in blobs
+        :param directory: directory of the blob files, removed on :meth:`close`; defaults to a new
+         temporary directory
+        """
+        self._threshold = threshold
+        self._directory = directory or tempfile.mkdtemp(prefix='aria-inputs-')
+        self._lock = threading.Lock()
+        # task id: {argument name: blob reference, or _INLINE}, until the task is forgotten. Task
+        # arguments don't change between attempts, so retries dispatched meanwhile reuse them.
+        self._references = {}
+        self._digests = set()
+
+    @classmethod
+    def from_environment(cls):
+        threshold = int(os.environ.get(INPUT_BLOB_THRESHOLD_ENV) or 0)
+        if threshold <= 0:
+            return None
+        return cls(threshold)
+
+    @property
+    def threshold(self):
+        return self._threshold
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def arguments(self, task):
+        """
+        The operation arguments of ``task``, with those larger than the threshold replaced by a
+        reference to their blob in the ``BLOB_INPUTS_ARGUMENT`` argument.
+        """
+        arguments = {}
+        references = {}
+        with self._lock:
+            task_references = self._references.setdefault(task.id, {})
+        for name, argument in task.arguments.iteritems():
+            if name in _RESERVED_ARGUMENTS:
+                arguments[name] = argument.value
+                continue
+            reference = task_references.get(name)
+            if reference is None:
+                reference = task_references[name] = self._encode(argument.value)
+            if reference is _INLINE:
+                arguments[name] = argument.value
+            else:
+                references[name] = reference
+        if references:
+            arguments[BLOB_INPUTS_ARGUMENT] = references
+        return arguments
+
+    def forget(self, task_id):
+        """
+        Drops the references kept for the task ``task_id``; its blobs stay until :meth:`close`, as
+        other tasks may share them.
+        """
+        with self._lock:
+            self._references.pop(task_id, None)
+
+    def close(self):
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def _encode(self, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) < self._threshold:
+            return _INLINE
+        digest = hashlib.sha1(data).hexdigest()
+        path = os.path.join(self._directory, digest)
+        with self._lock:
+            if digest not in self._digests:
+                utils.write_atomic(path, data)
+                self._digests.add(digest)
+        return {'path': path, 'size': len(data)}
+
+
+def load(references):
+    """
+    Decodes the blob inputs of a task, given the value of its ``BLOB_INPUTS_ARGUMENT`` argument.
+    """
+    if not references:
+        return {}
+    return dict((name, _decode(reference['path'])) for name, reference in references.items())
+
+
+def _decode(path):
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        # Python 3 unpickles straight from the mapped pages, Python 2 needs them as a string
+        return pickle.loads(mapped if sys.version_info[0] >= 3 else mapped[:])
+    finally:
+        mapped.close()
@@ -0,0 +1,211 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Memory growth tracking per operation.
+
+Set ``ARIA_CLOUDIFY_MEMORY_REPORT`` to a file path to measure how much memory every operation leaves
+behind in its worker, e.g. cached clients or module-level dicts a plugin keeps growing. Each
+operation appends a JSON line to the report with its operation name, its net memory growth, the
+top allocation sites behind it and the memory the worker retains afterwards. When the memory
+retained by a worker grows across its last ``TREND_WINDOW`` tasks (which happens with workers
+running several tasks, see :mod:`adapters.bulk`), the line is flagged with ``"trend": true`` and a
+warning is logged. :func:`summarize` aggregates a report by operation.
+
+Allocations are traced with ``tracemalloc`` when it is available (allocation sites are then source
+lines). Otherwise, garbage collected objects and the objects they refer to are counted by type
+before and after the operation (allocation sites are then object types, and sizes are shallow).
+
+Either way, measurements cover the whole worker, so tracked operations run one at a time in a
+worker: the tasks of a bulk worker (see :mod:`adapters.bulk`) run sequentially while memory is
+tracked, whatever the number of threads.
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from . import utils
+
+
+MEMORY_REPORT_ENV = 'ARIA_CLOUDIFY_MEMORY_REPORT'
+
+TOP_SITES = 10
+TREND_WINDOW = 5
+# Retained memory growth across the trend window that is worth a warning, in bytes
+TREND_THRESHOLD = 1024 * 1024
+
+# Memory retained by this worker after each of its tasks
+_retained = []
+# Held by the operation being tracked
+_tracking = threading.RLock()
+
+
+class MemoryTracker(object):
+
+    def __init__(self, report_path):
+        self._report_path = report_path
+
+    @classmethod
+    def from_environment(cls):
+        report_path = utils.env_path(MEMORY_REPORT_ENV)
+        if report_path is None:
+            return None
+        return cls(report_path)
+
+    @property
+    def backend(self):
+        return 'tracemalloc' if tracemalloc is not None else 'gc'
+
+    @contextmanager
+    def track(self, operation, task_id=None, logger=None):
+        """
+        Measures the memory growth of the block, which runs ``operation``, and reports it. Waits
+        for operations tracked by other threads to end first.
+        """
+        with _tracking:
+            with self._track(operation, task_id, logger):
+                yield
+
+    @contextmanager
+    def _track(self, operation, task_id, logger):
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        rss_before = _rss()
+        before = self._snapshot()
+        try:
+            yield
+        finally:
+            after = self._snapshot(before)
+            growth, sites, retained = self._compare(before, after)
+            _retained.append(retained)
+            record = {
+                'operation': operation,
+                'task_id': task_id,
+                'pid': os.getpid(),
+                'time': time.time(),
+                'backend': self.backend,
+                'growth': growth,
+                'retained': retained,
+                'rss_growth': _difference(_rss(), rss_before),
+                'top': sites,
+                'trend': _trending(_retained)
+            }
+            with utils.file_lock(self._report_path + '.lock'):
+                with open(self._report_path, 'ab') as f:
+                    f.write(json.dumps(record) + '\n')
+            if record['trend'] and logger is not None:
+                logger.warning(
+                    'Memory retained by worker {0} grew by {1} bytes over its last {2} tasks'
+                    .format(record['pid'], _retained[-1] - _retained[-TREND_WINDOW], TREND_WINDOW))
+
+    def _snapshot(self, previous=None):
+        """
+        :param previous: snapshot whose own objects are left out
+        """
+        gc.collect()
+        if tracemalloc is not None:
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__.replace('.pyc', '.py'))))
+            return snapshot, tracemalloc.get_traced_memory()[0]
+        # Objects that can't hold references (strings, numbers...) and containers holding only
+        # such objects aren't tracked by the collector, so the objects tracked ones refer to are
+        # counted as well
+        sizes = {}
+        seen = set()
+        if previous is not None:
+            seen.update(id(obj) for obj in (previous, previous[0]))
+            for entry in previous[0].values():
+                seen.update(id(obj) for obj in [entry] + entry)
+        for tracked in gc.get_objects():
+            for obj in [tracked] + gc.get_referents(tracked):
+                if id(obj) in seen:
+                    continue
+                seen.add(id(obj))
+                entry = sizes.setdefault(type(obj).__name__, [0, 0])
+                entry[0] += 1
+                entry[1] += sys.getsizeof(obj, 0)
+        return sizes, sum(size for _, size in sizes.values())
+
+    def _compare(self, before, after):
+        """
+        Returns the net growth, the top allocation sites as ``[site, size, count]`` growths, and
+        the retained memory.
+        """
+        (before, before_total), (after, after_total) = before, after
+        if tracemalloc is not None:
+            sites = [[str(stat.traceback[0]), stat.size_diff, stat.count_diff]
+                     for stat in after.compare_to(before, 'lineno')[:TOP_SITES]
+                     if stat.size_diff]
+        else:
+            sites = []
+            for name, (count, size) in after.items():
+                before_count, before_size = before.get(name, (0, 0))
+                if size != before_size:
+                    sites.append([name, size - before_size, count - before_count])
+            sites = sorted(sites, key=lambda site: site[1], reverse=True)[:TOP_SITES]
+        return after_total - before_total, sites, after_total
+
+
+def summarize(report_path):
+    """
+    Aggregates a memory report by operation: the number of tasks, their total and mean growth,
+    and how many of them were flagged with an upward trend.
+    """
+    summary = {}
+    with open(report_path, 'rb') as f:
+        for line in f:
+            record = json.loads(line)
+            entry = summary.setdefault(record['operation'],
+                                       {'tasks': 0, 'growth': 0, 'trends': 0})
+            entry['tasks'] += 1
+            entry['growth'] += record['growth']
+            entry['trends'] += 1 if record['trend'] else 0
+    for entry in summary.values():
+        entry['mean_growth'] = float(entry['growth']) / entry['tasks']
+    return summary
+
+
+def _trending(retained):
+    window = retained[-TREND_WINDOW:]
+    if len(window) < TREND_WINDOW:
+        return False
+    return all(later >= earlier for earlier, later in zip(window, window[1:])) and \
+        window[-1] - window[0] >= TREND_THRESHOLD
+
+
+def _rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def _difference(after, before):
+    if after is None or before is None:
+        return None
+    return after - before
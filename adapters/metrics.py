@@ -0,0 +1,230 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Operation metrics, aggregated across worker processes and exported in the Prometheus text
+exposition format.
+
+Every operation runs in its own process executor subprocess, so metrics are kept in a state file
+that all the workers on the host update under a file lock. No external service is involved.
+Setting ``ARIA_CLOUDIFY_METRICS_DIR`` enables collection, and setting
+``ARIA_CLOUDIFY_METRICS_TEXTFILE`` additionally re-exports the metrics to that file after every
+update (e.g. for the node exporter textfile collector). :func:`serve` exposes the same data on a
+local HTTP endpoint.
+"""
+
+import os
+import json
+import threading
+import BaseHTTPServer
+from contextlib import contextmanager
+
+from . import utils
+
+
+METRICS_DIR_ENV = 'ARIA_CLOUDIFY_METRICS_DIR'
+METRICS_TEXTFILE_ENV = 'ARIA_CLOUDIFY_METRICS_TEXTFILE'
+
+SUCCESS = 'success'
+ABORT = 'abort'
+RETRY = 'retry'
+ERROR = 'error'
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+OPERATIONS_TOTAL = 'aria_cloudify_operations_total'
+OPERATION_RETRIES_TOTAL = 'aria_cloudify_operation_retries_total'
+OPERATION_DURATION_SECONDS = 'aria_cloudify_operation_duration_seconds'
+NODE_INSTANCE_CONFLICTS_TOTAL = 'aria_cloudify_node_instance_conflicts_total'
+
+_METRICS = {
+    OPERATIONS_TOTAL: (COUNTER, 'Operations executed, by outcome.'),
+    OPERATION_RETRIES_TOTAL: (COUNTER, 'Operation attempts that ended with a retry request.'),
+    OPERATION_DURATION_SECONDS: (HISTOGRAM, 'Operation wall-clock duration.'),
+    NODE_INSTANCE_CONFLICTS_TOTAL: (COUNTER, 'Node instance updates that hit a version conflict.'),
+}
+
+
+def register(name, type_, description):
+    """
+    Registers the type and help text of a metric, so it is rendered properly.
+    """
+    _METRICS[name] = (type_, description)
+
+
+class MetricsStore(object):
+
+    STATE_FILE = 'metrics.json'
+    LOCK_FILE = 'metrics.lock'
+
+    def __init__(self, directory, textfile=None):
+        self._directory = directory
+        self._textfile = textfile
+        self._state_path = os.path.join(directory, self.STATE_FILE)
+        self._lock_path = os.path.join(directory, self.LOCK_FILE)
+
+    @classmethod
+    def from_environment(cls):
+        directory = utils.env_path(METRICS_DIR_ENV)
+        if directory is None:
+            return None
+        return cls(directory, textfile=utils.env_path(METRICS_TEXTFILE_ENV))
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @contextmanager
+    def batch(self):
+        """
+        Applies all the updates made in the block in a single locked read-modify-write cycle.
+        """
+        with utils.file_lock(self._lock_path):
+            batch = _Batch(self.load())
+            yield batch
+            utils.write_json(self._state_path, batch.state)
+            if self._textfile:
+                utils.write_atomic(self._textfile, render(batch.state))
+
+    def inc(self, name, labels, value=1):
+        with self.batch() as batch:
+            batch.inc(name, labels, value)
+
+    def observe(self, name, labels, value, buckets=DURATION_BUCKETS):
+        with self.batch() as batch:
+            batch.observe(name, labels, value, buckets)
+
+    def record_operation(self, plugin, operation, outcome, duration):
+        labels = {'plugin': plugin or '', 'operation': operation}
+        with self.batch() as batch:
+            batch.inc(OPERATIONS_TOTAL, dict(labels, outcome=outcome))
+            batch.observe(OPERATION_DURATION_SECONDS, labels, duration)
+            if outcome == RETRY:
+                batch.inc(OPERATION_RETRIES_TOTAL, labels)
+
+    def load(self):
+        return utils.read_json(self._state_path, default=None) or {}
+
+    def render(self):
+        return render(self.load())
+
+    def write_textfile(self, path):
+        utils.write_atomic(path, self.render())
+
+
+class _Batch(object):
+
+    def __init__(self, state):
+        self.state = state
+
+    def inc(self, name, labels, value=1):
+        series = self.state.setdefault(name, {})
+        key = _labels_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets=DURATION_BUCKETS):
+        series = self.state.setdefault(name, {})
+        key = _labels_key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = {'le': list(buckets),
+                                       'buckets': [0] * len(buckets),
+                                       'sum': 0.0,
+                                       'count': 0}
+        for index, bound in enumerate(histogram['le']):
+            if value <= bound:
+                histogram['buckets'][index] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+def render(state):
+    """
+    Renders metrics state in the Prometheus text exposition format (version 0.0.4).
+    """
+    lines = []
+    for name in sorted(state):
+        type_, description = _METRICS.get(name, (COUNTER, ''))
+        lines.append('# HELP {0} {1}'.format(name, description))
+        lines.append('# TYPE {0} {1}'.format(name, type_))
+        for key in sorted(state[name]):
+            labels = _labels_from_key(key)
+            value = state[name][key]
+            if type_ == HISTOGRAM:
+                for bound, count in zip(value['le'], value['buckets']):
+                    lines.append(_sample(name + '_bucket', labels + [('le', _format(bound))],
+                                         count))
+                lines.append(_sample(name + '_bucket', labels + [('le', '+Inf')],
+                                     value['count']))
+                lines.append(_sample(name + '_sum', labels, value['sum']))
+                lines.append(_sample(name + '_count', labels, value['count']))
+            else:
+                lines.append(_sample(name, labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+def serve(store, port=0, host='127.0.0.1'):
+    """
+    Serves the metrics of ``store`` over HTTP from a daemon thread, and returns the server (its
+    ``server_port`` attribute holds the bound port).
+    """
+    class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            body = store.render()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer((host, port), _Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def _labels_key(labels):
+    return json.dumps(sorted(labels.items()))
+
+
+def _labels_from_key(key):
+    return [tuple(item) for item in json.loads(key)]
+
+
+def _sample(name, labels, value):
+    if labels:
+        name = '{0}{{{1}}}'.format(name, ','.join(
+            '{0}="{1}"'.format(label, _escape(label_value)) for label, label_value in labels))
+    return '{0} {1}'.format(name, _format(value))
+
+
+def _escape(value):
+    value = unicode(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+    return value.encode('utf-8')
+
+
+def _format(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
@@ -0,0 +1,180 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Pre-dispatch prefetching of operation resources.
+
+Operations such as scripts fetch their resources only once they run, which puts resource storage
+latency on the critical path of every task. The :class:`Prefetcher` pulls the resources an
+operation declares (its implementation, its dependencies that are not ``key > value`` settings,
+and its ``script_path`` argument) into a worker-local cache in the background, with a bounded
+number of fetcher threads, as soon as the task (or one it depends on) is dispatched.
+
+Operation subprocesses find the cache through ``ARIA_CLOUDIFY_RESOURCE_CACHE``, and resource calls
+hit it when the resource is there. A resource that is not fetched yet is read from resource storage
+as usual, so prefetching never delays an operation.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import Queue
+
+from aria import logger
+from aria.storage import exceptions as storage_exceptions
+
+from . import utils
+
+
+RESOURCE_CACHE_ENV = 'ARIA_CLOUDIFY_RESOURCE_CACHE'
+PREFETCH_WORKERS_ENV = 'ARIA_CLOUDIFY_PREFETCH_WORKERS'
+
+
+class Prefetcher(logger.LoggerMixin):
+
+    def __init__(self, directory=None, workers=4):
+        super(Prefetcher, self).__init__()
+        self._directory = directory or tempfile.mkdtemp(prefix='aria-resource-cache-')
+        self._queue = Queue.Queue()
+        self._submitted = set()
+        self._lock = threading.Lock()
+        self._threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self._fetcher)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def prefetch(self, ctx, task=None):
+        """
+        Queues the resources declared by ``task`` (by default, the task of the operation context
+        ``ctx``) for fetching. Resources already queued are skipped.
+        """
+        task = task or ctx.task
+        service_id = str(ctx.service.id)
+        service_template_id = str(ctx.service_template.id)
+        for path in resource_paths(task):
+            key = (service_id, path)
+            with self._lock:
+                if key in self._submitted:
+                    continue
+                self._submitted.add(key)
+            self._queue.put((ctx.resource, service_id, service_template_id, path))
+
+    def join(self):
+        """
+        Waits for all queued resources to be fetched.
+        """
+        self._queue.join()
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=60)
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def _fetcher(self):
+        while True:
+            request = self._queue.get()
+            try:
+                if request is None:
+                    return
+                self._fetch(*request)
+            except BaseException as e:
+                self.logger.debug(u'Failed prefetching resource {0}: {1}'.format(request[3], e))
+            finally:
+                self._queue.task_done()
+
+    def _fetch(self, resource_storage, service_id, service_template_id, path):
+        target_path = cache_path(self._directory, service_id, path)
+        if target_path is None or os.path.exists(target_path):
+            return
+        utils.makedirs(os.path.dirname(target_path))
+        # Fetch next to the target and rename, so readers never see a partial resource
+        staging_path = tempfile.mkdtemp(dir=os.path.dirname(target_path), prefix='.fetch-')
+        try:
+            staged_path = os.path.join(staging_path, os.path.basename(target_path))
+            try:
+                resource_storage.service.download(
+                    entry_id=service_id, destination=staged_path, path=path)
+            except storage_exceptions.StorageError:
+                resource_storage.service_template.download(
+                    entry_id=service_template_id, destination=staged_path, path=path)
+            if os.path.isfile(staged_path):
+                os.rename(staged_path, target_path)
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+
+
+def cached(ctx, path):
+    """
+    Returns the path of the cached copy of a resource of the service of ``ctx``, or ``None`` if it
+    is not in the cache.
+    """
+    directory = os.environ.get(RESOURCE_CACHE_ENV)
+    if not directory:
+        return None
+    result = cache_path(directory, str(ctx.service.id), path)
+    return result if result and os.path.isfile(result) else None
+
+
+def cache_path(directory, service_id, path):
+    if not path:
+        return None
+    path = os.path.normpath(path).lstrip(os.sep)
+    if path == os.curdir or path.startswith(os.pardir):
+        return None
+    return os.path.join(directory, service_id, path)
+
+
+def resource_paths(task):
+    """
+    The resource paths declared by the operation of an ARIA task.
+    """
+    candidates = []
+    operation = _operation(task)
+    if operation is not None:
+        candidates.append(operation.implementation)
+        # Dependencies are also used for settings, e.g. "ssh.user > admin"
+        candidates.extend(dependency for dependency in operation.dependencies or []
+                          if '>' not in dependency)
+    script_path = task.arguments.get('script_path')
+    if script_path is not None:
+        candidates.append(script_path.value)
+
+    paths = []
+    for candidate in candidates:
+        # Plugin operations name their function, not a resource
+        if isinstance(candidate, basestring) and candidate and candidate != task.function \
+                and '://' not in candidate and candidate not in paths:
+            paths.append(candidate)
+    return paths
+
+
+def _operation(task):
+    actor = task.actor
+    if actor is None or not task.interface_name:
+        return None
+    interface = actor.interfaces.get(task.interface_name)
+    if interface is None:
+        return None
+    return interface.operations.get(task.operation_name)
@@ -0,0 +1,182 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Cloud endpoint rate limits, shared by the workers on a host.
+
+Set ``ARIA_CLOUDIFY_RATE_LIMITS`` to a JSON file mapping endpoints to limits, e.g.::
+
+    {"aws:us-east-1": {"rate": 10, "burst": 20, "concurrency": 8},
+     "openstack:*": {"rate": 5, "concurrency": 4}}
+
+``rate`` is the sustained number of calls per second (a token bucket holding up to ``burst``
+tokens, ``rate`` by default), and ``concurrency`` the number of calls in flight at once. Keys may be
+shell-style patterns, and the longest matching key applies. Operations wrap their cloud calls with
+``ctx.throttle()``, which derives the endpoint from the node's ``aws_config`` or
+``openstack_config`` property (see :func:`endpoint`).
+
+Bucket state lives in a file per endpoint in ``ARIA_CLOUDIFY_RATE_LIMIT_DIR`` (a directory in the
+system temporary directory by default), updated under a file lock. Time spent waiting is observed
+in the ``aria_cloudify_rate_limit_wait_seconds`` histogram when metrics are enabled.
+"""
+
+import os
+import time
+import fnmatch
+import hashlib
+import tempfile
+import itertools
+from contextlib import contextmanager
+
+from . import (metrics, utils)
+
+
+RATE_LIMITS_ENV = 'ARIA_CLOUDIFY_RATE_LIMITS'
+RATE_LIMIT_DIR_ENV = 'ARIA_CLOUDIFY_RATE_LIMIT_DIR'
+
+RATE_LIMIT_WAIT_SECONDS = 'aria_cloudify_rate_limit_wait_seconds'
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Longest sleep between attempts, so that freed concurrency slots are noticed promptly
+POLL_INTERVAL = 0.05
+
+metrics.register(RATE_LIMIT_WAIT_SECONDS, metrics.HISTOGRAM,
+                 'Time spent waiting for cloud endpoint rate limits.')
+
+_holder_ids = itertools.count()
+
+
+class RateLimiter(object):
+
+    def __init__(self, directory, limits):
+        self._directory = directory
+        self._limits = limits
+
+    @classmethod
+    def from_environment(cls):
+        limits_path = utils.env_path(RATE_LIMITS_ENV)
+        if limits_path is None:
+            return None
+        directory = utils.env_path(RATE_LIMIT_DIR_ENV) or \
+            os.path.join(tempfile.gettempdir(), 'aria-cloudify-rate-limits')
+        return cls(directory, utils.read_json(limits_path, default=None) or {})
+
+    def limits(self, endpoint):
+        """
+        The limits of ``endpoint``, from the longest key of the configuration matching it.
+        """
+        if endpoint in self._limits:
+            return self._limits[endpoint]
+        matching = [key for key in self._limits if fnmatch.fnmatchcase(endpoint, key)]
+        if not matching:
+            return None
+        return self._limits[max(matching, key=len)]
+
+    @contextmanager
+    def acquire(self, endpoint):
+        """
+        Waits until a call to ``endpoint`` is allowed, and holds a concurrency slot of the
+        endpoint for the duration of the block. Yields the number of seconds waited.
+        """
+        limits = self.limits(endpoint) if endpoint else None
+        if not limits:
+            yield 0
+            return
+
+        start = time.time()
+        holder = '{0}-{1}'.format(os.getpid(), next(_holder_ids))
+        while True:
+            delay = self._try_acquire(endpoint, limits, holder)
+            if delay is None:
+                break
+            time.sleep(min(delay, POLL_INTERVAL))
+        waited = time.time() - start
+        _observe_wait(endpoint, waited)
+        try:
+            yield waited
+        finally:
+            if limits.get('concurrency'):
+                with self._state(endpoint) as state:
+                    state.setdefault('holders', {}).pop(holder, None)
+
+    def _try_acquire(self, endpoint, limits, holder):
+        """
+        Takes a token and a concurrency slot if both are available and returns ``None``, or returns
+        how long to wait before trying again.
+        """
+        rate = float(limits['rate']) if limits.get('rate') else None
+        burst = limits.get('burst') or rate
+        concurrency = limits.get('concurrency')
+        with self._state(endpoint) as state:
+            now = time.time()
+            delay = None
+            if rate:
+                tokens = state.get('tokens')
+                if tokens is None:
+                    tokens = burst
+                else:
+                    tokens = min(burst, tokens + max(now - state['updated'], 0) * rate)
+                state.update(tokens=tokens, updated=now)
+                if tokens < 1:
+                    delay = (1 - tokens) / rate
+            if concurrency:
+                holders = state['holders'] = dict(
+                    (key, value) for key, value in state.get('holders', {}).items()
+                    if utils.process_alive(value))
+                if len(holders) >= concurrency:
+                    delay = max(delay or 0, POLL_INTERVAL)
+            if delay is not None:
+                return delay
+            if rate:
+                state['tokens'] -= 1
+            if concurrency:
+                state['holders'][holder] = os.getpid()
+            return None
+
+    @contextmanager
+    def _state(self, endpoint):
+        name = hashlib.sha1(endpoint.encode('utf-8')).hexdigest()
+        path = os.path.join(self._directory, name + '.json')
+        with utils.file_lock(os.path.join(self._directory, name + '.lock')):
+            state = utils.read_json(path, default=None) or {}
+            yield state
+            utils.write_json(path, state)
+
+
+def endpoint(properties):
+    """
+    Derives the cloud endpoint a node talks to from its properties: ``aws:<region>`` from
+    ``aws_config``, and ``openstack:<auth url>[/<region>]`` from ``openstack_config``. Credentials
+    are not part of it. Returns ``None`` for other nodes.
+    """
+    aws_config = properties.get('aws_config')
+    if aws_config is not None:
+        region = aws_config.get('ec2_region_endpoint') or aws_config.get('ec2_region_name') or \
+            aws_config.get('region_name') or 'default'
+        return 'aws:{0}'.format(region)
+    openstack_config = properties.get('openstack_config')
+    if openstack_config is not None:
+        result = 'openstack:{0}'.format(openstack_config.get('auth_url') or 'default')
+        if openstack_config.get('region'):
+            result = '{0}/{1}'.format(result, openstack_config['region'])
+        return result
+    return None
+
+
+def _observe_wait(endpoint, waited):
+    store = metrics.MetricsStore.from_environment()
+    if store is not None:
+        store.observe(RATE_LIMIT_WAIT_SECONDS, {'endpoint': endpoint}, waited, WAIT_BUCKETS)
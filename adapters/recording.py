@@ -0,0 +1,498 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Record-and-replay of the interactions Cloudify operations have with their context.
+
+Setting ``ARIA_CLOUDIFY_RECORDING_DIR`` puts the context adapter in recording mode: every public
+attribute read, method call (resource fetches, retries, node instance updates), runtime properties
+read/write and log call is captured along with the operation inputs and outcome, and saved as a
+JSON recording per task attempt. :func:`replay` re-runs the operation offline, against a context
+that serves everything from the recording, without ARIA storage.
+
+Only interactions with the context are captured; calls the operation makes to cloud APIs directly
+are not, so replaying such an operation as is still reaches the cloud unless its clients are
+substituted (or a different ``function`` is given to :func:`replay`).
+"""
+
+import os
+import copy
+import json
+import time
+import base64
+import logging
+import tempfile
+import importlib
+from contextlib import contextmanager
+
+from . import utils
+
+
+RECORDING_DIR_ENV = 'ARIA_CLOUDIFY_RECORDING_DIR'
+
+RECORDING_VERSION = 1
+
+_PRIMITIVES = (type(None), bool, int, long, float, basestring)
+_DOWNLOADS = ('download_resource', 'download_resource_and_render')
+_STREAMS = ('iter_resource', 'iter_resource_and_render')
+# Calls returning a context manager, which can't be recorded; they are replayed as no-ops
+_CONTEXTS = ('throttle', )
+_LIST = '__list__'
+
+# Fetched resources larger than this are recorded without their content; replaying the operation
+# then fails when it fetches them
+MAX_CONTENT_SIZE = 1024 * 1024
+
+
+class RetryRequested(Exception):
+    """
+    Raised by ``ctx.operation.retry`` during replay.
+    """
+
+    def __init__(self, message=None, retry_after=None):
+        super(RetryRequested, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class Recorder(object):
+
+    def __init__(self, function, inputs):
+        self.recording = {
+            'version': RECORDING_VERSION,
+            'function': function,
+            'inputs': _json_safe(inputs),
+            'context': {},
+            'events': [],
+            'outcome': None,
+            'message': None,
+            'duration': None
+        }
+        self._start = time.time()
+
+    @classmethod
+    def from_environment(cls, function, inputs):
+        if utils.env_path(RECORDING_DIR_ENV) is None:
+            return None
+        return cls(function, inputs)
+
+    def capture(self, path, value):
+        """
+        Records the value of the attribute at ``path`` and returns what should be handed to the
+        operation in its place.
+        """
+        if isinstance(value, _PRIMITIVES):
+            self.recording['context'].setdefault(path, value)
+            return value
+        elif path.endswith('runtime_properties'):
+            self.recording['context'].setdefault(path, _json_safe(value))
+            return RecordingDict(value, self, path)
+        elif path.endswith('logger'):
+            return _RecordingLogger(value, self, path)
+        elif isinstance(value, dict):
+            self.recording['context'].setdefault(path, _json_safe(value))
+            return value
+        elif isinstance(value, (list, tuple)):
+            if all(isinstance(item, _PRIMITIVES) for item in value):
+                self.recording['context'].setdefault(path, list(value))
+                return value
+            self.recording['context'].setdefault(path, {_LIST: len(value)})
+            return [self.capture('{0}[{1}]'.format(path, index), item)
+                    for index, item in enumerate(value)]
+        elif callable(value):
+            return self._recording_call(path, value)
+        else:
+            return _RecordingProxy(value, self, path)
+
+    def event(self, kind, path, **kwargs):
+        kwargs.update(kind=kind, path=path)
+        self.recording['events'].append(_json_safe(kwargs))
+
+    def finish(self, outcome, message=None):
+        self.recording.update(outcome=outcome,
+                              message=message,
+                              duration=time.time() - self._start)
+
+    def save(self, name, directory=None):
+        directory = directory or utils.env_path(RECORDING_DIR_ENV)
+        path = os.path.join(directory, '{0}.json'.format(name))
+        utils.write_atomic(path, json.dumps(self.recording, default=str, indent=2))
+        return path
+
+    def _recording_call(self, path, function):
+        def call(*args, **kwargs):
+            try:
+                result = function(*args, **kwargs)
+            except BaseException as e:
+                self.event('call', path, args=args, kwargs=kwargs, error=str(e))
+                raise
+            event = {'args': args, 'kwargs': kwargs, 'result': result}
+            if path.split('.')[-1] in _DOWNLOADS:
+                with open(result, 'rb') as f:
+                    event.update(_content(f.read(MAX_CONTENT_SIZE + 1),
+                                          os.path.getsize(result)))
+            elif path.split('.')[-1] in _STREAMS:
+                event['result'] = None
+                return self._recording_stream(path, result, event)
+            elif path.split('.')[-1] in _CONTEXTS:
+                event['result'] = None
+            self.event('call', path, **event)
+            return result
+        return call
+
+    def _recording_stream(self, path, chunks, event):
+        # Chunks are passed on as they come, and kept (up to MAX_CONTENT_SIZE) to be replayed. The
+        # call is recorded once the operation is done with the stream.
+        content = []
+        size = 0
+        try:
+            for chunk in chunks:
+                if size <= MAX_CONTENT_SIZE:
+                    content.append(chunk)
+                size += len(chunk)
+                yield chunk
+        finally:
+            event.update(_content(''.join(content), size))
+            self.event('call', path, **event)
+
+
+class RecordingAdapterMixin(object):
+    """
+    Mixed into the context adapter class in recording mode; routes every public attribute read of
+    the adapter through :meth:`Recorder.capture`.
+    """
+
+    def __getattribute__(self, name):
+        value = super(RecordingAdapterMixin, self).__getattribute__(name)
+        if name.startswith('_'):
+            return value
+        return self._recorder.capture(name, value)
+
+
+class _RecordingProxy(object):
+
+    def __init__(self, target, recorder, path):
+        self.__dict__.update(_target=target, _recorder=recorder, _path=path)
+
+    def __getattr__(self, name):
+        return self._recorder.capture('{0}.{1}'.format(self._path, name),
+                                      getattr(self._target, name))
+
+    def __setattr__(self, name, value):
+        path = '{0}.{1}'.format(self._path, name)
+        self._recorder.event('set', path, value=value)
+        setattr(self._target, name, value)
+
+
+class RecordingDict(dict):
+    """
+    Copy of a runtime properties dict that records key reads and every write. It is a ``dict``, so
+    plugins can serialize or type check it as usual. Writes also go to the underlying dict, so
+    instrumentation keeps tracking them.
+
+    Reads that bypass the mapping methods (such as ``json.dumps`` or ``dict(...)``) are not
+    recorded, which replay doesn't need: the runtime properties are recorded as they were when
+    the operation first read them.
+    """
+
+    def __init__(self, target, recorder, path):
+        super(RecordingDict, self).__init__(target)
+        self._target = target
+        self._recorder = recorder
+        self._path = path
+
+    def __getitem__(self, key):
+        value = super(RecordingDict, self).__getitem__(key)
+        self._recorder.event('get', self._path, key=key, value=value)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __setitem__(self, key, value):
+        self._recorder.event('set', self._path, key=key, value=value)
+        self._target[key] = value
+        super(RecordingDict, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._recorder.event('delete', self._path, key=key)
+        del self._target[key]
+        super(RecordingDict, self).__delitem__(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        if not self:
+            raise KeyError('popitem(): dictionary is empty')
+        key = next(iter(self))
+        return key, self.pop(key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        return dict, (dict(self), )
+
+
+class _RecordingLogger(object):
+
+    def __init__(self, logger, recorder, path):
+        self._logger = logger
+        self._recorder = recorder
+        self._path = path
+
+    def __getattr__(self, name):
+        attribute = getattr(self._logger, name)
+        if name not in ('debug', 'info', 'warn', 'warning', 'error', 'exception', 'critical'):
+            return attribute
+
+        def log(message, *args, **kwargs):
+            self._recorder.event('log', self._path, level=name, message=message, args=args)
+            return attribute(message, *args, **kwargs)
+        return log
+
+
+class ReplayResult(object):
+
+    def __init__(self, outcome, message, duration, recording, runtime_properties):
+        self.outcome = outcome
+        self.message = message
+        self.duration = duration
+        self.recording = recording
+        self.runtime_properties = runtime_properties
+
+    @property
+    def diverged(self):
+        """
+        Whether the replayed run ended differently than the recorded one.
+        """
+        return self.outcome != self.recording['outcome']
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        return json.load(f)
+
+
+def replay(recording, function=None, inputs=None):
+    """
+    Re-runs a recorded operation against a context that serves everything from the recording.
+
+    :param recording: a recording, or a path to one
+    :param function: the operation function (or its import path) to run instead of the recorded one
+    :param inputs: operation inputs to use instead of the recorded ones
+    :rtype: :class:`ReplayResult`
+    """
+    if isinstance(recording, basestring):
+        recording = load(recording)
+    function = function or recording['function']
+    if isinstance(function, basestring):
+        module_name, function_name = function.rsplit('.', 1)
+        function = getattr(importlib.import_module(module_name), function_name)
+    inputs = copy.deepcopy(recording['inputs'] if inputs is None else inputs)
+
+    ctx = ReplayContext(recording)
+    outcome, message = 'success', None
+    start = time.time()
+    try:
+        with _push_cfy_ctx(ctx, inputs):
+            function(ctx=ctx, **inputs)
+    except RetryRequested as e:
+        outcome, message = 'retry', str(e)
+    except Exception as e:
+        outcome, message = _outcome(e), str(e)
+    duration = time.time() - start
+    return ReplayResult(outcome=outcome,
+                        message=message,
+                        duration=duration,
+                        recording=recording,
+                        runtime_properties=ctx.replayed_runtime_properties)
+
+
+class _ReplayState(object):
+
+    def __init__(self, recording):
+        self.context = recording['context']
+        self.calls = {}
+        self.runtime_properties = {}
+        for event in recording['events']:
+            if event['kind'] == 'call':
+                self.calls.setdefault(event['path'], []).append(event)
+
+
+class _ReplayObject(object):
+
+    def __init__(self, state, path):
+        self._state = state
+        self._path = path
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self._value('{0}.{1}'.format(self._path, name) if self._path else name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            super(_ReplayObject, self).__setattr__(name, value)
+        elif name == 'runtime_properties':
+            properties = getattr(self, name)
+            properties.clear()
+            properties.update(value)
+        else:
+            raise AttributeError('{0}.{1} is read only during replay'.format(self._path, name))
+
+    def _value(self, path):
+        state = self._state
+        name = path.split('.')[-1]
+        if name == 'runtime_properties':
+            if path not in state.runtime_properties:
+                state.runtime_properties[path] = copy.deepcopy(state.context.get(path) or {})
+            return state.runtime_properties[path]
+        elif name == 'logger':
+            return logging.getLogger('aria.cloudify.replay')
+        elif path in state.calls or name in ('retry', 'update', 'refresh', 'send_event'):
+            return _ReplayCall(path, state.calls.get(path, []))
+        elif path in state.context:
+            value = state.context[path]
+            if isinstance(value, dict) and _LIST in value:
+                return [_ReplayObject(state, '{0}[{1}]'.format(path, index))
+                        for index in range(value[_LIST])]
+            return copy.deepcopy(value)
+        elif any(key.startswith(path + '.') for key in state.context):
+            return _ReplayObject(state, path)
+        raise AttributeError('{0} was not accessed during the recorded operation'.format(path))
+
+
+class ReplayContext(_ReplayObject):
+    """
+    Stands in for the context adapter during replay.
+    """
+
+    def __init__(self, recording):
+        super(ReplayContext, self).__init__(_ReplayState(recording), '')
+
+    @property
+    def replayed_runtime_properties(self):
+        """
+        The runtime properties written during the replay, by node instance path.
+        """
+        return dict((path, dict(value)) for path, value in self._state.runtime_properties.items())
+
+
+class _ReplayCall(object):
+
+    def __init__(self, path, events):
+        self._path = path
+        self._events = list(events)
+
+    def __call__(self, *args, **kwargs):
+        name = self._path.split('.')[-1]
+        if name == 'retry':
+            message = args[0] if args else kwargs.get('message')
+            retry_after = args[1] if len(args) > 1 else kwargs.get('retry_after')
+            raise RetryRequested(message, retry_after)
+        if name in _CONTEXTS:
+            return _no_wait()
+        if not self._events:
+            # Calls whose result is of no interest (e.g. update) may not have been recorded
+            return None
+        # Calls are answered in the recorded order; extra calls repeat the last answer
+        event = self._events.pop(0) if len(self._events) > 1 else self._events[0]
+        if 'error' in event:
+            raise RuntimeError(event['error'])
+        if name in _DOWNLOADS + _STREAMS and event.get('content', '') is None:
+            raise RuntimeError('{0} fetched {1} bytes, too many to be recorded'
+                               .format(self._path, event['size']))
+        if name in _DOWNLOADS:
+            return _materialize(event, args, kwargs)
+        elif name in _STREAMS:
+            return iter([base64.b64decode(event.get('content', ''))])
+        return event.get('result')
+
+
+@contextmanager
+def _no_wait():
+    yield 0
+
+
+def _materialize(event, args, kwargs):
+    target_path = kwargs.get('target_path') or (args[1] if len(args) > 1 else None)
+    if not target_path:
+        resource_path = kwargs.get('resource_path') or args[0]
+        fd, target_path = tempfile.mkstemp(suffix=os.path.basename(resource_path))
+        os.close(fd)
+    with open(target_path, 'wb') as f:
+        f.write(base64.b64decode(event.get('content', '')))
+    return target_path
+
+
+@contextmanager
+def _push_cfy_ctx(ctx, inputs):
+    # Makes the replay context importable as ``cloudify.ctx`` when Cloudify is installed
+    try:
+        import cloudify  # noqa
+        from .extension import _push_cfy_ctx as push
+    except ImportError:
+        yield ctx
+        return
+    with push(ctx, inputs) as current_ctx:
+        yield current_ctx
+
+
+def _outcome(exception):
+    try:
+        from cloudify.exceptions import (NonRecoverableError, RecoverableError)
+    except ImportError:
+        return 'error'
+    if isinstance(exception, RecoverableError):
+        return 'retry'
+    elif isinstance(exception, NonRecoverableError):
+        return 'abort'
+    return 'error'
+
+
+def _content(content, size):
+    if size > MAX_CONTENT_SIZE:
+        return {'content': None, 'size': size}
+    return {'content': base64.b64encode(content), 'size': size}
+
+
+def _json_safe(value):
+    return json.loads(json.dumps(value, default=str))
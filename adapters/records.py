@@ -0,0 +1,119 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Static task context records.
+
+Much of what the context adapter serves is fixed for the whole task: blueprint and deployment
+ids, the operation name, node names and types, plugin details... :class:`CloudifyGraphCompiler`
+computes it once per task when the workflow graph is compiled, and ships it as a task argument.
+The operation subprocess receives it with the other arguments, so the adapter serves these
+properties with no storage access. Use the compiler in place of ARIA's ``GraphCompiler``; tasks
+compiled without it are served from storage as before.
+"""
+
+from collections import namedtuple
+
+from aria.modeling import models
+from aria.orchestrator.workflows.core import graph_compiler
+
+from . import utils
+
+
+# Reserved task argument name; the extension takes it out of the operation inputs
+TASK_RECORD_ARGUMENT = '_cloudify_task_record'
+
+TaskRecord = namedtuple('TaskRecord', [
+    'blueprint_id', 'deployment_id', 'execution_id', 'workflow_id', 'task_name',
+    'operation_name', 'max_retries', 'plugin', 'node', 'source', 'target'])
+
+NodeRecord = namedtuple('NodeRecord', ['id', 'name', 'type', 'type_hierarchy', 'instance_id'])
+
+PluginRecord = namedtuple('PluginRecord', ['name', 'package_name', 'package_version'])
+
+
+class CloudifyGraphCompiler(graph_compiler.GraphCompiler):
+
+    def __init__(self, *args, **kwargs):
+        super(CloudifyGraphCompiler, self).__init__(*args, **kwargs)
+        # Node id: node record, as many tasks run on the same nodes
+        self._node_records = {}
+
+    def _create_operation_task(self, api_task, dependencies):
+        api_task.arguments[TASK_RECORD_ARGUMENT] = models.Argument.wrap(
+            TASK_RECORD_ARGUMENT, self._build(api_task))
+        return super(CloudifyGraphCompiler, self)._create_operation_task(api_task, dependencies)
+
+    def _build(self, api_task):
+        execution = self._ctx.execution
+        record = {
+            'blueprint_id': self._ctx.service_template.id,
+            'deployment_id': self._ctx.service.id,
+            'execution_id': execution.id,
+            'workflow_id': execution.workflow_name,
+            'task_name': api_task.function,
+            'operation_name': utils.operation_name(api_task.name),
+            'max_retries': _max_retries(api_task.max_attempts),
+            'plugin': None,
+            'node': None,
+            'source': None,
+            'target': None
+        }
+        plugin = api_task.plugin
+        if plugin is not None:
+            record['plugin'] = {'name': plugin.name,
+                                'package_name': plugin.package_name,
+                                'package_version': plugin.package_version}
+        actor = api_task.actor
+        if hasattr(actor, 'source_node'):
+            record['source'] = self._node_record(actor.source_node)
+            record['target'] = self._node_record(actor.target_node)
+        else:
+            record['node'] = self._node_record(actor)
+        return record
+
+    def _node_record(self, node):
+        if node.id not in self._node_records:
+            node_template = node.node_template
+            self._node_records[node.id] = {
+                'id': node_template.id,
+                'name': node_template.name,
+                'type': node_template.type.name,
+                'type_hierarchy': utils.cloudify_type_hierarchy(node_template.type),
+                'instance_id': node.id
+            }
+        return self._node_records[node.id]
+
+
+def load(value):
+    """
+    Turns a task record shipped as a task argument into an immutable :class:`TaskRecord`.
+    """
+    if value is None:
+        return None
+    fields = dict((field, value.get(field)) for field in TaskRecord._fields)
+    for field in ('node', 'source', 'target'):
+        if fields[field] is not None:
+            fields[field] = NodeRecord(**fields[field])
+    if fields['plugin'] is not None:
+        fields['plugin'] = PluginRecord(**fields['plugin'])
+    return TaskRecord(**fields)
+
+
+def _max_retries(max_attempts):
+    if max_attempts == models.Task.INFINITE_RETRIES:
+        return models.Task.INFINITE_RETRIES
+    return max_attempts - 1 if max_attempts > 0 else 0
@@ -0,0 +1,301 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Streaming access to service (template) resources.
+
+ARIA reads resources into memory in one piece, and renders them as a single Jinja template. The
+functions here read resources in chunks instead, and render them incrementally: the source is cut
+into segments at line boundaries where Jinja's lexer and parser find no template construct or
+block open, segments without template markers are copied through with the newline normalization
+Jinja applies to template text, and the others are rendered one at a time. Memory use is then
+bounded by about twice the chunk size or the largest template block, rather than by the resource
+size.
+
+Templates with top-level state shared between segments (``set``, ``macro``, ``import``,
+``extends``...) can't be cut that way. They are rendered as a whole with ``Template.generate()``,
+which still streams the output.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import jinja2
+from aria.storage import (exceptions as storage_exceptions, filesystem_rapi)
+
+from . import prefetch
+
+
+CHUNK_SIZE = 64 * 1024
+
+_MARKERS = ('{{', '{%', '{#')
+# Line breaks other than LF, which Jinja's lexer turns into LF, as UTF-8
+_LINE_BREAKS = ('\r', '\x0b', '\x0c', '\x1c', '\x1d', '\x1e', '\xc2\x85', '\xe2\x80\xa8',
+                '\xe2\x80\xa9')
+# Openings Jinja's lexer accepts at the end of a template without an error, dropping them
+_TRAILING_OPENING = re.compile(r'(?:\{#[-+]?|\{%[-+]?\s*raw\s*(?:-%\}\s*|%\}))\Z')
+_STATEFUL_TAGS = frozenset(['set', 'macro', 'import', 'from', 'extends', 'block'])
+_STATEFUL = re.compile(r'\{%[-+]?\s*(?:' + '|'.join(_STATEFUL_TAGS) + r')\b')
+
+_environment = jinja2.Environment(keep_trailing_newline=True)
+
+
+@contextmanager
+def open_resource(ctx, path):
+    """
+    Opens a resource of the service of ``ctx`` for reading in binary mode, falling back to the
+    service template resource like ``ctx.get_resource`` does.
+    """
+    cached_path = prefetch.cached(ctx, path)
+    if cached_path:
+        with open(cached_path, 'rb') as f:
+            yield f
+        return
+    try:
+        with _open(ctx.resource.service, str(ctx.service.id), path) as f:
+            yield f
+    except _ResourceNotFound:
+        with _open(ctx.resource.service_template, str(ctx.service_template.id), path) as f:
+            yield f
+
+
+def get_resource(ctx, path):
+    """
+    Like ``ctx.get_resource``, reading prefetched resources from the local cache.
+    """
+    cached_path = prefetch.cached(ctx, path)
+    if cached_path:
+        with open(cached_path, 'rb') as f:
+            return f.read()
+    return ctx.get_resource(path=path)
+
+
+def get_resource_and_render(ctx, path, variables=None):
+    """
+    Like ``ctx.get_resource_and_render``, reading prefetched resources from the local cache.
+    """
+    variables = dict(variables or {})
+    variables.setdefault('ctx', ctx)
+    return jinja2.Template(get_resource(ctx, path)).render(variables)
+
+
+def download_resource(ctx, destination, path):
+    """
+    Like ``ctx.download_resource``, copying prefetched resources from the local cache.
+    """
+    cached_path = prefetch.cached(ctx, path)
+    if cached_path:
+        shutil.copy2(cached_path, destination)
+    else:
+        ctx.download_resource(destination=destination, path=path)
+
+
+def iter_resource(ctx, path, chunk_size=CHUNK_SIZE):
+    """
+    Yields the content of a resource in chunks of up to ``chunk_size`` bytes.
+    """
+    with open_resource(ctx, path) as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            yield chunk
+
+
+def iter_resource_and_render(ctx, path, variables=None, chunk_size=CHUNK_SIZE):
+    """
+    Yields a resource rendered as a Jinja template, as UTF-8 encoded chunks. ``ctx`` is
+    available to the template without providing it explicitly.
+    """
+    variables = dict(variables or {})
+    variables.setdefault('ctx', ctx)
+    with open_resource(ctx, path) as f:
+        for chunk in render(f, variables, chunk_size):
+            yield chunk
+
+
+def download_resource_and_render(ctx, destination, path, variables=None, chunk_size=CHUNK_SIZE):
+    """
+    Renders a resource as a Jinja template straight into ``destination``.
+    """
+    with open(destination, 'wb') as target:
+        for chunk in iter_resource_and_render(ctx, path, variables, chunk_size):
+            target.write(chunk)
+
+
+def render(source, variables, chunk_size=CHUNK_SIZE):
+    """
+    Renders the template read from the binary file object ``source`` incrementally, yielding
+    UTF-8 encoded chunks. The output is the same as that of ``jinja2.Template.render``.
+    """
+    if _is_stateful(source):
+        template = jinja2.Template(source.read().decode('utf-8'))
+        for chunk in template.generate(variables):
+            yield chunk.encode('utf-8')
+        return
+
+    segment = []
+    size = 0
+    # Cutting is attempted again once the segment doubles, so that a long block isn't compiled
+    # over and over
+    cut_size = chunk_size
+    for piece in _pieces(source, chunk_size):
+        if segment and size >= cut_size:
+            template = _cut(''.join(segment), piece)
+            if template is None:
+                cut_size = size * 2
+            else:
+                yield template.render(variables).encode('utf-8')
+                segment = []
+                size = 0
+                cut_size = chunk_size
+        segment.append(piece)
+        size += len(piece)
+    # The last segment is held back until the end, as Jinja drops a single trailing newline
+    yield _template(''.join(segment), final=True).render(variables).encode('utf-8')
+
+
+def _cut(segment, next_piece):
+    """
+    The template of ``segment`` if the source may be cut between it and ``next_piece``, i.e. no
+    construct (including string literals within it) or block is open, and neither a line break
+    nor whitespace control reaches across the cut; ``None`` otherwise.
+    """
+    if ord(next_piece[0]) & 0xc0 == 0x80:
+        # Within a UTF-8 character
+        return None
+    # A whitespace control marker strips all the (Unicode) whitespace up to the cut and beyond,
+    # so the next piece must start with something else than whitespace or a (possibly cut)
+    # marker. It may end within a character, which decodes to a replacement character.
+    following = next_piece.decode('utf-8', 'replace').lstrip()[:3]
+    if segment[-1:] + next_piece[:1] in _MARKERS or \
+            segment.endswith(_LINE_BREAKS) or \
+            segment.decode('utf-8').rstrip()[-3:] in ('-}}', '-%}', '-#}') or \
+            following in ('', '{', '{{', '{%', '{#', '{{-', '{%-', '{#-') or \
+            following.startswith(u'\ufffd') or \
+            _TRAILING_OPENING.search(segment):
+        return None
+    try:
+        return _template(segment, final=False)
+    except jinja2.TemplateSyntaxError:
+        # Jinja's lexer and parser found a construct or block left open. Errors of the template
+        # itself surface once it can't be cut anymore, from the last segment.
+        return None
+
+
+def _template(segment, final):
+    """
+    Compiles a segment, keeping its trailing newline unless it is the last one.
+    """
+    if not any(marker in segment for marker in _MARKERS):
+        return _Text(segment.decode('utf-8'), keep_trailing_newline=not final)
+    if final:
+        return jinja2.Template(segment.decode('utf-8'))
+    return _environment.from_string(segment.decode('utf-8'))
+
+
+class _Text(object):
+    """
+    A segment without template markers, rendered with the newline normalization Jinja's lexer
+    applies to template text (with the default ``newline_sequence``).
+    """
+
+    def __init__(self, text, keep_trailing_newline):
+        self._text = text
+        self._keep_trailing_newline = keep_trailing_newline
+
+    def render(self, variables):
+        text = '\n'.join(self._text.splitlines())
+        if self._keep_trailing_newline and self._text.endswith(('\r\n', '\r', '\n')):
+            text += '\n'
+        return text
+
+
+def _pieces(source, chunk_size):
+    """
+    Splits the content of ``source`` into lines, cutting lines longer than ``chunk_size`` at
+    positions that split neither a template marker nor a UTF-8 character.
+    """
+    pending = ''
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        pending += chunk
+        start = 0
+        while True:
+            end = pending.find('\n', start)
+            if end == -1:
+                break
+            yield pending[start:end + 1]
+            start = end + 1
+        pending = pending[start:]
+        if len(pending) >= chunk_size:
+            cut = len(pending)
+            while cut > 1 and (pending[cut - 1] == '{' or ord(pending[cut - 1]) & 0xc0 == 0x80):
+                cut -= 1
+            yield pending[:cut]
+            pending = pending[cut:]
+    if pending:
+        yield pending
+
+
+def _is_stateful(source):
+    position = source.tell()
+    try:
+        for piece in _pieces(source, CHUNK_SIZE):
+            if _STATEFUL.search(piece):
+                return True
+        return False
+    finally:
+        source.seek(position)
+
+
+class _ResourceNotFound(Exception):
+    pass
+
+
+@contextmanager
+def _open(resource_api, entry_id, path):
+    if isinstance(resource_api, filesystem_rapi.FileSystemResourceAPI):
+        with open(_filesystem_path(resource_api, entry_id, path), 'rb') as f:
+            yield f
+        return
+
+    # Other resource APIs can only download or read in full; downloading copies in chunks
+    fd, staged_path = tempfile.mkstemp(prefix='aria-resource-')
+    os.close(fd)
+    try:
+        try:
+            resource_api.download(entry_id=entry_id, destination=staged_path, path=path)
+        except storage_exceptions.StorageError:
+            raise _ResourceNotFound()
+        with open(staged_path, 'rb') as f:
+            yield f
+    finally:
+        os.remove(staged_path)
+
+
+def _filesystem_path(resource_api, entry_id, path):
+    resource = os.path.join(resource_api.directory, resource_api.name, entry_id, path or '')
+    if os.path.isdir(resource):
+        # Like FileSystemResourceAPI.read, a directory holding a single resource stands for it
+        resources = os.listdir(resource)
+        if len(resources) == 1:
+            resource = os.path.join(resource, resources[0])
+    if not os.path.isfile(resource):
+        raise _ResourceNotFound()
+    return resource
@@ -0,0 +1,348 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Managed scratch space for operations.
+
+``ctx.download_resource`` and ``ctx.download_resource_and_render`` without a target path create
+files that nobody removes, which fills the disk of long running hosts. Set
+``ARIA_CLOUDIFY_SCRATCH_DIR`` to a directory dedicated to scratch files, or to ``auto``, and these
+files are created in a scratch directory of the operation instead, removed with everything in it
+when the operation ends. Calls passing ``keep=True`` create files that outlive the operation, as
+before.
+
+With ``auto``, scratch files go to ``/dev/shm`` when it is a writable tmpfs, and to the system
+temporary directory when they don't fit there (or there is no such tmpfs).
+
+``ARIA_CLOUDIFY_SCRATCH_QUOTA`` limits the total size in bytes of the scratch files of an
+operation, and ``ARIA_CLOUDIFY_SCRATCH_TOTAL_QUOTA`` that of the scratch files of all the operations
+in each scratch root. Quotas are enforced as files are written, so that a large download never
+lands in the tmpfs in full: a file growing over the total quota of the tmpfs moves to disk, where
+the rest of it is written; otherwise, a file taking the scratch space over a quota is removed and
+the call fails with :class:`QuotaExceeded`. The operations sharing a root account for the bytes
+they write in a ledger in it, reserving ``ScratchSpace.RESERVATION`` bytes at a time. Scratch
+directories of workers that died, and their reservations, are removed as later operations start.
+"""
+
+import os
+import errno
+import shutil
+import weakref
+import tempfile
+from contextlib import contextmanager
+
+from . import utils
+
+
+SCRATCH_DIR_ENV = 'ARIA_CLOUDIFY_SCRATCH_DIR'
+SCRATCH_QUOTA_ENV = 'ARIA_CLOUDIFY_SCRATCH_QUOTA'
+SCRATCH_TOTAL_QUOTA_ENV = 'ARIA_CLOUDIFY_SCRATCH_TOTAL_QUOTA'
+
+AUTO = 'auto'
+TMPFS_DIR = '/dev/shm'
+SCRATCH_NAME = 'aria-cloudify-scratch'
+LEDGER_NAME = '.usage.json'
+
+_COPY_SIZE = 64 * 1024
+
+# Operation context: its active scratch space
+_spaces = weakref.WeakKeyDictionary()
+
+
+class QuotaExceeded(IOError):
+
+    def __init__(self, message):
+        super(QuotaExceeded, self).__init__(errno.EDQUOT, message)
+
+
+class ScratchSpace(object):
+
+    # Bytes reserved against the total quota of a root at once, so that the ledger isn't locked for
+    # every chunk written
+    RESERVATION = 4 * 1024 * 1024
+
+    def __init__(self, roots, quota=None, total_quota=None):
+        """
+        :param roots: directories to create scratch directories in, by order of preference; a file
+         that doesn't fit in a root goes to the next one
+        :param quota: maximum size in bytes of the scratch files of the operation
+        :param total_quota: maximum size in bytes of the scratch files in each root
+        """
+        self._roots = list(roots)
+        self._quota = quota
+        self._total_quota = total_quota
+        # Root: scratch directory of the operation in it, created on first use
+        self._directories = {}
+        # Bytes of the scratch files of the operation
+        self._usage = 0
+        # Root: bytes of the scratch files of the operation in it, and bytes reserved for them
+        self._used = {}
+        self._reserved = {}
+
+    @classmethod
+    def from_environment(cls):
+        value = os.environ.get(SCRATCH_DIR_ENV)
+        if not value:
+            return None
+        if value == AUTO:
+            roots = [os.path.join(tempfile.gettempdir(), SCRATCH_NAME)]
+            if tmpfs_available():
+                roots.insert(0, os.path.join(TMPFS_DIR, SCRATCH_NAME))
+        else:
+            roots = [utils.env_path(SCRATCH_DIR_ENV)]
+        return cls(roots,
+                   quota=int(os.environ.get(SCRATCH_QUOTA_ENV) or 0) or None,
+                   total_quota=int(os.environ.get(SCRATCH_TOTAL_QUOTA_ENV) or 0) or None)
+
+    @property
+    def roots(self):
+        return self._roots
+
+    @contextmanager
+    def managed(self, ctx):
+        """
+        Serves scratch files to the operation of ``ctx`` for the duration of the block, and
+        removes them when it ends.
+        """
+        for root in self._roots:
+            collect(root)
+        _spaces[ctx] = self
+        try:
+            yield self
+        finally:
+            _spaces.pop(ctx, None)
+            self.clear()
+
+    def create(self, chunks, suffix=''):
+        """
+        Creates a scratch file holding the content of the iterable ``chunks``, and returns its
+        path.
+        """
+        scratch_file = _ScratchFile(self, suffix)
+        size = 0
+        try:
+            for chunk in chunks:
+                if self._quota is not None and self._usage + len(chunk) > self._quota:
+                    raise QuotaExceeded('Scratch files of the operation exceed {0} bytes'
+                                        .format(self._quota))
+                scratch_file.write(chunk)
+                size += len(chunk)
+                self._usage += len(chunk)
+        except BaseException:
+            self._usage -= size
+            scratch_file.discard()
+            raise
+        scratch_file.close()
+        return scratch_file.path
+
+    def usage(self):
+        """
+        Total size in bytes of the scratch files of the operation.
+        """
+        return self._usage
+
+    def clear(self):
+        directories, self._directories = self._directories, {}
+        for root, directory in directories.items():
+            shutil.rmtree(directory, ignore_errors=True)
+            if self._reserved.get(root):
+                _record(root, os.path.basename(directory), 0)
+        self._usage = 0
+        self._used = {}
+        self._reserved = {}
+
+    def _open(self, index, suffix):
+        root = self._roots[index]
+        directory = self._directories.get(root)
+        if directory is None:
+            utils.makedirs(root)
+            # Named after the worker process, so that it can be collected if the worker dies
+            directory = self._directories[root] = tempfile.mkdtemp(
+                dir=root, prefix='{0}-'.format(os.getpid()))
+        fd, path = tempfile.mkstemp(dir=directory, suffix=suffix)
+        # Unbuffered, so that a full file system fails the write of the chunk that doesn't fit
+        return path, os.fdopen(fd, 'wb', 0)
+
+    def _append(self, index, f, chunk):
+        """
+        Writes ``chunk`` to the scratch file ``f`` in the root at ``index``; ``False`` if it
+        doesn't fit there, and there is a next root.
+        """
+        root = self._roots[index]
+        last = index == len(self._roots) - 1
+        if not self._reserve(root, len(chunk)):
+            if last:
+                raise QuotaExceeded('Scratch files in {0} exceed {1} bytes'
+                                    .format(root, self._total_quota))
+            return False
+        try:
+            f.write(chunk)
+        except (IOError, OSError) as e:
+            self._release(root, len(chunk))
+            if e.errno == errno.ENOSPC and not last:
+                return False
+            raise
+        return True
+
+    def _reserve(self, root, size):
+        """
+        Counts ``size`` more bytes of scratch files in ``root`` against its total quota; ``False``
+        if they don't fit.
+        """
+        if self._total_quota is None:
+            return True
+        used = self._used.get(root, 0) + size
+        if used > self._reserved.get(root, 0) and \
+                not self._reserve_upto(root, used + self.RESERVATION) and \
+                not self._reserve_upto(root, used):
+            return False
+        self._used[root] = used
+        return True
+
+    def _release(self, root, size):
+        if self._total_quota is None:
+            return
+        self._used[root] = self._used.get(root, 0) - size
+        # Unused reservations are handed back past a reservation's worth
+        if self._reserved.get(root, 0) - self._used[root] > self.RESERVATION:
+            self._reserve_upto(root, self._used[root] + self.RESERVATION)
+
+    def _reserve_upto(self, root, size):
+        name = os.path.basename(self._directories[root])
+        if not _record(root, name, size, self._total_quota):
+            return False
+        self._reserved[root] = size
+        return True
+
+
+class _ScratchFile(object):
+    """
+    A scratch file being written, moving to the next root of the scratch space, with what was
+    written of it, once it doesn't fit in its root.
+    """
+
+    def __init__(self, space, suffix):
+        self._space = space
+        self._suffix = suffix
+        self._index = 0
+        self.path, self._file = space._open(self._index, suffix)
+        self.size = 0
+
+    def write(self, chunk):
+        while not self._space._append(self._index, self._file, chunk):
+            self._move()
+        self.size += len(chunk)
+
+    def close(self):
+        self._file.close()
+
+    def discard(self):
+        self._file.close()
+        _remove(self.path)
+        self._space._release(self._space.roots[self._index], self.size)
+
+    def _move(self):
+        root, path, size = self._space.roots[self._index], self.path, self.size
+        self._file.close()
+        self._index += 1
+        self.path, self._file = self._space._open(self._index, self._suffix)
+        self.size = 0
+        try:
+            with open(path, 'rb') as source:
+                while self.size < size:
+                    self.write(source.read(min(_COPY_SIZE, size - self.size)))
+        finally:
+            _remove(path)
+            self._space._release(root, size)
+
+
+def current(ctx):
+    """
+    The scratch space serving the operation of ``ctx``, if any.
+    """
+    return _spaces.get(ctx)
+
+
+def collect(root):
+    """
+    Removes the scratch directories in ``root`` of processes that are no longer running.
+    """
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return
+    for name in names:
+        if not _alive(name):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    ledger_path = os.path.join(root, LEDGER_NAME)
+    if os.path.exists(ledger_path):
+        with utils.file_lock(ledger_path + '.lock'):
+            ledger = utils.read_json(ledger_path, {})
+            live_ledger = dict((name, size) for name, size in ledger.items() if _alive(name))
+            if live_ledger != ledger:
+                utils.write_json(ledger_path, live_ledger)
+
+
+def tmpfs_available():
+    """
+    Whether ``TMPFS_DIR`` is a writable tmpfs mount.
+    """
+    if not os.access(TMPFS_DIR, os.W_OK):
+        return False
+    try:
+        with open('/proc/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2 and fields[1] == TMPFS_DIR:
+                    return fields[2] == 'tmpfs'
+    except IOError:
+        pass
+    return False
+
+
+def _record(root, name, size, total_quota=None):
+    """
+    Records in the ledger of ``root`` that the scratch directory ``name`` reserves ``size`` bytes,
+    unless that takes the reservations in the root over ``total_quota``; returns whether it did.
+    """
+    ledger_path = os.path.join(root, LEDGER_NAME)
+    with utils.file_lock(ledger_path + '.lock'):
+        ledger = utils.read_json(ledger_path, {})
+        if total_quota is not None and size > ledger.get(name, 0) and \
+                sum(ledger.values()) - ledger.get(name, 0) + size > total_quota:
+            return False
+        if size:
+            ledger[name] = size
+        else:
+            ledger.pop(name, None)
+        utils.write_json(ledger_path, ledger)
+    return True
+
+
+def _alive(name):
+    """
+    Whether the process a scratch directory is named after is still running (names that aren't
+    of scratch directories count as alive).
+    """
+    pid = name.split('-', 1)[0]
+    return not pid.isdigit() or utils.process_alive(int(pid))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
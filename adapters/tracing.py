@@ -0,0 +1,184 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Span-based tracing of adapter calls.
+
+Setting ``ARIA_CLOUDIFY_TRACE_FILE`` makes every operation append its spans to that file, one
+JSON object per line, as complete ("X") events of the Chrome Trace Event Format. Spans nest under
+the operation span by time containment on the same pid/tid, and also reference their parent span
+id. :func:`to_chrome_trace` turns the file into a trace loadable by chrome://tracing or Perfetto.
+
+Tracing is on per thread, so that the tasks a bulk worker runs on threads of their own (see
+:mod:`adapters.bulk`) each get their operation span. Spans of threads an operation starts itself
+are not recorded. When tracing is off, a :func:`traced` function costs a single thread-local lookup
+on top of the call.
+"""
+
+import os
+import sys
+import json
+import time
+import itertools
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+from . import utils
+
+
+TRACE_FILE_ENV = 'ARIA_CLOUDIFY_TRACE_FILE'
+
+
+class _Active(threading.local):
+    # Tracer of the operation running on the thread
+    tracer = None
+
+
+_active = _Active()
+
+
+class Tracer(object):
+
+    def __init__(self, path):
+        self._path = path
+        self._events = []
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+
+    @property
+    def path(self):
+        return self._path
+
+    @contextmanager
+    def span(self, name, category='adapter', **args):
+        stack = self._stack()
+        span_id = next(self._ids)
+        if stack:
+            args['parent_id'] = stack[-1]
+        args['span_id'] = span_id
+        stack.append(span_id)
+        start = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            stack.pop()
+            self._events.append({
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': start * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': os.getpid(),
+                'tid': threading.current_thread().ident,
+                'args': args
+            })
+
+    def flush(self):
+        events, self._events = self._events, []
+        if not events:
+            return
+        lines = ''.join(json.dumps(event, default=str) + '\n' for event in events)
+        with utils.file_lock(self._path + '.lock'):
+            with open(self._path, 'ab') as f:
+                f.write(lines)
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+
+def enabled():
+    return utils.env_path(TRACE_FILE_ENV) is not None
+
+
+def traced(name):
+    """
+    Decorates a function so that every call to it is recorded as a span while tracing is on.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            tracer = _active.tracer
+            if tracer is None:
+                return function(*args, **kwargs)
+            with tracer.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def span(name, **args):
+    tracer = _active.tracer
+    if tracer is None:
+        yield
+    else:
+        with tracer.span(name, **args):
+            yield
+
+
+@contextmanager
+def traced_context(name, context_manager):
+    """
+    Enters ``context_manager`` with its entry and exit recorded as two spans, so the time spent in
+    the block itself is not attributed to it.
+    """
+    with span(name):
+        value = context_manager.__enter__()
+    try:
+        yield value
+    except BaseException:
+        with span(name + ':exit'):
+            if not context_manager.__exit__(*sys.exc_info()):
+                raise
+    else:
+        with span(name + ':exit'):
+            context_manager.__exit__(None, None, None)
+
+
+@contextmanager
+def operation_span(name, path=None, **args):
+    """
+    Turns tracing on for the duration of an operation running on the calling thread, under a root
+    span that carries ``args``, and appends the collected spans to the trace file. Does nothing
+    unless a path is given or configured.
+    """
+    path = path or utils.env_path(TRACE_FILE_ENV)
+    if path is None or _active.tracer is not None:
+        yield
+        return
+
+    tracer = _active.tracer = Tracer(path)
+    try:
+        with tracer.span(name, category='operation', **args):
+            yield
+    finally:
+        _active.tracer = None
+        tracer.flush()
+
+
+def to_chrome_trace(trace_file, output_path):
+    """
+    Converts a trace file of JSON lines into a JSON object trace.
+    """
+    with open(trace_file, 'rb') as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    utils.write_json(output_path, {'traceEvents': events, 'displayTimeUnit': 'ms'})
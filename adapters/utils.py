@@ -0,0 +1,140 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+import json
+import errno
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+def env_path(name):
+    """
+    Returns the expanded path stored in the environment variable ``name``, or ``None`` if it is
+    not set. Environment variables are used for configuration since they are inherited by the
+    process executor subprocesses.
+    """
+    value = os.environ.get(name)
+    if not value:
+        return None
+    return os.path.expanduser(os.path.expandvars(value))
+
+
+def operation_name(aria_name):
+    """
+    Translates an ARIA task name into a Cloudify operation name.
+    """
+    # We needed to modify the operation's 'name' property in order to support the Cloudify AWS
+    # plugin. It can't use ARIA's operation naming convention, as any operation we want to run
+    # using the Cloudify AWS plugin must have its name in the format:
+    # '<something>.<operation_name>'.
+    return aria_name.split('@')[0].replace(':', '.')
+
+
+def cloudify_type_hierarchy(type_):
+    """
+    Translates the hierarchy of an ARIA node type into Cloudify type names.
+    """
+    # We needed to modify the type hierarchy to be a list of strings that include the word
+    # 'cloudify' in each one of them instead of 'aria', since in the Cloudify AWS plugin, that
+    # we currently wish to support, if we want to attach an ElasticIP to a node, this node's
+    # type_hierarchy property must be a list of strings only, and it must contain either the
+    # string 'cloudify.aws.nodes.Instance', or the string 'cloudify.aws.nodes.Interface'.
+    # In any other case, we won't be able to attach an ElasticIP to a node using the Cloudify
+    # AWS plugin.
+    type_hierarchy_names = [t.name for t in type_.hierarchy if t.name is not None]
+    return [type_name.replace('aria', 'cloudify') for type_name in type_hierarchy_names]
+
+
+def process_alive(pid):
+    """
+    Whether the process ``pid`` is running (always assumed on Windows).
+    """
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Holds an exclusive lock on ``path`` (created if needed) for the duration of the block. The
+    lock is released by the OS if the holding process dies.
+    """
+    makedirs(os.path.dirname(path))
+    with open(path, 'a+') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield f
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def read_json(path, default=None):
+    try:
+        with open(path, 'rb') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def write_atomic(path, content):
+    """
+    Replaces the content of ``path`` without ever exposing a partially written file.
+    """
+    directory = os.path.dirname(path)
+    makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_json(path, value):
+    write_atomic(path, json.dumps(value))
@@ -0,0 +1,125 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Memoized ``creation_validation`` results.
+
+Validation operations check a node's properties against the cloud, which takes several round trips
+and gives the same answer as long as the properties and the plugin don't change. Set
+``ARIA_CLOUDIFY_VALIDATION_CACHE`` to a directory to remember successful validations, keyed by a
+hash of the node properties, operation inputs, operation name, function and plugin package
+name and version. A validation with a remembered success is skipped (and succeeds) for
+``ARIA_CLOUDIFY_VALIDATION_CACHE_TTL`` seconds, a day by default. Failed validations are not
+remembered. :meth:`ValidationCache.invalidate` and :meth:`ValidationCache.clear` drop results
+before they expire, e.g. after changing something the validation checks outside the node.
+"""
+
+import os
+import json
+import time
+import hashlib
+
+from . import utils
+
+
+VALIDATION_CACHE_ENV = 'ARIA_CLOUDIFY_VALIDATION_CACHE'
+VALIDATION_CACHE_TTL_ENV = 'ARIA_CLOUDIFY_VALIDATION_CACHE_TTL'
+
+DEFAULT_TTL = 24 * 60 * 60
+
+VALIDATION_OPERATIONS = ('cloudify.interfaces.validation.creation', 'Validation.creation')
+
+
+class ValidationCache(object):
+
+    def __init__(self, directory, ttl=DEFAULT_TTL):
+        self._directory = directory
+        self._ttl = ttl
+
+    @classmethod
+    def from_environment(cls):
+        directory = utils.env_path(VALIDATION_CACHE_ENV)
+        if directory is None:
+            return None
+        return cls(directory, ttl=float(os.environ.get(VALIDATION_CACHE_TTL_ENV) or DEFAULT_TTL))
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def get(self, key):
+        """
+        The entry remembered for ``key``, or ``None`` if there is none or it expired.
+        """
+        entry = utils.read_json(self._path(key))
+        if entry is None:
+            return None
+        if time.time() - entry['validated_at'] > self._ttl:
+            self.invalidate(key)
+            return None
+        return entry
+
+    def add(self, key, **details):
+        """
+        Remembers a successful validation; ``details`` (e.g. the operation and plugin) are kept
+        with it, for :meth:`clear`.
+        """
+        entry = dict(details, validated_at=time.time())
+        utils.write_json(self._path(key), entry)
+        return entry
+
+    def invalidate(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self, **details):
+        """
+        Drops the remembered validations whose details match ``details`` (all of them if none are
+        given). Returns how many were dropped.
+        """
+        if not os.path.isdir(self._directory):
+            return 0
+        cleared = 0
+        for name in os.listdir(self._directory):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            entry = utils.read_json(self._path(key)) or {}
+            if all(entry.get(detail) == value for detail, value in details.items()):
+                self.invalidate(key)
+                cleared += 1
+        return cleared
+
+    def _path(self, key):
+        return os.path.join(self._directory, '{0}.json'.format(key))
+
+
+def is_validation(function, operation):
+    """
+    Whether the operation ``operation`` calling ``function`` validates node creation.
+    """
+    return operation in VALIDATION_OPERATIONS or function.endswith('creation_validation')
+
+
+def key(function, operation, package_name, package_version, properties, inputs):
+    """
+    A stable hash of everything a validation result depends on.
+    """
+    return hashlib.sha256(json.dumps(
+        [function, operation, package_name, package_version, properties, inputs],
+        sort_keys=True, default=repr)).hexdigest()
@@ -0,0 +1,199 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Node instance versions for optimistic concurrency.
+
+A node instance version counts the committed writes of the node instance and of its runtime
+properties, so that an adapter can tell whether another worker wrote the node instance since it
+was loaded. Once :func:`track_writes` is called, every storage session commit in the process that
+writes node instances advances their versions, whatever made the write: ``update()``, or the
+instrumented runtime properties Cloudify operations write. The write and the version advance
+happen under the version's lock.
+
+The count is kept apart from the node's own ``version`` column: ARIA's mapper checks that column
+on every write of the node row, so bumping it would make concurrent writers of unrelated runtime
+properties fail. Counts are shared by the workers of an executor through a small file per node
+instance, in a directory the executor creates (in ``ARIA_CLOUDIFY_NODE_VERSIONS_DIR``, or the
+temporary directory) and removes when it is closed. Operations run without it keep no versions.
+"""
+
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import (event, orm)
+
+from . import utils
+
+
+NODE_VERSIONS_DIR_ENV = 'ARIA_CLOUDIFY_NODE_VERSIONS_DIR'
+# Set by the executor for its operations
+EXECUTOR_VERSIONS_DIR_ENV = 'ARIA_CLOUDIFY_EXECUTOR_VERSIONS_DIR'
+
+# Session info keys: node instance ids written in the transaction, and the locks acquired for them
+_WRITTEN = 'aria_cloudify_written_nodes'
+_LOCKS = 'aria_cloudify_node_version_locks'
+
+
+class _Local(threading.local):
+
+    def __init__(self):
+        # Paths of the version files the thread holds the lock of
+        self.held = set()
+        # Version file path: {version: version after}, for the writes the thread committed
+        self.written = {}
+
+
+_local = _Local()
+_tracking_lock = threading.Lock()
+_tracking = False
+
+
+def create_directory():
+    """
+    Creates the version directory of an executor.
+    """
+    parent = utils.env_path(NODE_VERSIONS_DIR_ENV)
+    if parent is not None:
+        utils.makedirs(parent)
+    return tempfile.mkdtemp(prefix='aria-node-versions-', dir=parent)
+
+
+def enabled():
+    return utils.env_path(EXECUTOR_VERSIONS_DIR_ENV) is not None
+
+
+class NodeVersion(object):
+
+    def __init__(self, node_id, directory):
+        """
+        :param node_id: id of the node instance
+        :param directory: version directory of the executor
+        """
+        self._path = os.path.join(directory, '{0}.json'.format(node_id))
+
+    @classmethod
+    def from_environment(cls, node_id):
+        directory = utils.env_path(EXECUTOR_VERSIONS_DIR_ENV)
+        if directory is None:
+            return None
+        return cls(node_id, directory)
+
+    @property
+    def current(self):
+        return utils.read_json(self._path, default=None) or 0
+
+    @contextmanager
+    def held(self):
+        """
+        Holds the version for the block, which gets the current version: other writers of the node
+        instance wait, and writes the block commits advance the version.
+        """
+        with _holding(self._path):
+            yield self.current
+
+    def caught_up(self, version):
+        """
+        ``version``, advanced past the writes the calling thread committed on top of it. Writes of
+        other workers meanwhile leave it behind the current version.
+        """
+        written = _local.written.get(self._path, {})
+        while version in written:
+            version = written[version]
+        return version
+
+    def advance(self):
+        with _holding(self._path):
+            version = self.current
+            utils.write_json(self._path, version + 1)
+            _local.written.setdefault(self._path, {})[version] = version + 1
+
+
+def track_writes():
+    """
+    Advances the versions of the node instances written by the storage sessions of the process.
+    """
+    global _tracking
+    with _tracking_lock:
+        if _tracking:
+            return
+        event.listen(orm.Session, 'before_flush', _before_flush)
+        event.listen(orm.Session, 'after_commit', _after_commit)
+        event.listen(orm.Session, 'after_rollback', _after_rollback)
+        _tracking = True
+
+
+@contextmanager
+def _holding(path):
+    if path in _local.held:
+        yield
+        return
+    with utils.file_lock(path + '.lock'):
+        _local.held.add(path)
+        try:
+            yield
+        finally:
+            _local.held.discard(path)
+
+
+def _before_flush(session, flush_context, instances):
+    from aria.modeling import models
+
+    if not enabled():
+        return
+    written = session.info.setdefault(_WRITTEN, set())
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, models.Node):
+            node = instance
+        elif isinstance(instance, models.Attribute):
+            node = instance.node
+            if node is None:
+                continue
+        else:
+            continue
+        if instance in session.new or instance in session.deleted or \
+                session.is_modified(instance):
+            written.add(node.id)
+
+    # New node instances have no id yet, nor other writers
+    locks = session.info.setdefault(_LOCKS, [])
+    for node_id in sorted(node_id for node_id in written if node_id is not None):
+        path = NodeVersion.from_environment(node_id)._path
+        if path not in _local.held:
+            lock = _holding(path)
+            lock.__enter__()
+            locks.append(lock)
+
+
+def _after_commit(session):
+    try:
+        for node_id in session.info.pop(_WRITTEN, ()):
+            if node_id is not None:
+                NodeVersion.from_environment(node_id).advance()
+    finally:
+        _release(session)
+
+
+def _after_rollback(session):
+    session.info.pop(_WRITTEN, None)
+    _release(session)
+
+
+def _release(session):
+    for lock in reversed(session.info.pop(_LOCKS, [])):
+        lock.__exit__(None, None, None)
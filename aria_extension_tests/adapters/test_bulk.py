@@ -0,0 +1,74 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import pytest
+
+from adapters import bulk
+
+
+def test_next(reported):
+    tasks = _tasks(1, 2)
+    arguments, messenger = tasks.next()
+    assert arguments['task_id'] == 1
+    messenger.started()
+    messenger.succeeded()
+    tasks.done(1)
+    assert tasks.next()[0]['task_id'] == 2
+    assert tasks.next() is None
+    assert reported == [(1, 'started', None), (1, 'succeeded', None)]
+
+
+def test_abandon(reported):
+    tasks = _tasks(1, 2, 3)
+    _, stuck = tasks.next()
+    _, running = tasks.next()
+    error = RuntimeError('stuck')
+
+    assert tasks.abandon(1, error)
+    assert reported[0] == (1, 'failed', error)
+    others = dict((task_id, exception) for task_id, _, exception in reported[1:])
+    assert sorted(others) == [2, 3]
+    assert all(isinstance(exception, bulk.WorkerAbandoned) and exception.retry_interval == 0
+               for exception in others.values())
+
+    # Abandoned tasks neither run nor report anymore
+    assert tasks.next() is None
+    stuck.succeeded()
+    running.succeeded()
+    assert len(reported) == 3
+
+
+def test_abandon_outside_worker(reported):
+    assert not bulk.abandon(1, RuntimeError())
+    assert not _tasks(1).abandon(1, RuntimeError())
+    assert reported == []
+
+
+def _tasks(*task_ids):
+    tasks = bulk._Tasks()
+    for task_id in task_ids:
+        tasks.put({'task_id': task_id, 'port': 1234})
+    return tasks
+
+
+@pytest.fixture
+def reported(monkeypatch):
+    result = []
+
+    def send_message(messenger, type, exception=None):
+        result.append((messenger.task_id, type, exception))
+    monkeypatch.setattr(bulk.process._Messenger, '_send_message', send_message)
+    return result
@@ -0,0 +1,76 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+
+import pytest
+
+from adapters import checkpoints
+
+
+def test_checkpoints(tmpdir):
+    ctx = _Context(str(tmpdir), task_id=7)
+    first = checkpoints.Checkpoints.of(ctx)
+    assert first.markers == {}
+    first.save('created', 'i-123')
+    first.save('tagged')
+    assert first.path == str(tmpdir.join(checkpoints.CHECKPOINTS_DIR, '3', '7.json'))
+
+    # As read by the next attempt
+    second = checkpoints.Checkpoints.of(ctx)
+    assert second.markers == {'created': 'i-123', 'tagged': True}
+    markers = second.markers
+    markers['attached'] = True
+    assert 'attached' not in second.markers
+
+    second.clear()
+    assert second.markers == {}
+    assert not os.path.exists(second.path)
+    assert tmpdir.join(checkpoints.CHECKPOINTS_DIR).listdir() == []
+    assert checkpoints.Checkpoints.of(ctx).markers == {}
+    second.clear()
+
+
+def test_checkpoints_per_task(tmpdir):
+    checkpoints.Checkpoints.of(_Context(str(tmpdir), task_id=1)).save('created')
+    assert checkpoints.Checkpoints.of(_Context(str(tmpdir), task_id=2)).markers == {}
+    assert checkpoints.Checkpoints.of(
+        _Context(str(tmpdir), task_id=1, execution_id=4)).markers == {}
+
+
+def test_no_plugin(tmpdir):
+    ctx = _Context(None, task_id=7)
+    assert not checkpoints.available(ctx)
+    with pytest.raises(ValueError):
+        checkpoints.Checkpoints.of(ctx)
+    assert checkpoints.available(_Context(str(tmpdir), task_id=7))
+
+
+class _Model(object):
+
+    def __init__(self, id, plugin=None, execution=None):
+        self.id = id
+        self.plugin = plugin
+        self.execution = execution
+
+
+class _Context(object):
+
+    def __init__(self, plugin_workdir, task_id, execution_id=3):
+        self.plugin_workdir = plugin_workdir
+        self.task = _Model(task_id,
+                           plugin='plugin' if plugin_workdir else None,
+                           execution=_Model(execution_id))
@@ -0,0 +1,116 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+
+import pytest
+import sqlalchemy
+from sqlalchemy import orm
+
+from adapters import concurrency
+
+
+class TestConcurrencyController(object):
+
+    def test_io_bound(self):
+        controller = concurrency.ConcurrencyController(1, 32, cpus=2)
+        assert controller.limit == 2
+        limits = [_observe(controller, cpu_time=0.05) for _ in range(5)]
+        # Doubles at most, up to the maximum
+        assert limits == [4, 8, 16, 32, 32]
+
+    def test_cpu_bound(self):
+        controller = concurrency.ConcurrencyController(16, 64, cpus=4)
+        controller._limit = 40
+        limits = [_observe(controller, cpu_time=1) for _ in range(4)]
+        # Shrinks towards the number of CPUs, but not below the minimum
+        assert limits == [20, 16, 16, 16]
+
+    def test_cpu_wait(self):
+        controller = concurrency.ConcurrencyController(1, 32, cpus=1)
+        controller._limit = 8
+        # Tasks that mostly waited for the CPU are CPU-bound, however small their CPU share
+        limits = [_observe(controller, cpu_time=0.1, cpu_wait=0.9) for _ in range(4)]
+        assert limits == [4, 2, 1, 1]
+
+    def test_storage_contention(self):
+        controller = concurrency.ConcurrencyController(1, 64, cpus=4)
+        controller._limit = 32
+        assert _observe(controller, cpu_time=0.05, storage_time=0.5) == 16
+        assert _observe(controller, cpu_time=0.05, storage_time=0.3) == 11
+        # Grows back once commits stop dominating
+        assert _observe(controller, cpu_time=0.05, storage_time=0.1) == 22
+
+    def test_window(self):
+        controller = concurrency.ConcurrencyController(1, 32, cpus=2)
+        for _ in range(controller.WINDOW - 1):
+            assert controller.observe(1, 0.05, 0) == 2
+        assert controller.observe(1, 0.05, 0) == 4
+
+    def test_from_environment(self, monkeypatch):
+        monkeypatch.delenv(concurrency.ADAPTIVE_WORKERS_ENV, raising=False)
+        assert concurrency.ConcurrencyController.from_environment() is None
+        monkeypatch.setenv(concurrency.ADAPTIVE_WORKERS_ENV, '2:48')
+        assert concurrency.ConcurrencyController.from_environment().bounds == (2, 48)
+
+
+def test_usage_report(tmpdir, monkeypatch, model):
+    monkeypatch.setenv(concurrency.TASK_USAGE_DIR_ENV, str(tmpdir))
+    with concurrency.usage_report('task-1', model):
+        sum(range(1000000))
+        model.node._session.execute('INSERT INTO entries VALUES (1)')
+        model.node._session.commit()
+
+    wall_time, cpu_time, storage_time, cpu_wait = concurrency.read_usage(str(tmpdir), 'task-1')
+    assert wall_time > 0
+    assert cpu_time > 0
+    assert wall_time >= storage_time > 0
+    assert wall_time >= cpu_wait >= 0
+    assert os.listdir(str(tmpdir)) == []
+    assert concurrency.read_usage(str(tmpdir), 'task-1') is None
+
+
+def test_usage_report_disabled(monkeypatch, model):
+    monkeypatch.delenv(concurrency.TASK_USAGE_DIR_ENV, raising=False)
+    with concurrency.usage_report('task-1', model):
+        pass
+
+
+@pytest.fixture
+def model():
+    engine = sqlalchemy.create_engine('sqlite://')
+    engine.execute('CREATE TABLE entries (id INTEGER)')
+    session = orm.sessionmaker(bind=engine)()
+    yield _Model(session)
+    session.close()
+
+
+def _observe(controller, cpu_time, storage_time=0, cpu_wait=0):
+    for _ in range(controller.WINDOW):
+        controller.observe(1, cpu_time, storage_time, cpu_wait)
+    return controller.limit
+
+
+class _Storage(object):
+
+    def __init__(self, session):
+        self._session = session
+
+
+class _Model(object):
+
+    def __init__(self, session):
+        self.node = _Storage(session)
@@ -16,11 +16,14 @@
 
 import os
 import copy
+import time
 import datetime
+import threading
 import contextlib
 
 import pytest
 
+import aria
 from aria import (workflow, operation)
 from aria.modeling import models
 from aria.orchestrator import events
@@ -35,7 +38,8 @@ import tests
 from tests import (mock, storage, conftest)
 from tests.orchestrator.workflows.helpers import events_collector
 
-from adapters import context_adapter
+from adapters import (bulk, checkpoints, context_adapter, deadlines,
+                      executor as executor_module, records, scratch, validation)
 
 
 @pytest.fixture(autouse=True)
@@ -149,10 +153,209 @@ class TestCloudifyContextAdapter(object):
             assert f.read() == content
         with open(out['download_resource_and_render'], 'rb') as f:
             assert f.read() == rendered
+        assert out['iter_resource'] == content
+        assert out['iter_resource_and_render'] == rendered
 
         os.remove(out['download_resource'])
         os.remove(out['download_resource_and_render'])
 
+    def test_scratch_space(self, tmpdir, executor, workflow_context, monkeypatch):
+        monkeypatch.setenv(scratch.SCRATCH_DIR_ENV, str(tmpdir.join('scratch')))
+        resource_path = 'resource'
+        source = tmpdir.join(resource_path)
+        source.write('content')
+        workflow_context.resource.service.upload(
+            entry_id=str(workflow_context.service.id),
+            source=str(source),
+            path=resource_path)
+
+        out = self._run(executor, workflow_context, _test_scratch_space,
+                        inputs={'resource': resource_path})
+
+        assert out['scratch'].startswith(str(tmpdir.join('scratch')))
+        assert out['scratch_content'] == 'content'
+        # Scratch files are removed as the operation ends, unless kept
+        assert os.listdir(str(tmpdir.join('scratch'))) == []
+        with open(out['kept'], 'rb') as f:
+            assert f.read() == 'content'
+        os.remove(out['kept'])
+
+    def test_prefetched_resource(self, tmpdir, workflow_context):
+        resource_path = 'scripts/configure.sh'
+        source = tmpdir.join('configure.sh')
+        source.write('content')
+        workflow_context.resource.service_template.upload(
+            entry_id=str(workflow_context.service_template.id),
+            source=str(source),
+            path=resource_path)
+        prefetching_executor = executor_module.CloudifyProcessExecutor(
+            prefetch_workers=2, python_path=[tests.ROOT_DIR])
+        try:
+            out = self._run(prefetching_executor, workflow_context, _test_get_resource,
+                            inputs={'script_path': resource_path})
+        finally:
+            prefetching_executor.close()
+
+        assert out['get_resource'] == 'content'
+
+    def test_max_workers(self, workflow_context):
+        capped_executor = executor_module.CloudifyProcessExecutor(
+            max_workers=1, python_path=[tests.ROOT_DIR])
+        try:
+            out = self._run(capped_executor, workflow_context, _test_node_instance_operation)
+        finally:
+            capped_executor.close()
+
+        assert out['instance']['id'] == self._get_node(workflow_context).id
+
+    def test_large_inputs(self, workflow_context):
+        parameters = {'BlockDeviceMappings': [{'DeviceName': '/dev/sd{0}'.format(letter),
+                                               'Ebs': {'VolumeSize': 100}}
+                                              for letter in 'bcdefghijklmnop']}
+        plugin = self._put_plugin(workflow_context, mock_cfy_plugin=True)
+        blob_executor = executor_module.CloudifyProcessExecutor(
+            input_threshold=256, python_path=[tests.ROOT_DIR])
+        try:
+            # The task record is larger than the threshold too, and the operation takes no
+            # **kwargs
+            out = self._run(blob_executor, workflow_context, _test_large_inputs,
+                            inputs={'parameters': parameters, 'image_id': 'ami-1'},
+                            skip_common_assert=True,
+                            plugin=plugin,
+                            compiler=records.CloudifyGraphCompiler)
+            # Only the large input was passed in a blob
+            assert len(os.listdir(blob_executor._input_store.directory)) == 1
+        finally:
+            blob_executor.close()
+
+        assert out['parameters'] == parameters
+        assert out['image_id'] == 'ami-1'
+        assert out['recorded']
+
+    def test_bulk(self, workflow_context):
+        plugin = self._put_plugin(workflow_context, mock_cfy_plugin=True)
+        node = self._get_node(workflow_context)
+        node.interfaces['test'] = mock.models.create_interface(
+            node.service, 'test', 'op',
+            operation_kwargs={'function': '{0}.{1}'.format(__name__, _test_bulk.__name__),
+                              'plugin': plugin,
+                              'arguments': {}})
+        operation_inputs = node.interfaces['test'].operations['op'].inputs
+        for input_name, input in (('index', 0), ('fail', False)):
+            operation_inputs[input_name] = models.Input(name=input_name,
+                                                        type_name=type_.full_type_name(input))
+        workflow_context.model.node.update(node)
+
+        @workflow
+        def mock_workflow(graph, **kwargs):
+            graph.add_tasks(*[api.task.OperationTask(node, 'test', 'op',
+                                                     arguments={'index': index,
+                                                                'fail': index == 2},
+                                                     ignore_failure=True)
+                              for index in range(4)])
+
+        bulk_executor = executor_module.CloudifyProcessExecutor(
+            bulk_size=4, bulk_threads=1, python_path=[tests.ROOT_DIR])
+        signal = events.on_failure_task_signal
+        try:
+            with events_collector(signal) as collected:
+                graph_compiler.GraphCompiler(workflow_context, bulk_executor.__class__).compile(
+                    mock_workflow(ctx=workflow_context))
+                eng = engine.Engine(executors={bulk_executor.__class__: bulk_executor})
+                eng.execute(workflow_context)
+        finally:
+            bulk_executor.close()
+
+        attributes = self._get_node(workflow_context).attributes
+        outs = [attributes['bulk_{0}'.format(index)].value for index in (0, 1, 3)]
+        assert 'bulk_2' not in attributes
+        # All the tasks ran in the same worker, each with a context of its own
+        assert len(set(out['pid'] for out in outs)) == 1
+        assert len(set(out['task_id'] for out in outs)) == 3
+        exceptions = [event['kwargs']['exception'] for event in collected[signal]]
+        assert len(exceptions) == 1
+        assert isinstance(exceptions[0], TaskAbortException)
+        assert exceptions[0].message == 'bulk-2'
+
+    def test_bulk_stuck_operation(self, workflow_context, tmpdir, monkeypatch):
+        timeouts = tmpdir.join('timeouts.json')
+        timeouts.write('{"*": 0.2}')
+        monkeypatch.setenv(deadlines.OPERATION_TIMEOUTS_ENV, str(timeouts))
+        monkeypatch.setenv(deadlines.TIMEOUT_GRACE_ENV, '0.2')
+        plugin = self._put_plugin(workflow_context, mock_cfy_plugin=True)
+        node = self._get_node(workflow_context)
+        node.interfaces['test'] = mock.models.create_interface(
+            node.service, 'test', 'op',
+            operation_kwargs={'function': '{0}.{1}'.format(__name__, _test_bulk_stuck.__name__),
+                              'plugin': plugin,
+                              'arguments': {}})
+        workflow_context.model.node.update(node)
+
+        @workflow
+        def mock_workflow(graph, **kwargs):
+            graph.add_tasks(*[api.task.OperationTask(node, 'test', 'op', max_attempts=1,
+                                                     ignore_failure=True)
+                              for _ in range(3)])
+
+        # The first task gets stuck, and the others queue behind it
+        bulk_executor = executor_module.CloudifyProcessExecutor(
+            bulk_size=3, bulk_threads=1, python_path=[tests.ROOT_DIR])
+        signal = events.on_failure_task_signal
+        try:
+            with events_collector(signal) as collected:
+                graph_compiler.GraphCompiler(workflow_context, bulk_executor.__class__).compile(
+                    mock_workflow(ctx=workflow_context))
+                eng = engine.Engine(executors={bulk_executor.__class__: bulk_executor})
+                eng.execute(workflow_context)
+            # The worker exited, freeing its slot
+            assert bulk_executor._workers() == 0
+        finally:
+            bulk_executor.close()
+
+        exceptions = [event['kwargs']['exception'] for event in collected[signal]]
+        assert len(exceptions) == 3
+        timeouts = [e for e in exceptions if isinstance(e, deadlines.OperationTimeout)]
+        assert len(timeouts) == 1
+        assert all(isinstance(e, bulk.WorkerAbandoned) for e in exceptions
+                   if e not in timeouts)
+
+    def test_refresh(self, versioned_executor, workflow_context):
+        out = self._run(versioned_executor, workflow_context, _test_refresh)
+
+        assert out['refresh']['unchanged_version'] == out['refresh']['initial_version']
+        assert out['refresh']['refreshed_version'] > out['refresh']['initial_version']
+        assert out['refresh']['concurrent'] is True
+
+    def test_refresh_without_versions(self, executor, workflow_context):
+        out = self._run(executor, workflow_context, _test_refresh)
+
+        # Every refresh reloads the node instance
+        assert out['refresh']['initial_version'] is None
+        assert out['refresh']['refreshed_version'] is None
+        assert out['refresh']['concurrent'] is True
+
+    def test_concurrent_runtime_properties(self, versioned_executor, workflow_context):
+        out = self._run(versioned_executor, workflow_context, _test_concurrent_runtime_properties)
+
+        versions = out['concurrent_runtime_properties']
+        # The operation's own writes keep its version current, the concurrent one doesn't
+        assert versions['version'] == versions['initial_version'] + 1
+        assert versions['refreshed_version'] == versions['initial_version'] + 3
+        assert versions['conflict_error'] is True
+        node = self._get_node(workflow_context)
+        assert node.attributes['concurrent'].value is True
+        assert node.attributes['mine'].value is True
+        assert node.attributes['mine_again'].value is True
+
+    def test_update_on_conflict(self, versioned_executor, workflow_context):
+        out = self._run(versioned_executor, workflow_context, _test_update_on_conflict)
+
+        assert out['update']['conflict_error'] is True
+        assert out['update']['conflicts'] == [{'concurrent': True}]
+        node = self._get_node(workflow_context)
+        assert node.attributes['concurrent'].value is True
+        assert node.attributes['mine'].value is True
+
     def test_retry(self, executor, workflow_context):
         message = 'retry-message'
         retry_interval = 0.01
@@ -171,6 +374,58 @@ class TestCloudifyContextAdapter(object):
         assert out['operation']['retry_number'] == 1
         assert out['operation']['max_retries'] == 1
 
+    def test_checkpoints(self, executor, workflow_context, tmpdir):
+        plugin = self._put_plugin(workflow_context)
+        out = self._run(executor, workflow_context, _test_checkpoints, max_attempts=2,
+                        plugin=plugin)
+
+        assert out['operation']['retry_number'] == 1
+        assert out['checkpoints'] == {'created': 'i-123'}
+        # Checkpoints are removed once the operation succeeds
+        checkpoints_dir = tmpdir.join('workdir', 'plugins', str(workflow_context.service.id),
+                                      plugin.name, checkpoints.CHECKPOINTS_DIR)
+        assert checkpoints_dir.listdir() == []
+
+    def test_operation_timeout(self, executor, workflow_context, tmpdir, monkeypatch):
+        timeouts = tmpdir.join('timeouts.json')
+        timeouts.write('{"*": 0.2}')
+        monkeypatch.setenv(deadlines.OPERATION_TIMEOUTS_ENV, str(timeouts))
+        monkeypatch.setenv(deadlines.TIMEOUT_GRACE_ENV, '0.2')
+
+        exception = self._run_and_get_task_exceptions(
+            executor, workflow_context, _test_operation_timeout, max_attempts=1)[-1]
+
+        assert isinstance(exception, TaskRetryException)
+        assert exception.retry_interval == deadlines.RETRY_BACKOFF
+        out = self._get_node(workflow_context).attributes['out'].value
+        assert out['cancelled'] == [False, True]
+
+    def test_validation_cache(self, executor, workflow_context, tmpdir, monkeypatch):
+        monkeypatch.setenv(validation.VALIDATION_CACHE_ENV, str(tmpdir.join('validations')))
+
+        out = self._run(executor, workflow_context, _test_creation_validation,
+                        skip_common_assert=True)
+
+        assert out == {'validated': True}
+        cache = validation.ValidationCache.from_environment()
+        assert cache.clear(operation='test.op', node=self._get_node(workflow_context).name) == 1
+
+    def test_validation_cache_hit(self, executor, workflow_context, tmpdir, monkeypatch):
+        monkeypatch.setenv(validation.VALIDATION_CACHE_ENV, str(tmpdir.join('validations')))
+        node = self._get_node(workflow_context)
+        node.attributes['out'] = models.Attribute.wrap('out', {'validated': False})
+        workflow_context.model.node.update(node)
+        properties = dict((name, prop.value) for name, prop in node.properties.items())
+        validation.ValidationCache.from_environment().add(validation.key(
+            '{0}.{1}'.format(__name__, _test_creation_validation.__name__), 'test.op', None, None,
+            properties, {}))
+
+        out = self._run(executor, workflow_context, _test_creation_validation,
+                        skip_common_assert=True)
+
+        # The validation was skipped
+        assert out == {'validated': False}
+
     def test_logger_and_send_event(self, executor, workflow_context):
         # TODO: add assertions of output once process executor output can be captured
         message = 'logger-message'
@@ -199,6 +454,38 @@ class TestCloudifyContextAdapter(object):
                         plugin=plugin)
         assert out['inputs'] == test_inputs
 
+    def test_task_record(self, executor, workflow_context):
+        plugin = self._put_plugin(workflow_context, mock_cfy_plugin=True)
+        test_inputs = {'input1': 1}
+
+        out = self._run(executor, workflow_context, _test_task_record,
+                        inputs=test_inputs,
+                        skip_common_assert=True,
+                        plugin=plugin,
+                        max_attempts=3,
+                        compiler=records.CloudifyGraphCompiler)
+
+        node_template = self._get_node_template(workflow_context)
+        node = self._get_node(workflow_context)
+        assert out == {
+            'recorded': True,
+            'inputs': test_inputs,
+            'blueprint_id': workflow_context.service_template.id,
+            'deployment_id': workflow_context.service.id,
+            'execution_id': workflow_context.execution.id,
+            'workflow_id': workflow_context.execution.workflow_name,
+            'task_name': '{0}._test_task_record'.format(__name__),
+            'operation_name': 'test.op',
+            'max_retries': 2,
+            'node_id': node_template.id,
+            'node_name': node_template.name,
+            'node_type': node_template.type.name,
+            'type_hierarchy': [type_.name.replace('aria', 'cloudify')
+                               for type_ in node_template.type.hierarchy],
+            'instance_id': node.id,
+            'plugin': [plugin.name, plugin.package_name, plugin.package_version]
+        }
+
     def test_non_recoverable_error(self, executor, workflow_context):
         message = 'NON_RECOVERABLE_MESSAGE'
         plugin = self._put_plugin(workflow_context, mock_cfy_plugin=True)
@@ -254,7 +541,8 @@ class TestCloudifyContextAdapter(object):
              max_attempts=None,
              skip_common_assert=False,
              operation_end=None,
-             plugin=None):
+             plugin=None,
+             compiler=graph_compiler.GraphCompiler):
         interface_name = 'test'
         operation_name = 'op'
         op_dict = {'function': '{0}.{1}'.format(__name__, func.__name__),
@@ -301,7 +589,7 @@ class TestCloudifyContextAdapter(object):
             graph.add_tasks(task)
 
         tasks_graph = mock_workflow(ctx=workflow_context)
-        graph_compiler.GraphCompiler(workflow_context, executor.__class__).compile(tasks_graph)
+        compiler(workflow_context, executor.__class__).compile(tasks_graph)
         eng = engine.Engine(executors={executor.__class__: executor})
         eng.execute(workflow_context)
         out = self._get_node(workflow_context).attributes['out'].value
@@ -336,6 +624,13 @@ class TestCloudifyContextAdapter(object):
         yield result
         result.close()
 
+    @pytest.fixture
+    def versioned_executor(self):
+        # Operations run by the Cloudify executor keep node instance versions
+        result = executor_module.CloudifyProcessExecutor(python_path=[tests.ROOT_DIR])
+        yield result
+        result.close()
+
     @pytest.fixture
     def workflow_context(self, tmpdir):
         result = mock.context.simple(
@@ -444,10 +739,123 @@ def _test_get_and_download_resource_and_render(ctx, resource, variable):
             'download_resource': adapter.download_resource(resource),
             'download_resource_and_render': adapter.download_resource_and_render(
                 resource, template_variables={'variable': variable}
-            )
+            ),
+            'iter_resource': ''.join(adapter.iter_resource(resource, chunk_size=4)),
+            'iter_resource_and_render': ''.join(adapter.iter_resource_and_render(
+                resource, template_variables={'variable': variable}, chunk_size=4
+            ))
         })
 
 
+@operation
+def _test_scratch_space(ctx, resource):
+    with _adapter(ctx) as (adapter, out):
+        out['scratch'] = adapter.download_resource(resource)
+        with open(out['scratch'], 'rb') as f:
+            out['scratch_content'] = f.read()
+        out['kept'] = adapter.download_resource(resource, keep=True)
+
+
+@operation
+def _test_get_resource(ctx, script_path):
+    with _adapter(ctx) as (adapter, out):
+        out['get_resource'] = adapter.get_resource(script_path)
+
+
+@operation
+def _test_large_inputs(ctx, parameters, image_id):
+    ctx.instance.runtime_properties['out'] = {'parameters': parameters,
+                                              'image_id': image_id,
+                                              'recorded': ctx._record is not None}
+
+
+@operation
+def _test_refresh(ctx):
+    with _adapter(ctx) as (adapter, out):
+        instance = adapter.instance
+        initial_version = instance.version
+        instance.refresh()
+        unchanged_version = instance.version
+
+        _write_concurrently(ctx, concurrent=True)
+        instance.refresh()
+
+        out['refresh'] = {'initial_version': initial_version,
+                          'unchanged_version': unchanged_version,
+                          'refreshed_version': instance.version,
+                          'concurrent': instance.runtime_properties['concurrent']}
+
+
+@operation
+def _test_concurrent_runtime_properties(ctx):
+    with _adapter(ctx) as (adapter, out):
+        instance = adapter.instance
+        initial_version = instance.version
+        instance.runtime_properties['mine'] = True
+
+        # Writers of other runtime properties don't fail each other, but they count as writes
+        _write_concurrently(ctx, update=False, concurrent=True)
+        instance.runtime_properties['mine_again'] = True
+        version = instance.version
+
+        try:
+            instance.update()
+            conflict_error = False
+        except context_adapter.NodeInstanceConflictError:
+            conflict_error = True
+        instance.refresh()
+
+        out['concurrent_runtime_properties'] = {'initial_version': initial_version,
+                                                'version': version,
+                                                'refreshed_version': instance.version,
+                                                'conflict_error': conflict_error}
+
+
+@operation
+def _test_update_on_conflict(ctx):
+    with _adapter(ctx) as (adapter, out):
+        instance = adapter.instance
+        _write_concurrently(ctx, concurrent=True)
+
+        try:
+            instance.update()
+            conflict_error = False
+        except context_adapter.NodeInstanceConflictError:
+            conflict_error = True
+
+        conflicts = []
+
+        def on_conflict(runtime_properties):
+            conflicts.append({'concurrent': runtime_properties['concurrent']})
+            runtime_properties['mine'] = True
+        instance.update(on_conflict=on_conflict)
+
+        out['update'] = {'conflict_error': conflict_error, 'conflicts': conflicts}
+
+
+def _write_concurrently(ctx, update=True, **runtime_properties):
+    # Writes the node through a storage connection and a thread of its own, as another worker would
+    def write():
+        model = aria.application_model_storage(**ctx.model.serialization_dict)
+        with model.instrument(*ctx.INSTRUMENTATION_FIELDS):
+            instance = context_adapter.NodeInstanceAdapter(_StorageContext(model),
+                                                           model.node.get(ctx.node.id))
+            instance.runtime_properties.update(runtime_properties)
+            if update:
+                instance.update()
+        model.node._session.remove()
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    thread.join()
+
+
+class _StorageContext(object):
+
+    def __init__(self, model):
+        self.model = model
+
+
 @operation
 def _test_retry(ctx, message, retry_interval):
     with _adapter(ctx) as (adapter, out):
@@ -456,6 +864,34 @@ def _test_retry(ctx, message, retry_interval):
         op.retry(message, retry_after=retry_interval)
 
 
+@operation
+def _test_checkpoints(ctx):
+    with _adapter(ctx) as (adapter, out):
+        op = adapter.operation
+        out['operation'] = {'retry_number': op.retry_number}
+        out['checkpoints'] = op.checkpoints
+        if 'created' not in op.checkpoints:
+            op.checkpoint('created', 'i-123')
+            op.retry('created', retry_after=0.01)
+
+
+@operation
+def _test_operation_timeout(ctx):
+    adapter = context_adapter.CloudifyContextAdapter(ctx)
+    cancelled = [adapter.operation.cancelled]
+    while not adapter.operation.cancelled:
+        time.sleep(0.01)
+    cancelled.append(adapter.operation.cancelled)
+    adapter.instance.runtime_properties['out'] = {'cancelled': cancelled}
+    # Ignores the cancellation, to be interrupted
+    time.sleep(10)
+
+
+@operation
+def _test_creation_validation(ctx):
+    ctx.node.attributes['out'] = {'validated': True}
+
+
 @operation
 def _test_logger_and_send_event(ctx, message, event):
     with _adapter(ctx) as (adapter, _):
@@ -482,6 +918,44 @@ def _test_importable_ctx_and_inputs(**_):
     ctx.instance.runtime_properties['out'] = {'inputs': dict(ctx_parameters)}
 
 
+@operation
+def _test_task_record(**_):
+    from cloudify import ctx
+    from cloudify.state import ctx_parameters
+    ctx.instance.runtime_properties['out'] = {
+        'recorded': ctx._record is not None,
+        'inputs': dict(ctx_parameters),
+        'blueprint_id': ctx.blueprint.id,
+        'deployment_id': ctx.deployment.id,
+        'execution_id': ctx.execution_id,
+        'workflow_id': ctx.workflow_id,
+        'task_name': ctx.task_name,
+        'operation_name': ctx.operation.name,
+        'max_retries': ctx.operation.max_retries,
+        'node_id': ctx.node.id,
+        'node_name': ctx.node.name,
+        'node_type': ctx.node.type,
+        'type_hierarchy': ctx.node.type_hierarchy,
+        'instance_id': ctx.instance.id,
+        'plugin': [ctx.plugin.name, ctx.plugin.package_name, ctx.plugin.package_version]
+    }
+
+
+@operation
+def _test_bulk(index, fail, **_):
+    from cloudify import ctx
+    from cloudify.exceptions import NonRecoverableError
+    if fail:
+        raise NonRecoverableError('bulk-{0}'.format(index))
+    ctx.instance.runtime_properties['bulk_{0}'.format(index)] = {'pid': os.getpid(),
+                                                                 'task_id': ctx.task_id}
+
+
+def _test_bulk_stuck(**_):
+    # Blocks past the interrupt, which a thread only gets once back in Python code
+    time.sleep(10)
+
+
 @operation
 def _test_non_recoverable_error(message, **_):
     from cloudify.exceptions import NonRecoverableError
@@ -0,0 +1,179 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import json
+import time
+import signal
+import threading
+
+import pytest
+
+from adapters import (bulk, deadlines)
+
+
+def test_timeout():
+    timeouts = {'*': 100, 'openstack': 60, 'cloudify.interfaces.lifecycle.create': 30,
+                'openstack:cloudify.interfaces.lifecycle.start': 10}
+    assert deadlines.timeout(timeouts, 'openstack', 'cloudify.interfaces.lifecycle.start') == 10
+    assert deadlines.timeout(timeouts, 'openstack', 'cloudify.interfaces.lifecycle.create') == 30
+    assert deadlines.timeout(timeouts, 'openstack', 'cloudify.interfaces.lifecycle.stop') == 60
+    assert deadlines.timeout(timeouts, None, 'cloudify.interfaces.lifecycle.stop') == 100
+    assert deadlines.timeout({'openstack': 60}, 'aws', 'Standard.create') is None
+
+
+def test_from_environment(tmpdir, monkeypatch):
+    assert deadlines.Deadline.from_environment('openstack', 'Standard.create') is None
+
+    path = tmpdir.join('timeouts.json')
+    path.write(json.dumps({'openstack': 60}))
+    monkeypatch.setenv(deadlines.OPERATION_TIMEOUTS_ENV, str(path))
+    monkeypatch.setenv(deadlines.TIMEOUT_GRACE_ENV, '5')
+    assert deadlines.Deadline.from_environment('aws', 'Standard.create') is None
+    deadline = deadlines.Deadline.from_environment('openstack', 'Standard.create',
+                                                   retry_number=2)
+    assert (deadline.timeout, deadline.grace, deadline.retry_after) == (60, 5, 120)
+
+
+def test_retry_backoff():
+    assert deadlines.Deadline(1).retry_after == deadlines.RETRY_BACKOFF
+    assert deadlines.Deadline(1, retry_number=1).retry_after == deadlines.RETRY_BACKOFF * 2
+    assert deadlines.Deadline(1, retry_number=10).retry_after == deadlines.MAX_RETRY_BACKOFF
+
+
+def test_in_time():
+    ctx = _Context()
+    handler = signal.getsignal(signal.SIGALRM)
+    deadline = deadlines.Deadline(5, grace=5)
+    with deadline.enforced(ctx):
+        assert deadlines.current(ctx) is deadline
+        assert 0 < deadline.remaining() <= 5
+    assert deadlines.current(ctx) is None
+    assert not deadline.cancelled
+    assert signal.getsignal(signal.SIGALRM) == handler
+
+
+def test_cooperative_cancellation():
+    deadline = deadlines.Deadline(0.05, grace=5)
+    with pytest.raises(deadlines.OperationTimeout) as e:
+        with deadline.enforced(_Context()):
+            while not deadline.cancelled:
+                time.sleep(0.01)
+            raise RuntimeError('cancelled')
+    assert e.value.retry_interval == deadlines.RETRY_BACKOFF
+
+
+def test_interrupt_main_thread():
+    start = time.time()
+    with pytest.raises(deadlines.OperationTimeout):
+        with deadlines.Deadline(0.05, grace=0.05).enforced(_Context()):
+            time.sleep(5)
+    assert time.time() - start < 2
+
+
+def test_interrupt_thread():
+    result = {}
+
+    def run():
+        try:
+            with deadlines.Deadline(0.05, grace=0.05).enforced(_Context()):
+                while True:
+                    time.sleep(0.01)
+        except deadlines.OperationTimeout as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join(2)
+    assert isinstance(result.get('error'), deadlines.OperationTimeout)
+
+
+def test_abandon(monkeypatch):
+    reported = []
+    stop = threading.Event()
+
+    class _Messenger(object):
+        def __init__(self, task_id, port):
+            self.task_id = task_id
+
+        def failed(self, exception):
+            reported.append((self.task_id, exception))
+            stop.set()
+
+    monkeypatch.setattr(deadlines.process, '_Messenger', _Messenger)
+    monkeypatch.setenv(deadlines.EXECUTOR_PORT_ENV, '1234')
+
+    def run():
+        with deadlines.Deadline(0.05, grace=0.05).enforced(_Context(), task_id=7):
+            # Swallows the interrupt, as a stuck operation would
+            while not stop.is_set():
+                try:
+                    time.sleep(0.01)
+                except BaseException:
+                    pass
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join(2)
+    assert [task_id for task_id, _ in reported] == [7]
+    assert isinstance(reported[0][1], deadlines.OperationTimeout)
+
+
+def test_abandon_bulk(monkeypatch):
+    reported = []
+    exits = []
+    stop = threading.Event()
+
+    def send_message(messenger, type, exception=None):
+        reported.append((messenger.task_id, type, exception))
+
+    def exit_worker(code):
+        exits.append(code)
+        stop.set()
+        # Ends the timer thread, as the worker would end
+        raise SystemExit(code)
+
+    monkeypatch.setattr(bulk.process._Messenger, '_send_message', send_message)
+    monkeypatch.setattr(deadlines.os, '_exit', exit_worker)
+    monkeypatch.setenv(deadlines.EXECUTOR_PORT_ENV, '1234')
+    # A bulk worker running a single thread: the stuck task, and two queued behind it
+    tasks = bulk._Tasks()
+    for task_id in (7, 8, 9):
+        tasks.put({'task_id': task_id, 'port': 1234})
+    monkeypatch.setattr(bulk, '_tasks', tasks)
+    tasks.next()
+
+    def run():
+        try:
+            with deadlines.Deadline(0.05, grace=0.05).enforced(_Context(), task_id=7):
+                # Stuck in a blocking call, which the interrupt doesn't break
+                stop.wait()
+        except BaseException:
+            # Interrupted once unblocked
+            pass
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join(2)
+    assert exits == [1]
+    assert [(task_id, type) for task_id, type, _ in reported] == \
+        [(7, 'failed'), (8, 'failed'), (9, 'failed')]
+    assert isinstance(reported[0][2], deadlines.OperationTimeout)
+    assert all(isinstance(exception, bulk.WorkerAbandoned) for _, _, exception in reported[1:])
+    assert tasks.next() is None
+
+
+class _Context(object):
+    pass
@@ -0,0 +1,74 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import pytest
+
+from adapters import durations
+
+
+class TestDurationStore(object):
+
+    def test_percentiles(self, store):
+        for duration in range(1, 11):
+            store.record('cloudify_aws.ec2.instance.start', 'aria.aws.nodes.Instance', duration)
+
+        assert store.percentile('cloudify_aws.ec2.instance.start',
+                                'aria.aws.nodes.Instance', 50) == 5.5
+        assert store.percentile('cloudify_aws.ec2.instance.start',
+                                'aria.aws.nodes.Instance', 100) == 10
+        assert store.percentile('cloudify_aws.ec2.instance.start', 'other', 50) is None
+
+    def test_rolling_window(self, tmpdir):
+        store = durations.DurationStore(str(tmpdir.join('durations.db')), window=3)
+        for duration in range(5):
+            store.record('op', 'type', duration)
+        assert store.samples('op', 'type') == [2, 3, 4]
+
+    def test_estimate(self, store):
+        store.record('op', 'type', 10)
+        assert store.estimate('op', 'type') == 10
+        assert store.estimate('op', 'other_type') == 10
+        assert store.estimate('other_op', 'type') == durations.DEFAULT_ESTIMATE
+
+    def test_persistence(self, tmpdir):
+        path = str(tmpdir.join('durations.db'))
+        store = durations.DurationStore(path)
+        store.record('op', 'type', 2)
+        store.close()
+        assert durations.DurationStore(path).samples('op', 'type') == [2]
+
+    @pytest.fixture
+    def store(self, tmpdir):
+        result = durations.DurationStore(str(tmpdir.join('durations.db')))
+        yield result
+        result.close()
+
+
+def test_critical_path_priorities():
+    priorities = durations.critical_path_priorities({
+        'securitygroup.create': (2, []),
+        'keypair.create': (1, []),
+        'instance.create': (60, ['securitygroup.create', 'keypair.create']),
+        'instance.start': (120, ['instance.create']),
+        'elasticip.create': (3, [])
+    })
+    assert priorities == {
+        'securitygroup.create': 182,
+        'keypair.create': 181,
+        'instance.create': 180,
+        'instance.start': 120,
+        'elasticip.create': 3
+    }
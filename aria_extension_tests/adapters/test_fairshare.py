@@ -0,0 +1,212 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import json
+import itertools
+import subprocess
+from collections import namedtuple
+
+from adapters import (fairshare, metrics)
+
+
+_Entry = namedtuple('_Entry', ['priority', 'sequence', 'task_id', 'service', 'bulk_key',
+                               'queued_at'])
+
+
+class TestAdmissionQueue(object):
+
+    def test_single_queue(self):
+        queue = fairshare.AdmissionQueue()
+        entries = _entries(queue, [('big', 0)] * 3 + [('small', -10), ('small', 0)])
+
+        popped = [queue.pop({'big': 5})[0] for _ in range(5)]
+
+        # Priority order, regardless of services and their workers
+        assert popped == [entries[3], entries[0], entries[1], entries[2], entries[4]]
+        assert queue.pop() == []
+
+    def test_fair_share(self):
+        queue = fairshare.AdmissionQueue({'*': {}})
+        entries = _entries(queue, [('big', 0)] * 4 + [('small', 0)])
+
+        # The service with the fewest workers goes first, then the longest waiting
+        assert queue.pop({'big': 2}) == [entries[4]]
+        assert queue.pop({'big': 2, 'small': 1}) == [entries[0]]
+        assert queue.pop({'big': 1, 'small': 1}) == [entries[1]]
+        assert len(queue) == 2
+
+    def test_weights(self):
+        queue = fairshare.AdmissionQueue({'*': {'weight': 1}, 'big': {'weight': 4}})
+        entries = _entries(queue, [('big', 0)] * 4 + [('small', 0)])
+
+        assert queue.pop({'big': 3, 'small': 1}) == [entries[0]]
+        assert queue.pop({'big': 5, 'small': 1}) == [entries[4]]
+
+    def test_max_workers(self):
+        queue = fairshare.AdmissionQueue({'*': {'max_workers': 2}})
+        entries = _entries(queue, [('big', 0)] * 2)
+
+        assert queue.pop({'big': 2}) == []
+        assert queue.pop({'big': 1}) == [entries[0]]
+
+    def test_bulk(self):
+        queue = fairshare.AdmissionQueue({'*': {}})
+        entries = _entries(queue, [('big', 0, 'create'), ('small', 0, 'create'),
+                                   ('big', 0, 'configure'), ('big', 0, 'create'),
+                                   ('big', 0, 'create')])
+
+        # Only tasks of the same service are started in bulk
+        assert queue.pop({'small': 1}, bulk_size=2) == [entries[0], entries[3]]
+        assert queue.pop({'small': 1}, bulk_size=2) == [entries[2]]
+
+    def test_remove_and_clear(self):
+        queue = fairshare.AdmissionQueue({'*': {}})
+        entries = _entries(queue, [('big', 0), ('small', 0), ('big', 0)])
+
+        assert queue.remove(entries[1].task_id) == [entries[1]]
+        assert queue.remove(entries[1].task_id) == []
+        assert sorted(queue.clear()) == [entries[0], entries[2]]
+        assert len(queue) == 0
+
+    def test_service(self):
+        queue = fairshare.AdmissionQueue({'*': {}})
+        entries = _entries(queue, [('big', 0), ('small', 0), ('big', -1)])
+
+        assert queue.waiting() == {'big': entries[2].queued_at, 'small': entries[1].queued_at}
+        # Regardless of whose turn it is
+        assert queue.pop({'small': 5}, service='small') == [entries[1]]
+        assert queue.pop(service='small') == []
+        assert queue.waiting() == {'big': entries[2].queued_at}
+
+
+class TestHostAdmission(object):
+    """
+    Executors of separate executions, sharing the host's workers.
+    """
+
+    def test_fair_share(self, tmpdir):
+        big, small = _executors(tmpdir, 2, {'*': {}}, max_workers=4)
+
+        assert big.acquire({'big': 1}) == 'big'
+        assert small.acquire({'small': 2}) == 'small'
+        assert small.acquire({'small': 5}) is None
+        assert big.acquire({'big': 3}) == 'big'
+        # The other executor's service has fewer workers on the host
+        assert big.acquire({'big': 4}) is None
+        assert small.acquire({'small': 5}) == 'small'
+        # The host's workers are all taken
+        assert small.acquire({'small': 6}) is None
+        assert big.acquire({'big': 4}) is None
+
+        big.release('big')
+        assert big.acquire({'big': 4}) == 'big'
+
+    def test_longest_waiting(self, tmpdir):
+        first, second = _executors(tmpdir, 2, {'*': {}}, max_workers=1)
+
+        assert first.acquire({'service': 1}) == 'service'
+        assert first.acquire({'service': 3}) is None
+        assert second.acquire({'service': 2}) is None
+        first.release('service')
+        # The task queued first starts, whichever executor asks first
+        assert first.acquire({'service': 3}) is None
+        assert second.acquire({'service': 2}) == 'service'
+
+    def test_max_workers(self, tmpdir):
+        first, second = _executors(tmpdir, 2, {'*': {'max_workers': 2}})
+
+        assert first.acquire({'service': 1}) == 'service'
+        assert first.acquire({'service': 3}) == 'service'
+        # The service's limit holds for the host
+        assert second.acquire({'service': 2}) is None
+        first.release('service')
+        assert first.acquire({'service': 3}) is None
+        assert second.acquire({'service': 2}) == 'service'
+
+    def test_unlimited(self, tmpdir):
+        first, second = _executors(tmpdir, 2, {'*': {}})
+
+        assert first.acquire({'big': 1}) == 'big'
+        assert second.acquire({'small': 2}) == 'small'
+        # Nothing to share without a limit for the host
+        assert first.acquire({'big': 3}) == 'big'
+        assert first.acquire({'big': 3}) == 'big'
+
+    def test_stale_and_closed(self, tmpdir):
+        first, second = _executors(tmpdir, 2, {'*': {}}, max_workers=1)
+
+        assert second.acquire({'small': 1}) == 'small'
+        assert second.acquire({'small': 2}) is None
+        assert first.acquire({'big': 3}) is None
+        second.release('small')
+        assert first.acquire({'big': 3}) is None
+        # Waiting services recorded too long ago are ignored
+        first.STALE_AFTER = 0
+        assert first.acquire({'big': 3}) == 'big'
+        first.close()
+        assert second.acquire({'small': 2}) == 'small'
+
+    def test_dead_executor(self, tmpdir):
+        process = subprocess.Popen(['true'])
+        process.wait()
+        tmpdir.join('admission.json').write(json.dumps({'dead': {
+            'pid': process.pid, 'updated': 0, 'workers': {'big': 1}, 'waiting': {}}}))
+        admission, = _executors(tmpdir, 1, None, max_workers=1)
+
+        assert admission.acquire({'small': 1}) == 'small'
+
+    def test_from_environment(self, tmpdir, monkeypatch):
+        monkeypatch.setenv(fairshare.ADMISSION_DIR_ENV, str(tmpdir))
+        monkeypatch.delenv(fairshare.HOST_WORKERS_ENV, raising=False)
+        assert fairshare.HostAdmission.from_environment(None) is None
+        assert fairshare.HostAdmission.from_environment({'*': {}}).shares == {'*': {}}
+        monkeypatch.setenv(fairshare.HOST_WORKERS_ENV, '8')
+        admission = fairshare.HostAdmission.from_environment(None)
+        assert admission.shares == {}
+        assert admission._max_workers == 8
+
+
+def test_share():
+    shares = {'*': {'max_workers': 8}, 'prod-*': {'weight': 4}}
+    assert fairshare.share(shares, 'dev-1') == (1.0, 8)
+    assert fairshare.share(shares, 'prod-1') == (4.0, None)
+    assert fairshare.share({}, 'dev-1') == (1.0, None)
+
+
+def test_observe_waits(tmpdir, monkeypatch):
+    monkeypatch.setenv(metrics.METRICS_DIR_ENV, str(tmpdir))
+    fairshare.observe_waits([('big', 12), ('small', 0.2)])
+
+    text = metrics.MetricsStore(str(tmpdir)).render()
+    assert 'aria_cloudify_queue_wait_seconds_count{service="big"} 1' in text
+    assert 'aria_cloudify_queue_wait_seconds_bucket{service="small",le="0.5"} 1' in text
+
+
+def _entries(queue, specs):
+    sequence = itertools.count()
+    entries = []
+    for spec in specs:
+        service, priority = spec[:2]
+        index = next(sequence)
+        entry = _Entry(priority, index, 'task-{0}'.format(index), service,
+                       spec[2] if len(spec) > 2 else None, 1000 + index)
+        queue.push(entry)
+        entries.append(entry)
+    return entries
+
+
+def _executors(tmpdir, count, shares, max_workers=None):
+    return [fairshare.HostAdmission(str(tmpdir), shares, max_workers) for _ in range(count)]
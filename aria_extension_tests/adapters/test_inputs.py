@@ -0,0 +1,130 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+
+import pytest
+
+from adapters import (inputs, records)
+
+
+LARGE = {'BlockDeviceMappings': [{'DeviceName': '/dev/sd{0}'.format(chr(ord('a') + index)),
+                                  'Ebs': {'VolumeSize': 100, 'VolumeType': 'gp2'}}
+                                 for index in range(20)]}
+
+
+class TestInputStore(object):
+
+    def test_arguments(self, store):
+        arguments = store.arguments(_Task(1, image_id='ami-1', parameters=LARGE))
+
+        assert arguments['image_id'] == 'ami-1'
+        assert 'parameters' not in arguments
+        references = arguments[inputs.BLOB_INPUTS_ARGUMENT]
+        assert list(references) == ['parameters']
+        assert inputs.load(references) == {'parameters': LARGE}
+
+    def test_small_arguments(self, store):
+        assert store.arguments(_Task(1, image_id='ami-1')) == {'image_id': 'ami-1'}
+        assert os.listdir(store.directory) == []
+
+    def test_shared_blobs(self, store):
+        first = store.arguments(_Task(1, parameters=LARGE))
+        second = store.arguments(_Task(2, parameters=LARGE))
+
+        assert first == second
+        assert len(os.listdir(store.directory)) == 1
+
+    def test_retry(self, store):
+        task = _Task(1, image_id='ami-1', parameters=LARGE)
+        first = store.arguments(task)
+        reads = dict(task.reads)
+        second = store.arguments(task)
+
+        assert first == second
+        # Blob arguments aren't read again
+        assert task.reads['parameters'] == reads['parameters']
+        assert task.reads['image_id'] == reads['image_id'] + 1
+
+    def test_reserved_arguments(self, store):
+        record = dict(('property_{0}'.format(index), 'value-{0}'.format(index))
+                      for index in range(50))
+        arguments = store.arguments(_Task(1, parameters=LARGE,
+                                          **{records.TASK_RECORD_ARGUMENT: record}))
+
+        # The extension takes the record out before loading the blobs
+        assert arguments[records.TASK_RECORD_ARGUMENT] == record
+        assert list(arguments[inputs.BLOB_INPUTS_ARGUMENT]) == ['parameters']
+
+    def test_forget(self, store):
+        task = _Task(1, parameters=LARGE)
+        first = store.arguments(task)
+        store.forget(task.id)
+        reads = dict(task.reads)
+
+        assert store.arguments(task) == first
+        assert task.reads['parameters'] == reads['parameters'] + 1
+        assert len(os.listdir(store.directory)) == 1
+        store.forget(task.id)
+        store.forget(task.id)
+
+    def test_close(self, tmpdir):
+        store = inputs.InputStore(1, str(tmpdir.mkdir('inputs')))
+        store.arguments(_Task(1, parameters=LARGE))
+        store.close()
+        assert not os.path.exists(store.directory)
+
+    def test_from_environment(self, monkeypatch):
+        monkeypatch.delenv(inputs.INPUT_BLOB_THRESHOLD_ENV, raising=False)
+        assert inputs.InputStore.from_environment() is None
+        monkeypatch.setenv(inputs.INPUT_BLOB_THRESHOLD_ENV, '4096')
+        store = inputs.InputStore.from_environment()
+        try:
+            assert store.threshold == 4096
+        finally:
+            store.close()
+
+    @pytest.fixture
+    def store(self, tmpdir):
+        result = inputs.InputStore(512, str(tmpdir.mkdir('inputs')))
+        yield result
+        result.close()
+
+
+def test_load_nothing():
+    assert inputs.load(None) == {}
+
+
+class _Argument(object):
+
+    def __init__(self, task, name, value):
+        self._task = task
+        self._name = name
+        self._value = value
+
+    @property
+    def value(self):
+        self._task.reads[self._name] = self._task.reads.get(self._name, 0) + 1
+        return self._value
+
+
+class _Task(object):
+
+    def __init__(self, id, **arguments):
+        self.id = id
+        self.reads = {}
+        self.arguments = dict((name, _Argument(self, name, value))
+                              for name, value in arguments.items())
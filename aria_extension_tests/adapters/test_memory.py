@@ -0,0 +1,119 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import json
+import time
+import logging
+import threading
+
+import pytest
+
+from adapters import memory
+
+
+# Stands in for a plugin module-level cache
+_leaked = []
+
+
+class TestMemoryTracker(object):
+
+    def test_growth(self, tracker, report):
+        with tracker.track('Standard.create', task_id=1):
+            _leak()
+        with tracker.track('Standard.start', task_id=2):
+            pass
+
+        leaking, clean = _records(report)
+        assert leaking['operation'] == 'Standard.create'
+        assert leaking['task_id'] == 1
+        assert leaking['backend'] == tracker.backend
+        assert leaking['growth'] > 100 * 1024
+        assert leaking['top'][0][1] > 0
+        assert clean['growth'] < leaking['growth'] / 10
+        assert not leaking['trend'] and not clean['trend']
+
+    def test_failed_operation(self, tracker, report):
+        with pytest.raises(RuntimeError):
+            with tracker.track('Standard.create'):
+                raise RuntimeError()
+        assert _records(report)[0]['operation'] == 'Standard.create'
+
+    def test_trend(self, tracker, report, monkeypatch):
+        monkeypatch.setattr(memory, 'TREND_THRESHOLD', 100 * 1024)
+        warnings = []
+        logger = logging.getLogger('test_memory')
+        monkeypatch.setattr(logger, 'warning', warnings.append)
+        for _ in range(memory.TREND_WINDOW):
+            with tracker.track('Standard.create', logger=logger):
+                _leak()
+
+        trends = [record['trend'] for record in _records(report)]
+        assert trends == [False] * (memory.TREND_WINDOW - 1) + [True]
+        assert len(warnings) == 1
+
+    def test_summarize(self, tracker, report):
+        for operation in ('Standard.create', 'Standard.create', 'Standard.start'):
+            with tracker.track(operation):
+                pass
+        summary = memory.summarize(report)
+        assert sorted(summary) == ['Standard.create', 'Standard.start']
+        assert summary['Standard.create']['tasks'] == 2
+        assert summary['Standard.create']['trends'] == 0
+
+    def test_threads(self, tracker, report):
+        spans = []
+
+        def run(task_id):
+            with tracker.track('Standard.create', task_id=task_id):
+                start = time.time()
+                time.sleep(0.1)
+                spans.append((start, time.time()))
+
+        threads = [threading.Thread(target=run, args=(task_id,)) for task_id in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Tracked operations don't overlap, so that each is measured alone
+        first, second = sorted(spans)
+        assert first[1] <= second[0]
+        assert sorted(record['task_id'] for record in _records(report)) == [0, 1]
+
+    @pytest.fixture
+    def report(self, tmpdir):
+        return str(tmpdir.join('memory.jsonl'))
+
+    @pytest.fixture
+    def tracker(self, report, monkeypatch):
+        monkeypatch.setattr(memory, '_retained', [])
+        yield memory.MemoryTracker(report)
+        del _leaked[:]
+
+
+def test_from_environment(tmpdir, monkeypatch):
+    assert memory.MemoryTracker.from_environment() is None
+    monkeypatch.setenv(memory.MEMORY_REPORT_ENV, str(tmpdir.join('memory.jsonl')))
+    assert memory.MemoryTracker.from_environment() is not None
+
+
+def _leak():
+    _leaked.extend(dict(index=index) for index in range(2000))
+
+
+def _records(report):
+    with open(report) as f:
+        return [json.loads(line) for line in f]
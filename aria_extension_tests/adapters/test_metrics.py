@@ -0,0 +1,81 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import urllib2
+import multiprocessing
+
+import pytest
+
+from adapters import metrics
+
+
+class TestMetricsStore(object):
+
+    def test_record_operation(self, store):
+        store.record_operation('PLUGIN', 'Standard.create', metrics.SUCCESS, 0.3)
+        store.record_operation('PLUGIN', 'Standard.create', metrics.RETRY, 12)
+        text = store.render()
+
+        labels = 'operation="Standard.create",plugin="PLUGIN"'
+        assert 'aria_cloudify_operations_total{{{0}}} 1'.format(
+            'operation="Standard.create",outcome="success",plugin="PLUGIN"') in text
+        assert 'aria_cloudify_operations_total{{{0}}} 1'.format(
+            'operation="Standard.create",outcome="retry",plugin="PLUGIN"') in text
+        assert 'aria_cloudify_operation_retries_total{{{0}}} 1'.format(labels) in text
+        assert 'aria_cloudify_operation_duration_seconds_bucket{{{0},le="0.5"}} 1'.format(
+            labels) in text
+        assert 'aria_cloudify_operation_duration_seconds_bucket{{{0},le="+Inf"}} 2'.format(
+            labels) in text
+        assert 'aria_cloudify_operation_duration_seconds_count{{{0}}} 2'.format(labels) in text
+        assert '# TYPE aria_cloudify_operation_duration_seconds histogram' in text
+
+    def test_aggregation_across_processes(self, store):
+        processes = [multiprocessing.Process(target=_record, args=(store.directory, ))
+                     for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        assert 'aria_cloudify_operations_total{{{0}}} 40'.format(
+            'operation="op",outcome="abort",plugin=""') in store.render()
+
+    def test_textfile(self, tmpdir):
+        textfile = tmpdir.join('metrics.prom')
+        store = metrics.MetricsStore(str(tmpdir.join('metrics')), textfile=str(textfile))
+        store.inc('custom_total', {'label': 'with "quotes"'})
+        assert textfile.read() == ('# HELP custom_total \n'
+                                   '# TYPE custom_total counter\n'
+                                   'custom_total{label="with \\"quotes\\""} 1\n')
+
+    def test_serve(self, store):
+        store.record_operation('PLUGIN', 'op', metrics.SUCCESS, 1)
+        server = metrics.serve(store)
+        try:
+            response = urllib2.urlopen('http://127.0.0.1:{0}/metrics'.format(server.server_port))
+            assert response.read() == store.render()
+        finally:
+            server.shutdown()
+
+    @pytest.fixture
+    def store(self, tmpdir):
+        return metrics.MetricsStore(str(tmpdir.join('metrics')))
+
+
+def _record(directory):
+    store = metrics.MetricsStore(directory)
+    for _ in range(10):
+        store.record_operation(None, 'op', metrics.ABORT, 0.01)
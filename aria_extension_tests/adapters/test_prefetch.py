@@ -0,0 +1,133 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+
+import pytest
+from aria.storage import exceptions as storage_exceptions
+
+from adapters import prefetch
+
+
+class TestPrefetcher(object):
+
+    def test_prefetch(self, prefetcher, monkeypatch):
+        storage = _ResourceStorage(service={'scripts/configure.sh': 'configure'},
+                                   service_template={'scripts/start.sh': 'start'})
+        ctx = _Context(storage, _Task(implementation='scripts/configure.sh',
+                                      dependencies=['scripts/start.sh', 'ssh.user > admin',
+                                                    'missing.sh']))
+        prefetcher.prefetch(ctx)
+        prefetcher.prefetch(ctx)
+        prefetcher.join()
+
+        monkeypatch.setenv(prefetch.RESOURCE_CACHE_ENV, prefetcher.directory)
+        with open(prefetch.cached(ctx, 'scripts/configure.sh')) as f:
+            assert f.read() == 'configure'
+        with open(prefetch.cached(ctx, 'scripts/start.sh')) as f:
+            assert f.read() == 'start'
+        assert prefetch.cached(ctx, 'missing.sh') is None
+        assert sorted(storage.downloads) == \
+            ['missing.sh', 'scripts/configure.sh', 'scripts/start.sh']
+
+    def test_close(self, tmpdir):
+        prefetcher = prefetch.Prefetcher(str(tmpdir.join('cache')), workers=1)
+        prefetcher.close()
+        assert not os.path.exists(prefetcher.directory)
+
+    @pytest.fixture
+    def prefetcher(self, tmpdir):
+        result = prefetch.Prefetcher(str(tmpdir.join('cache')), workers=2)
+        yield result
+        result.close()
+
+
+def test_resource_paths():
+    assert prefetch.resource_paths(_Task(implementation='plugin.tasks.create')) == []
+    assert prefetch.resource_paths(_Task(implementation='scripts/create.sh',
+                                         dependencies=['scripts/lib.sh', 'ssh.user > admin'],
+                                         script_path='scripts/create.sh')) == \
+        ['scripts/create.sh', 'scripts/lib.sh']
+    assert prefetch.resource_paths(_Task(implementation='http://host/create.sh')) == []
+
+
+def test_cache_path():
+    assert prefetch.cache_path('/cache', '1', 'scripts/start.sh') == '/cache/1/scripts/start.sh'
+    assert prefetch.cache_path('/cache', '1', '/scripts/start.sh') == '/cache/1/scripts/start.sh'
+    assert prefetch.cache_path('/cache', '1', '../start.sh') is None
+    assert prefetch.cache_path('/cache', '1', '') is None
+
+
+class _ResourceStorage(object):
+
+    def __init__(self, service, service_template):
+        self.downloads = []
+        self.service = _ResourceAPI(service, self.downloads)
+        self.service_template = _ResourceAPI(service_template)
+
+
+class _ResourceAPI(object):
+
+    def __init__(self, resources, downloads=None):
+        self._resources = resources
+        self._downloads = downloads if downloads is not None else []
+
+    def download(self, entry_id, destination, path=None):
+        self._downloads.append(path)
+        if path not in self._resources:
+            raise storage_exceptions.StorageError('Resource {0} does not exist'.format(path))
+        with open(destination, 'wb') as f:
+            f.write(self._resources[path])
+
+
+class _Context(object):
+
+    def __init__(self, resource, task):
+        self.resource = resource
+        self.task = task
+        self.service = _Model(1)
+        self.service_template = _Model(2)
+
+
+class _Model(object):
+
+    def __init__(self, id):
+        self.id = id
+
+
+class _Argument(object):
+
+    def __init__(self, value):
+        self.value = value
+
+
+class _Task(object):
+
+    function = 'plugin.tasks.create'
+    interface_name = 'Standard'
+    operation_name = 'create'
+
+    def __init__(self, implementation, dependencies=None, script_path=None):
+        operation = _Model(None)
+        operation.implementation = implementation
+        operation.dependencies = dependencies
+        interface = _Model(None)
+        interface.operations = {self.operation_name: operation}
+        self.actor = _Model(None)
+        self.actor.interfaces = {self.interface_name: interface}
+        self.arguments = {}
+        if script_path:
+            self.arguments['script_path'] = _Argument(script_path)
@@ -0,0 +1,118 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+import json
+import time
+import multiprocessing
+
+import pytest
+
+from adapters import (metrics, ratelimit)
+
+
+class TestRateLimiter(object):
+
+    def test_limits(self, tmpdir):
+        limiter = ratelimit.RateLimiter(str(tmpdir), {'*': {'rate': 1},
+                                                      'aws:*': {'rate': 2},
+                                                      'aws:us-east-1': {'rate': 3}})
+        assert limiter.limits('aws:us-east-1') == {'rate': 3}
+        assert limiter.limits('aws:eu-west-1') == {'rate': 2}
+        assert limiter.limits('openstack:http://keystone:5000/v3') == {'rate': 1}
+        assert ratelimit.RateLimiter(str(tmpdir), {'aws:*': {}}).limits('openstack:x') is None
+
+    def test_rate(self, tmpdir):
+        limiter = ratelimit.RateLimiter(str(tmpdir), {'aws:*': {'rate': 10, 'burst': 2}})
+        waits = []
+        for _ in range(4):
+            with limiter.acquire('aws:us-east-1') as waited:
+                waits.append(waited)
+        assert waits[0] < 0.05 and waits[1] < 0.05
+        assert 0.05 < waits[2] < 0.5 and 0.05 < waits[3] < 0.5
+
+    def test_unlimited(self, tmpdir):
+        limiter = ratelimit.RateLimiter(str(tmpdir), {'aws:*': {'rate': 0.001}})
+        for endpoint in ('openstack:x', None, 'openstack:x'):
+            with limiter.acquire(endpoint) as waited:
+                assert waited == 0
+
+    def test_concurrency_across_processes(self, tmpdir):
+        limits = {'*': {'concurrency': 2}}
+        log = tmpdir.join('log')
+        processes = [multiprocessing.Process(target=_hold, args=(str(tmpdir), limits, str(log)))
+                     for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        events = sorted(tuple(json.loads(line)) for line in log.readlines())
+        in_flight = peak = 0
+        for _, change in events:
+            in_flight += change
+            peak = max(peak, in_flight)
+        assert len(events) == 8
+        assert peak == 2
+
+    def test_dead_holders(self, tmpdir):
+        limiter = ratelimit.RateLimiter(str(tmpdir), {'*': {'concurrency': 1}})
+        process = multiprocessing.Process(target=os._exit, args=(0, ))
+        process.start()
+        process.join()
+        with limiter._state('aws:x') as state:
+            state['holders'] = {'dead': process.pid}
+
+        with limiter.acquire('aws:x') as waited:
+            assert waited < ratelimit.POLL_INTERVAL
+
+    def test_wait_metrics(self, tmpdir, monkeypatch):
+        monkeypatch.setenv(metrics.METRICS_DIR_ENV, str(tmpdir.join('metrics')))
+        limiter = ratelimit.RateLimiter(str(tmpdir), {'*': {'rate': 100}})
+        with limiter.acquire('aws:us-east-1'):
+            pass
+
+        text = metrics.MetricsStore.from_environment().render()
+        assert '# TYPE aria_cloudify_rate_limit_wait_seconds histogram' in text
+        assert 'aria_cloudify_rate_limit_wait_seconds_count{endpoint="aws:us-east-1"} 1' in text
+
+
+@pytest.mark.parametrize('properties, endpoint', [
+    ({'aws_config': {'aws_access_key_id': 'secret', 'ec2_region_name': 'us-east-1'}},
+     'aws:us-east-1'),
+    ({'aws_config': {}}, 'aws:default'),
+    ({'openstack_config': {'auth_url': 'http://keystone:5000/v3', 'region': 'RegionOne',
+                           'password': 'secret'}},
+     'openstack:http://keystone:5000/v3/RegionOne'),
+    ({'openstack_config': {'auth_url': 'http://keystone:5000/v2.0'}},
+     'openstack:http://keystone:5000/v2.0'),
+    ({'image': 'ubuntu'}, None),
+])
+def test_endpoint(properties, endpoint):
+    assert ratelimit.endpoint(properties) == endpoint
+
+
+def _hold(directory, limits, log):
+    limiter = ratelimit.RateLimiter(directory, limits)
+    with limiter.acquire('aws:us-east-1'):
+        _log(log, 1)
+        time.sleep(0.2)
+        _log(log, -1)
+
+
+def _log(log, change):
+    with open(log, 'a') as f:
+        f.write(json.dumps([time.time(), change]) + '\n')
@@ -0,0 +1,172 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+import copy
+import json
+import logging
+
+from adapters import recording
+
+
+class TestRecordAndReplay(object):
+
+    def test_record(self, tmpdir):
+        recorder = self._record(_operation, tmpdir)
+        events = recorder.recording['events']
+        context = recorder.recording['context']
+
+        assert recorder.recording['outcome'] == 'success'
+        assert recorder.recording['inputs'] == {'resource': 'script.sh'}
+        assert context['node.properties'] == {'image_id': 'ami-1'}
+        assert context['instance.runtime_properties'] == {'existing': 1}
+        assert ('get', 'instance.runtime_properties', 'existing') in \
+            [(e['kind'], e['path'], e.get('key')) for e in events]
+        assert {'kind': 'set', 'path': 'instance.runtime_properties',
+                'key': 'resource', 'value': 'echo'} in events
+        assert [e['message'] for e in events if e['kind'] == 'log'] == ['creating ami-1']
+        download = [e for e in events if e['path'] == 'download_resource'][0]
+        assert download['content'] == 'ZWNobw=='
+
+    def test_replay(self, tmpdir):
+        recorder = self._record(_operation, tmpdir)
+        path = recorder.save('task', str(tmpdir))
+
+        result = recording.replay(path, function=_operation)
+
+        assert result.outcome == 'success'
+        assert not result.diverged
+        assert result.runtime_properties == {
+            'instance.runtime_properties': {'existing': 1, 'resource': 'echo', 'downloaded': 'echo'}
+        }
+
+    def test_replay_retry(self, tmpdir):
+        recorder = self._record(_retrying_operation, tmpdir)
+
+        result = recording.replay(recorder.recording, function=_retrying_operation)
+
+        assert result.outcome == 'retry'
+        assert result.message == 'not yet'
+
+    def test_runtime_properties_dict(self, tmpdir):
+        recorder = recording.Recorder('module.function', {})
+        adapter = _RecordingAdapter(str(tmpdir))
+        adapter._recorder = recorder
+        properties = adapter.instance.runtime_properties
+
+        assert isinstance(properties, dict)
+        assert json.loads(json.dumps(properties)) == {'existing': 1}
+        properties.update(created=True)
+        assert properties.pop('existing') == 1
+        assert properties.setdefault('tags', []) == []
+        assert copy.deepcopy(properties) == {'created': True, 'tags': []}
+        assert type(copy.deepcopy(properties)) is dict
+        assert adapter.instance._target.runtime_properties == {'created': True, 'tags': []}
+        assert [(e['kind'], e['key']) for e in recorder.recording['events']
+                if e['kind'] != 'get'] == [('set', 'created'), ('delete', 'existing'),
+                                           ('set', 'tags')]
+
+    def test_stream(self, tmpdir):
+        recorder = self._record(_streaming_operation, tmpdir)
+        stream = [e for e in recorder.recording['events'] if e['path'] == 'iter_resource'][0]
+        assert stream['content'] == 'ZWNobw=='
+
+        result = recording.replay(recorder.recording, function=_streaming_operation)
+        assert result.outcome == 'success'
+        assert result.runtime_properties == {'instance.runtime_properties': {
+            'existing': 1, 'streamed': 'echo'}}
+
+    def test_large_content(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(recording, 'MAX_CONTENT_SIZE', 3)
+        recorder = self._record(_operation, tmpdir)
+        download = [e for e in recorder.recording['events'] if e['path'] == 'download_resource'][0]
+        assert download['content'] is None
+        assert download['size'] == 4
+
+        result = recording.replay(recorder.recording, function=_operation)
+        assert result.outcome == 'error'
+        assert 'too many to be recorded' in result.message
+
+    def _record(self, function, tmpdir):
+        inputs = {'resource': 'script.sh'}
+        recorder = recording.Recorder('module.function', inputs)
+        adapter = _RecordingAdapter(str(tmpdir))
+        adapter._recorder = recorder
+        try:
+            function(ctx=adapter, **inputs)
+        except _Retry as e:
+            recorder.finish('retry', str(e))
+        else:
+            recorder.finish('success')
+        return recorder
+
+
+def _operation(ctx, resource):
+    ctx.logger.info('creating {0}'.format(ctx.node.properties['image_id']))
+    assert ctx.instance.runtime_properties['existing'] == 1
+    ctx.instance.runtime_properties['resource'] = ctx.get_resource(resource)
+    with open(ctx.download_resource(resource)) as f:
+        ctx.instance.runtime_properties['downloaded'] = f.read()
+
+
+def _streaming_operation(ctx, resource):
+    ctx.instance.runtime_properties['streamed'] = ''.join(ctx.iter_resource(resource))
+
+
+def _retrying_operation(ctx, **_):
+    if ctx.operation.retry_number < 3:
+        ctx.operation.retry('not yet', 5)
+
+
+class _Retry(Exception):
+    pass
+
+
+class _Stub(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class _Adapter(object):
+
+    def __init__(self, workdir):
+        self._workdir = workdir
+        self.node = _Stub(id='node', properties={'image_id': 'ami-1'})
+        self.instance = _Stub(id='node_1', runtime_properties={'existing': 1})
+        self.operation = _Stub(retry_number=0, retry=self._retry)
+
+    @property
+    def logger(self):
+        return logging.getLogger('test')
+
+    def get_resource(self, resource_path):
+        return 'echo'
+
+    def download_resource(self, resource_path, target_path=None):
+        target_path = os.path.join(self._workdir, resource_path)
+        with open(target_path, 'wb') as f:
+            f.write('echo')
+        return target_path
+
+    def iter_resource(self, resource_path):
+        return iter(['ec', 'ho'])
+
+    def _retry(self, message, retry_after):
+        raise _Retry(message)
+
+
+class _RecordingAdapter(recording.RecordingAdapterMixin, _Adapter):
+    pass
@@ -0,0 +1,114 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import pickle
+
+from aria.modeling import models
+
+from adapters import records
+
+
+def test_build_and_load():
+    compiler = records.CloudifyGraphCompiler(_Context(), None)
+    node = _Node(u'node_1', _NodeTemplate(11, u'node', [u'aria.nodes.Root', u'aria.nodes.Compute']))
+    record = records.load(compiler._build(_ApiTask(actor=node, max_attempts=3)))
+
+    assert record == records.TaskRecord(
+        blueprint_id=1,
+        deployment_id=2,
+        execution_id=3,
+        workflow_id=u'install',
+        task_name=u'plugin.tasks.create',
+        operation_name=u'Standard.create',
+        max_retries=2,
+        plugin=records.PluginRecord(u'plugin', u'package', u'1.0'),
+        node=records.NodeRecord(id=11, name=u'node', type=u'aria.nodes.Compute',
+                                type_hierarchy=[u'cloudify.nodes.Root', u'cloudify.nodes.Compute'],
+                                instance_id=u'node_1'),
+        source=None,
+        target=None)
+    assert pickle.loads(pickle.dumps(record)) == record
+
+
+def test_build_relationship():
+    compiler = records.CloudifyGraphCompiler(_Context(), None)
+    source = _Node(u'source_1', _NodeTemplate(12, u'source', [u'aria.nodes.Root']))
+    target = _Node(u'target_1', _NodeTemplate(13, u'target', [u'aria.nodes.Root']))
+    record = records.load(compiler._build(_ApiTask(actor=_Relationship(source, target),
+                                                   max_attempts=models.Task.INFINITE_RETRIES,
+                                                   plugin=None)))
+
+    assert record.node is None
+    assert record.source.instance_id == u'source_1'
+    assert record.target.instance_id == u'target_1'
+    assert record.max_retries == models.Task.INFINITE_RETRIES
+    assert record.plugin is None
+
+
+def test_load_none():
+    assert records.load(None) is None
+
+
+class _Context(object):
+    service_template = type('ServiceTemplate', (object, ), {'id': 1})
+    service = type('Service', (object, ), {'id': 2})
+    execution = type('Execution', (object, ), {'id': 3, 'workflow_name': u'install'})
+
+
+class _Type(object):
+
+    def __init__(self, hierarchy):
+        self.name = hierarchy[-1]
+        self.hierarchy = [self] if len(hierarchy) == 1 else \
+            _Type(hierarchy[:-1]).hierarchy + [self]
+
+
+class _NodeTemplate(object):
+
+    def __init__(self, id, name, hierarchy):
+        self.id = id
+        self.name = name
+        self.type = _Type(hierarchy)
+
+
+class _Node(object):
+
+    def __init__(self, id, node_template):
+        self.id = id
+        self.node_template = node_template
+
+
+class _Relationship(object):
+
+    def __init__(self, source_node, target_node):
+        self.source_node = source_node
+        self.target_node = target_node
+
+
+class _Plugin(object):
+    name = u'plugin'
+    package_name = u'package'
+    package_version = u'1.0'
+
+
+class _ApiTask(object):
+
+    def __init__(self, actor, max_attempts, plugin=_Plugin()):
+        self.actor = actor
+        self.max_attempts = max_attempts
+        self.plugin = plugin
+        self.function = u'plugin.tasks.create'
+        self.name = u'Standard:create@node:{0}'.format(actor.__class__.__name__)
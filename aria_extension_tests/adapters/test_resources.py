@@ -0,0 +1,64 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+from io import BytesIO
+
+import jinja2
+import pytest
+
+from adapters import resources
+
+
+TEMPLATES = [
+    '',
+    'plain\ntext\n',
+    'hello {{ name }}\n',
+    '#cloud-config\nhostname: {{ name }}\nruncmd:\n  - echo {{ value | upper }}\n\n',
+    '{% for i in range(3) %}\nline {{ i }}\n{% endfor %}\ntail\n',
+    '{% if name %}\n{{ name }}\n{% else %}\nnone\n{% endif %}',
+    'a {{\n  name\n}} b\n{# a\ncomment #}\nc\n',
+    '{% raw %}\n{% for %}\n{{ not rendered }}\n{% endraw %}\n',
+    'before  \n{%- if name %}\n  trimmed\n{% endif -%}\n  after\n',
+    '{% set greeting = "hi" %}\n{{ greeting }} {{ name }}\n',
+    '{% macro m(x) %}<{{ x }}>{% endmacro %}\n{{ m(name) }}\n',
+    u'unicode \u00e9 {{ name }} \u2713\n'.encode('utf-8'),
+    'no trailing newline {{ name }}',
+    'x' * 50 + '{{ name }}' + 'y' * 50 + '\n',
+    'plain\r\ntext\r\n',
+    'v={{ name }}\r\n{% for i in range(6) %}more {{ i }}\r\n{% endfor %}plain\r\nlines\r\n',
+    'old\rmac\r{{ name }}\rend\r',
+    'page\x0cbreak\r\n\r\n{{ name }}\n\n',
+    '{{ "}}\n" }}\nplain\n{{ name }}\n',
+    "{{ '{%' ~ name ~ '\n%}' }}\n{% if '{#' %}\nyes\n{% endif %}\n",
+    '{# "unterminated\n #}\n{{ name }}\n',
+    '{#- comment -#}\n{% raw -%}\n {{ x }}\n{% endraw %}\n',
+    u'a\u2028 \u2028{%- if name %}x{% endif %}\n'.encode('utf-8'),
+]
+
+
+@pytest.mark.parametrize('template', TEMPLATES)
+@pytest.mark.parametrize('chunk_size', [1, 7, resources.CHUNK_SIZE])
+def test_render(template, chunk_size):
+    variables = {'name': 'NAME', 'value': 'value'}
+    expected = jinja2.Template(template.decode('utf-8')).render(variables).encode('utf-8')
+    assert ''.join(resources.render(BytesIO(template), variables, chunk_size)) == expected
+
+
+def test_render_is_incremental():
+    source = BytesIO('{{ name }}\n' * 1000)
+    chunks = list(resources.render(source, {'name': 'NAME'}, chunk_size=100))
+    assert len(chunks) > 10
+    assert max(len(chunk) for chunk in chunks) < 200
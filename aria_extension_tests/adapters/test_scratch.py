@@ -0,0 +1,178 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+import json
+import errno
+import tempfile
+import subprocess
+
+import pytest
+
+from adapters import scratch
+
+
+class TestScratchSpace(object):
+
+    def test_managed(self, tmpdir):
+        space = scratch.ScratchSpace([str(tmpdir)])
+        ctx = _Context()
+        with space.managed(ctx):
+            assert scratch.current(ctx) is space
+            path = space.create(['con', 'tent'], suffix='script.sh')
+            assert path.endswith('script.sh')
+            assert os.path.dirname(os.path.dirname(path)) == str(tmpdir)
+            with open(path) as f:
+                assert f.read() == 'content'
+        assert scratch.current(ctx) is None
+        assert os.listdir(str(tmpdir)) == []
+
+    def test_no_space_fallback(self, tmpdir):
+        tmpfs, disk = str(tmpdir.join('tmpfs')), str(tmpdir.join('disk'))
+        space = _FullScratchSpace([tmpfs, disk], capacity=4)
+
+        path = space.create(['abc', 'def', 'ghi'])
+        assert path.startswith(disk)
+        with open(path) as f:
+            assert f.read() == 'abcdefghi'
+        assert os.listdir(space._directories[tmpfs]) == []
+        assert space.usage() == 9
+
+    def test_total_quota_fallback(self, tmpdir):
+        tmpfs, disk = str(tmpdir.join('tmpfs')), str(tmpdir.join('disk'))
+        space = scratch.ScratchSpace([tmpfs, disk], total_quota=10)
+        first = space.create(['a' * 6])
+        assert first.startswith(tmpfs)
+        # Moves to disk as it grows over the quota of the tmpfs
+        second = space.create(['b' * 3, 'c' * 3])
+        assert second.startswith(disk)
+        with open(second) as f:
+            assert f.read() == 'bbbccc'
+        assert os.listdir(space._directories[tmpfs]) == [os.path.basename(first)]
+        with pytest.raises(scratch.QuotaExceeded):
+            space.create(['d' * 8])
+        assert space.usage() == 12
+        # The bytes of the moved file stay reserved for the operation, up to a reservation's worth
+        assert _ledger(tmpfs) == {os.path.basename(space._directories[tmpfs]): 9}
+        assert _ledger(disk) == {os.path.basename(space._directories[disk]): 6}
+
+        space.clear()
+        assert _ledger(tmpfs) == {}
+        assert _ledger(disk) == {}
+
+    def test_total_quota_shared(self, tmpdir):
+        first_space = scratch.ScratchSpace([str(tmpdir)], total_quota=10)
+        second_space = scratch.ScratchSpace([str(tmpdir)], total_quota=10)
+        first_space.create(['x' * 8])
+        with pytest.raises(scratch.QuotaExceeded):
+            second_space.create(['x' * 8])
+        assert second_space.usage() == 0
+        first_space.clear()
+        second_space.create(['x' * 8])
+
+    def test_quota(self, tmpdir):
+        space = scratch.ScratchSpace([str(tmpdir)], quota=10)
+        space.create(['x' * 8])
+        chunks = iter(['x'] * 5)
+        with pytest.raises(scratch.QuotaExceeded) as excinfo:
+            space.create(chunks)
+        assert excinfo.value.errno == errno.EDQUOT
+        # Fails as soon as the quota is crossed, rather than once the file is written
+        assert list(chunks) == ['x'] * 2
+        assert space.usage() == 8
+        assert len(os.listdir(space._directories[str(tmpdir)])) == 1
+
+    def test_write_failure(self, tmpdir):
+        space = scratch.ScratchSpace([str(tmpdir)])
+
+        def chunks():
+            yield 'content'
+            raise IOError(errno.ENOENT, 'No such resource')
+
+        with pytest.raises(IOError):
+            space.create(chunks())
+        assert space.usage() == 0
+        assert os.listdir(space._directories[str(tmpdir)]) == []
+
+    def test_from_environment(self, tmpdir, monkeypatch):
+        monkeypatch.delenv(scratch.SCRATCH_DIR_ENV, raising=False)
+        assert scratch.ScratchSpace.from_environment() is None
+
+        monkeypatch.setenv(scratch.SCRATCH_DIR_ENV, str(tmpdir))
+        monkeypatch.setenv(scratch.SCRATCH_QUOTA_ENV, '1024')
+        space = scratch.ScratchSpace.from_environment()
+        assert space.roots == [str(tmpdir)]
+        assert space._quota == 1024
+
+        monkeypatch.setenv(scratch.SCRATCH_DIR_ENV, scratch.AUTO)
+        roots = scratch.ScratchSpace.from_environment().roots
+        assert roots[-1] == os.path.join(tempfile.gettempdir(), scratch.SCRATCH_NAME)
+        assert len(roots) == (2 if scratch.tmpfs_available() else 1)
+
+
+def test_collect(tmpdir):
+    process = subprocess.Popen(['true'])
+    process.wait()
+    dead = tmpdir.mkdir('{0}-abc'.format(process.pid))
+    dead.join('file').write('content')
+    alive = tmpdir.mkdir('{0}-abc'.format(os.getpid()))
+    tmpdir.join(scratch.LEDGER_NAME).write(json.dumps({dead.basename: 7, alive.basename: 8}))
+
+    scratch.collect(str(tmpdir))
+
+    assert not dead.check()
+    assert alive.check()
+    assert _ledger(str(tmpdir)) == {alive.basename: 8}
+
+
+class _Context(object):
+    pass
+
+
+class _FullScratchSpace(scratch.ScratchSpace):
+    """
+    Scratch space whose first root runs out of space past ``capacity`` bytes.
+    """
+
+    def __init__(self, roots, capacity):
+        super(_FullScratchSpace, self).__init__(roots)
+        self._capacity = capacity
+
+    def _open(self, index, suffix):
+        path, f = super(_FullScratchSpace, self)._open(index, suffix)
+        return path, (_FullFile(f, self._capacity) if index == 0 else f)
+
+
+class _FullFile(object):
+
+    def __init__(self, f, capacity):
+        self._file = f
+        self._capacity = capacity
+
+    def write(self, data):
+        self._file.write(data[:self._capacity])
+        if len(data) > self._capacity:
+            self._capacity = 0
+            raise IOError(errno.ENOSPC, 'No space left on device')
+        self._capacity -= len(data)
+
+    def close(self):
+        self._file.close()
+
+
+def _ledger(root):
+    with open(os.path.join(root, scratch.LEDGER_NAME)) as f:
+        return json.load(f)
@@ -0,0 +1,110 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import json
+import threading
+from contextlib import contextmanager
+
+from adapters import tracing
+
+
+class TestTracing(object):
+
+    def test_spans_nest_under_operation_span(self, tmpdir):
+        trace_file = str(tmpdir.join('trace.jsonl'))
+        with tracing.operation_span('Standard.create', path=trace_file, task_id='TASK'):
+            _traced_call(lambda: _traced_call(lambda: None))
+
+        events = _read_events(trace_file)
+        assert [e['name'] for e in events] == ['call', 'call', 'Standard.create']
+        inner, outer, operation = events
+        assert operation['cat'] == 'operation'
+        assert operation['args']['task_id'] == 'TASK'
+        assert outer['args']['parent_id'] == operation['args']['span_id']
+        assert inner['args']['parent_id'] == outer['args']['span_id']
+        assert operation['ts'] <= outer['ts'] <= inner['ts']
+        assert inner['ts'] + inner['dur'] <= operation['ts'] + operation['dur']
+        assert all(e['ph'] == 'X' for e in events)
+
+    def test_traced_context(self, tmpdir):
+        trace_file = str(tmpdir.join('trace.jsonl'))
+        with tracing.operation_span('op', path=trace_file):
+            with tracing.traced_context('scope', _context()) as value:
+                assert value == 'value'
+
+        assert [e['name'] for e in _read_events(trace_file)] == ['scope', 'scope:exit', 'op']
+
+    def test_threads(self, tmpdir):
+        trace_file = str(tmpdir.join('trace.jsonl'))
+        started = threading.Event()
+        resume = threading.Event()
+
+        def first():
+            with tracing.operation_span('first', path=trace_file):
+                started.set()
+                resume.wait(5)
+                _traced_call(lambda: None)
+
+        def second():
+            started.wait(5)
+            # Runs while the first thread's operation is traced
+            with tracing.operation_span('second', path=trace_file):
+                _traced_call(lambda: None)
+            resume.set()
+
+        threads = [threading.Thread(target=target) for target in (first, second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        events = _read_events(trace_file)
+        assert [e['name'] for e in events] == ['call', 'second', 'call', 'first']
+        for call, operation in (events[:2], events[2:]):
+            assert call['args']['parent_id'] == operation['args']['span_id']
+            assert call['tid'] == operation['tid']
+
+    def test_off(self, tmpdir, monkeypatch):
+        monkeypatch.delenv(tracing.TRACE_FILE_ENV, raising=False)
+        with tracing.operation_span('op'):
+            assert _traced_call(lambda: 'result') == 'result'
+        assert not tmpdir.listdir()
+
+    def test_to_chrome_trace(self, tmpdir):
+        trace_file = str(tmpdir.join('trace.jsonl'))
+        output = tmpdir.join('trace.json')
+        for _ in range(2):
+            with tracing.operation_span('op', path=trace_file):
+                pass
+
+        tracing.to_chrome_trace(trace_file, str(output))
+
+        assert len(json.loads(output.read())['traceEvents']) == 2
+
+
+@tracing.traced('call')
+def _traced_call(function):
+    return function()
+
+
+@contextmanager
+def _context():
+    yield 'value'
+
+
+def _read_events(trace_file):
+    with open(trace_file) as f:
+        return [json.loads(line) for line in f]
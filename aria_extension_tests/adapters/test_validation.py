@@ -0,0 +1,80 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import pytest
+
+from adapters import validation
+
+
+class TestValidationCache(object):
+
+    def test_add_and_get(self, cache):
+        assert cache.get('key') is None
+        entry = cache.add('key', operation='Validation.creation', package_name='aws')
+        assert cache.get('key') == entry
+        assert entry['operation'] == 'Validation.creation'
+
+    def test_ttl(self, tmpdir, monkeypatch):
+        cache = validation.ValidationCache(str(tmpdir), ttl=60)
+        now = [1000.0]
+        monkeypatch.setattr(validation.time, 'time', lambda: now[0])
+        cache.add('key')
+        now[0] += 59
+        assert cache.get('key') is not None
+        now[0] += 2
+        assert cache.get('key') is None
+        assert tmpdir.listdir() == []
+
+    def test_invalidate(self, cache):
+        cache.add('key')
+        cache.invalidate('key')
+        cache.invalidate('missing')
+        assert cache.get('key') is None
+
+    def test_clear(self, cache):
+        cache.add('key1', package_name='aws', package_version='1.4')
+        cache.add('key2', package_name='aws', package_version='1.5')
+        cache.add('key3', package_name='openstack', package_version='2.0')
+        assert cache.clear(package_name='aws', package_version='1.4') == 1
+        assert cache.get('key2') is not None
+        assert cache.clear() == 2
+        assert cache.get('key3') is None
+        assert validation.ValidationCache('/nonexistent').clear() == 0
+
+    @pytest.fixture
+    def cache(self, tmpdir):
+        return validation.ValidationCache(str(tmpdir))
+
+
+def test_is_validation():
+    assert validation.is_validation('cloudify_aws.ec2.instance.creation_validation',
+                                    'Validation.creation')
+    assert validation.is_validation('nova_plugin.server.validate',
+                                    'cloudify.interfaces.validation.creation')
+    assert not validation.is_validation('cloudify_aws.ec2.instance.create',
+                                        'cloudify.interfaces.lifecycle.create')
+
+
+def test_key():
+    arguments = ['cloudify_aws.ec2.instance.creation_validation', 'Validation.creation',
+                 'cloudify-aws-plugin', '1.4.10', {'image_id': 'ami-1', 'tags': {'a': 1, 'b': 2}},
+                 {}]
+    key = validation.key(*arguments)
+    reordered = {'tags': {'b': 2, 'a': 1}, 'image_id': 'ami-1'}
+    assert validation.key(*arguments[:4] + [reordered, {}]) == key
+    assert validation.key(*arguments[:3] + ['1.4.11'] + arguments[4:]) != key
+    assert validation.key(*arguments[:4] + [{'image_id': 'ami-2'}, {}]) != key
+    assert validation.key(*arguments[:1] + ['Validation.delete'] + arguments[2:]) != key
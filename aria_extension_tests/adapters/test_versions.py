@@ -0,0 +1,154 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+import datetime
+import threading
+
+import pytest
+
+import aria
+from aria.modeling import models
+from aria.storage import sql_mapi
+
+from adapters import versions
+
+
+def test_advance(tmpdir):
+    version = versions.NodeVersion(1, str(tmpdir))
+    assert version.current == 0
+    version.advance()
+    assert version.current == 1
+    # Other workers see the same version
+    assert versions.NodeVersion(1, str(tmpdir)).current == 1
+    assert versions.NodeVersion(2, str(tmpdir)).current == 0
+
+
+def test_held(tmpdir):
+    version = versions.NodeVersion(1, str(tmpdir))
+    with version.held() as current:
+        assert current == 0
+        version.advance()
+    assert version.current == 1
+
+
+def test_caught_up(tmpdir):
+    version = versions.NodeVersion(1, str(tmpdir))
+    version.advance()
+    assert version.caught_up(0) == 1
+
+    # Writes of other threads are not the caller's
+    thread = threading.Thread(target=version.advance)
+    thread.start()
+    thread.join()
+    version.advance()
+    assert version.current == 3
+    assert version.caught_up(0) == 1
+    assert version.caught_up(2) == 3
+
+
+def test_directory(tmpdir, monkeypatch):
+    monkeypatch.setenv(versions.NODE_VERSIONS_DIR_ENV, str(tmpdir.join('versions')))
+    directory = versions.create_directory()
+    assert os.path.dirname(directory) == str(tmpdir.join('versions'))
+
+    assert versions.NodeVersion.from_environment(1) is None
+    assert not versions.enabled()
+    monkeypatch.setenv(versions.EXECUTOR_VERSIONS_DIR_ENV, directory)
+    assert versions.enabled()
+    versions.NodeVersion.from_environment(1).advance()
+    assert versions.NodeVersion(1, directory).current == 1
+
+
+class TestTrackWrites(object):
+
+    def test_runtime_properties(self, model, node):
+        version = versions.NodeVersion.from_environment(node.id)
+        with model.instrument(models.Node.attributes):
+            instance = model.node.get(node.id)
+            instance.attributes['created'] = True
+            assert version.current == 1
+            instance.attributes['created'] = False
+            assert version.current == 2
+        assert version.caught_up(0) == 2
+
+    def test_update(self, model, node):
+        version = versions.NodeVersion.from_environment(node.id)
+        node.state = 'started'
+        model.node.update(node)
+        assert version.current == 1
+        # Nothing written
+        model.node.update(node)
+        assert version.current == 1
+
+    def test_other_writer(self, model, node):
+        version = versions.NodeVersion.from_environment(node.id)
+
+        def write():
+            other = aria.application_model_storage(**model.serialization_dict)
+            with other.instrument(models.Node.attributes):
+                other.node.get(node.id).attributes['other'] = 1
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        thread.join()
+        assert version.current == 1
+        assert version.caught_up(0) == 0
+
+    def test_waits_for_holder(self, model, node):
+        version = versions.NodeVersion.from_environment(node.id)
+        written = threading.Event()
+
+        def write():
+            with model.instrument(models.Node.attributes):
+                model.node.get(node.id).attributes['waited'] = True
+            written.set()
+
+        with version.held():
+            thread = threading.Thread(target=write)
+            thread.start()
+            assert not written.wait(0.5)
+        thread.join()
+        assert version.current == 1
+
+
+@pytest.fixture
+def model(tmpdir, monkeypatch):
+    monkeypatch.setenv(versions.EXECUTOR_VERSIONS_DIR_ENV, str(tmpdir.join('versions')))
+    versions.track_writes()
+    model = aria.application_model_storage(sql_mapi.SQLAlchemyModelAPI,
+                                           initiator_kwargs=dict(base_dir=str(tmpdir)))
+    yield model
+    model._all_api_kwargs['session'].close()
+    model._all_api_kwargs['engine'].dispose()
+
+
+@pytest.fixture
+def node(model):
+    node_type = models.Type(name='type', variant='node')
+    service_template = models.ServiceTemplate(name='template',
+                                              created_at=datetime.datetime.utcnow())
+    model.service_template.put(service_template)
+    node_template = models.NodeTemplate(name='node', type=node_type,
+                                        service_template=service_template)
+    model.node_template.put(node_template)
+    service = models.Service(name='service', service_template=service_template,
+                             created_at=datetime.datetime.utcnow())
+    model.service.put(service)
+    node = models.Node(name='node_1', type=node_type, node_template=node_template,
+                       service=service, state='initial')
+    model.node.put(node)
+    return node
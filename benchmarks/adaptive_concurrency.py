@@ -0,0 +1,130 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Compares fixed worker limits with :class:`adapters.concurrency.ConcurrencyController` on phases of
+I/O-heavy operations (waiting on a simulated cloud API), CPU-heavy ones, and storage-heavy ones
+(committing to a shared SQLite database, as instrumented operations do).
+
+Every operation runs in a subprocess, as with the process executor, and reports its wall time, CPU
+time and commit time, which the adaptive run feeds to the controller. For each phase, the duration
+and mean operation latency are reported, and the limit the adaptive run ended the phase with.
+
+Run from the repository root:
+``python -m benchmarks.adaptive_concurrency [tasks per phase] [max workers]``
+"""
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import multiprocessing
+
+from adapters import concurrency
+
+
+PHASES = ('io', 'cpu', 'storage', 'io')
+
+# Seconds an I/O-heavy operation waits on the simulated API
+IO_WAIT = 0.2
+# CPU seconds a CPU-heavy operation burns
+CPU_WORK = 0.1
+# Commits of a storage-heavy operation, and seconds each holds the database write lock
+COMMITS = 5
+COMMIT_HOLD = 0.005
+
+
+def _operation(kind, database, results):
+    start = time.time()
+    start_cpu_time = concurrency.cpu_time()
+    start_cpu_wait = concurrency.cpu_wait()
+    storage_time = 0
+    if kind == 'io':
+        time.sleep(IO_WAIT)
+    elif kind == 'cpu':
+        while concurrency.cpu_time() - start_cpu_time < CPU_WORK:
+            sum(range(1000))
+    else:
+        connection = sqlite3.connect(database, timeout=60, isolation_level=None)
+        for index in range(COMMITS):
+            commit_start = time.time()
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('INSERT INTO attributes VALUES (?, ?)', (os.getpid(), index))
+            time.sleep(COMMIT_HOLD)
+            connection.execute('COMMIT')
+            storage_time += time.time() - commit_start
+        connection.close()
+    results.put((time.time() - start, concurrency.cpu_time() - start_cpu_time, storage_time,
+                 concurrency.cpu_wait() - start_cpu_wait))
+
+
+def run_phase(kind, tasks, database, limit, observe=None):
+    """
+    Runs ``tasks`` operations of ``kind``, at most ``limit()`` at once; returns the duration and
+    mean operation latency.
+    """
+    results = multiprocessing.Queue()
+    processes = []
+    latencies = []
+    start = time.time()
+    while len(latencies) < tasks:
+        while len(processes) < tasks and len(processes) - len(latencies) < limit():
+            process = multiprocessing.Process(target=_operation, args=(kind, database, results))
+            process.start()
+            processes.append(process)
+        usage = results.get()
+        latencies.append(usage[0])
+        if observe is not None:
+            observe(*usage)
+    duration = time.time() - start
+    for process in processes:
+        process.join()
+    return duration, sum(latencies) / len(latencies)
+
+
+def main(tasks=60, max_workers=32):
+    directory = tempfile.mkdtemp()
+    try:
+        database = os.path.join(directory, 'storage.db')
+        connection = sqlite3.connect(database)
+        connection.execute('CREATE TABLE attributes (pid INTEGER, value INTEGER)')
+        connection.commit()
+        connection.close()
+
+        cpus = multiprocessing.cpu_count()
+        print('{0} tasks per phase, {1} CPUs; duration / mean latency (limit)'.format(tasks, cpus))
+        print('{0:>10} '.format('workers') + ' '.join('{0:>22}'.format(kind) for kind in PHASES))
+        for workers in sorted(set([cpus, max_workers])) + [None]:
+            if workers is None:
+                controller = concurrency.ConcurrencyController(1, max_workers)
+                name = '1-{0}'.format(max_workers)
+                limit, observe = (lambda: controller.limit), controller.observe
+            else:
+                name = str(workers)
+                limit, observe = (lambda: workers), None
+            row = ['{0:>10}'.format(name)]
+            for kind in PHASES:
+                duration, latency = run_phase(kind, tasks, database, limit, observe)
+                row.append('{0:7.2f}s {1:7.3f}s ({2:>3})'.format(duration, latency, limit()))
+            print(' '.join(row))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
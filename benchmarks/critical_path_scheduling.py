@@ -0,0 +1,96 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Simulates the makespan of a provisioning workflow under FIFO and critical-path-first dispatch.
+
+The workflow resembles the AWS hello world blueprint scaled out: a shared security group and key
+pair, then per VM an elastic IP, a volume and a create/configure/start instance chain with long
+cloud-side waits, plus many short independent tasks (e.g. DNS records, tags). Durations are what
+:class:`adapters.durations.DurationStore` would estimate from history. Ready tasks are dispatched
+to a fixed number of workers, in graph order (FIFO) or by descending critical path priority.
+
+Pure Python, no ARIA required: ``python -m benchmarks.critical_path_scheduling [workers] [vms]``
+"""
+
+import sys
+import heapq
+
+from adapters import durations
+
+
+def workflow(vms, short_tasks_per_vm=6):
+    tasks = {}  # id: (duration, dependencies); ids sort in graph order
+    tasks['000-securitygroup.create'] = (4, [])
+    tasks['001-keypair.create'] = (2, [])
+    for vm in range(vms):
+        prefix = '{0:03d}-vm{1}'.format(vm + 2, vm)
+        for index in range(short_tasks_per_vm):
+            tasks['{0}-0-short{1}'.format(prefix, index)] = (1, [])
+        tasks[prefix + '-1-elasticip.create'] = (3, [])
+        tasks[prefix + '-2-volume.create'] = (15, [])
+        tasks[prefix + '-3-instance.create'] = (
+            45, ['000-securitygroup.create', '001-keypair.create'])
+        tasks[prefix + '-4-instance.configure'] = (20, [prefix + '-3-instance.create'])
+        tasks[prefix + '-5-instance.start'] = (60, [prefix + '-4-instance.configure'])
+        tasks[prefix + '-6-volume.attach'] = (
+            10, [prefix + '-2-volume.create', prefix + '-5-instance.start'])
+        tasks[prefix + '-7-elasticip.associate'] = (
+            5, [prefix + '-1-elasticip.create', prefix + '-5-instance.start'])
+    return tasks
+
+
+def makespan(tasks, workers, priority):
+    remaining = dict((task_id, len(dependencies))
+                     for task_id, (_, dependencies) in tasks.items())
+    dependents = dict((task_id, []) for task_id in tasks)
+    for task_id, (_, dependencies) in tasks.items():
+        for dependency in dependencies:
+            dependents[dependency].append(task_id)
+
+    ready = [(priority(task_id), task_id) for task_id, count in remaining.items() if count == 0]
+    heapq.heapify(ready)
+    running = []
+    now = 0
+    while ready or running:
+        while ready and len(running) < workers:
+            _, task_id = heapq.heappop(ready)
+            heapq.heappush(running, (now + tasks[task_id][0], task_id))
+        now, task_id = heapq.heappop(running)
+        for dependent in dependents[task_id]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                heapq.heappush(ready, (priority(dependent), dependent))
+    return now
+
+
+def main(workers=4, vms=8):
+    tasks = workflow(vms)
+    priorities = durations.critical_path_priorities(tasks)
+    fifo = makespan(tasks, workers, lambda task_id: task_id)
+    critical_path = makespan(tasks, workers, lambda task_id: (-priorities[task_id], task_id))
+    lower_bound = max(max(priorities.values()),
+                      sum(duration for duration, _ in tasks.values()) / float(workers))
+
+    print('{0} tasks, {1} workers'.format(len(tasks), workers))
+    print('lower bound:         {0:8.1f}s'.format(lower_bound))
+    print('FIFO:                {0:8.1f}s'.format(fifo))
+    print('critical path first: {0:8.1f}s ({1:.1%} shorter)'.format(
+        critical_path, 1 - float(critical_path) / fifo))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
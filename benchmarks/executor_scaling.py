@@ -0,0 +1,266 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Measures how the throughput of Cloudify operations scales with the number of worker processes.
+
+Runs a workflow of independent Cloudify-style operations (through ``CloudifyExecutorExtension``
+and the context adapter) with ``CloudifyProcessExecutor`` capped at 1, 2, 4... workers, and
+reports tasks/sec, p50/p99 task latency (from dispatch to success) and the number of storage writes
+per task, made by the engine and by the operation subprocesses. ``noop`` operations read node
+properties and runtime properties; ``sleep`` operations also wait, as for a cloud API call.
+
+A last run per operation groups up to ``bulk size`` tasks per worker (see :mod:`adapters.bulk`),
+at the highest worker count.
+
+Spawning, storage contention and adapter overhead show up as follows: spawn bound runs scale
+until the CPUs are busy, storage bound runs flatten while writes per task stay constant, and
+adapter overhead shows as the gap between no-op latency and bare process startup.
+
+Requires ARIA (with its TOSCA extension), the Cloudify plugins common package and this package
+installed (as for the test suite). Run from the repository root:
+``python -m benchmarks.executor_scaling [tasks] [max workers] [sleep seconds] [bulk size]``
+"""
+
+import os
+import sys
+import time
+import atexit
+import logging
+import shutil
+import datetime
+import tempfile
+import threading
+import multiprocessing
+
+from sqlalchemy import event
+
+import aria
+from aria import (workflow, operation)
+from aria import logger as aria_logger
+from aria.core import Core
+from aria.modeling import models
+from aria.orchestrator import events
+from aria.orchestrator.context.workflow import WorkflowContext
+from aria.orchestrator.plugin import PluginManager
+from aria.orchestrator.workflows import api
+from aria.orchestrator.workflows.core import (engine, graph_compiler)
+from aria.storage import (sql_mapi, filesystem_rapi)
+from aria.utils import type as type_
+
+from adapters import (durations, utils)
+from adapters.executor import CloudifyProcessExecutor
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+SERVICE_TEMPLATE = """
+tosca_definitions_version: tosca_simple_yaml_1_0
+node_types:
+  benchmark.Node:
+    derived_from: tosca.nodes.Root
+    properties:
+      benchmark:
+        type: string
+        default: benchmark
+topology_template:
+  node_templates:
+    node:
+      type: benchmark.Node
+"""
+
+
+@operation
+def noop(ctx, writes_path, **_):
+    _count_writes(ctx, writes_path)
+    ctx.node.properties.get('benchmark')
+    ctx.instance.runtime_properties.get('benchmark')
+
+
+@operation
+def sleep(ctx, writes_path, seconds, **_):
+    _count_writes(ctx, writes_path)
+    ctx.node.properties.get('benchmark')
+    ctx.instance.runtime_properties.get('benchmark')
+    time.sleep(seconds)
+
+
+def _count_writes(ctx, writes_path):
+    counter = _WriteCounter()
+    counter.listen(ctx._ctx.model)
+
+    # The operation context is flushed and closed after the operation returns
+    def report():
+        with utils.file_lock(writes_path + '.lock'):
+            with open(writes_path, 'ab') as f:
+                f.write('{0}\n'.format(counter.count))
+    atexit.register(report)
+
+
+class _WriteCounter(object):
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def listen(self, model):
+        event.listen(model.node._session.get_bind(), 'before_cursor_execute', self._execute)
+
+    def _execute(self, connection, cursor, statement, *_):
+        if statement.lstrip().upper().startswith(_WRITES):
+            with self._lock:
+                self.count += 1
+
+
+def _workflow_context(directory):
+    model_storage = aria.application_model_storage(
+        sql_mapi.SQLAlchemyModelAPI, initiator_kwargs=dict(base_dir=directory))
+    resource_storage = aria.application_resource_storage(
+        filesystem_rapi.FileSystemResourceAPI,
+        api_kwargs=dict(directory=os.path.join(directory, 'resources')))
+    core = Core(model_storage, resource_storage,
+                PluginManager(model_storage, os.path.join(directory, 'plugins')))
+
+    template_dir = os.path.join(directory, 'template')
+    utils.makedirs(template_dir)
+    template_path = os.path.join(template_dir, 'benchmark.yaml')
+    with open(template_path, 'w') as f:
+        f.write(SERVICE_TEMPLATE)
+    core.create_service_template(template_path, template_dir, 'benchmark')
+    service = core.create_service(model_storage.service_template.get_by_name('benchmark').id, {},
+                                  'benchmark')
+
+    execution = models.Execution(created_at=datetime.datetime.utcnow(),
+                                 service=service,
+                                 workflow_name='benchmark',
+                                 inputs={})
+    model_storage.execution.put(execution)
+    return WorkflowContext(name='benchmark',
+                           model_storage=model_storage,
+                           resource_storage=resource_storage,
+                           service_id=service.id,
+                           execution_id=execution.id,
+                           workflow_name='benchmark',
+                           workdir=os.path.join(directory, 'workdir'))
+
+
+def run(workers, tasks, function, arguments, bulk_size=None):
+    directory = tempfile.mkdtemp()
+    workflow_context = _workflow_context(directory)
+    writes_path = os.path.join(directory, 'writes')
+    arguments = dict(arguments, writes_path=writes_path)
+    executor = CloudifyProcessExecutor(max_workers=workers,
+                                       bulk_size=bulk_size,
+                                       python_path=[ROOT_DIR])
+    sent = {}
+    ended = {}
+
+    def on_sent(ctx, **_):
+        sent[ctx.task.id] = time.time()
+
+    def on_success(ctx, **_):
+        ended[ctx.task.id] = time.time()
+
+    events.sent_task_signal.connect(on_sent)
+    events.on_success_task_signal.connect(on_success)
+    try:
+        plugin = models.Plugin(name='benchmark',
+                               archive_name='benchmark',
+                               package_name='benchmark',
+                               package_version='0.1',
+                               uploaded_at=datetime.datetime.now(),
+                               wheels=['cloudify_plugins_common'])
+        workflow_context.model.plugin.put(plugin)
+        node = workflow_context.service.nodes.values()[0]
+        node_operation = models.Operation(
+            name='op',
+            function='{0}.{1}'.format(__name__, function.__name__),
+            plugin=plugin)
+        for name, value in arguments.items():
+            node_operation.arguments[name] = models.Argument.wrap(name, value)
+            node_operation.inputs[name] = models.Input(name=name,
+                                                       type_name=type_.full_type_name(value))
+        node.interfaces['benchmark'] = models.Interface(
+            name='benchmark',
+            type=node.interfaces['Standard'].type,
+            operations={'op': node_operation})
+        workflow_context.model.node.update(node)
+
+        @workflow
+        def benchmark_workflow(graph, **_):
+            graph.add_tasks(*[api.task.OperationTask(node, 'benchmark', 'op', arguments=arguments)
+                              for _ in range(tasks)])
+
+        graph_compiler.GraphCompiler(workflow_context, executor.__class__).compile(
+            benchmark_workflow(ctx=workflow_context))
+        engine_writes = _WriteCounter()
+        engine_writes.listen(workflow_context.model)
+
+        start = time.time()
+        engine.Engine(executors={executor.__class__: executor}).execute(workflow_context)
+        duration = time.time() - start
+
+        operation_writes = 0
+        if os.path.exists(writes_path):
+            with open(writes_path) as f:
+                operation_writes = sum(int(line) for line in f)
+        latencies = [ended[task_id] - sent[task_id] for task_id in ended if task_id in sent]
+        return {
+            'tasks/sec': len(ended) / duration,
+            'p50 latency': durations.percentile(latencies, 50),
+            'p99 latency': durations.percentile(latencies, 99),
+            'engine writes/task': float(engine_writes.count) / tasks,
+            'operation writes/task': float(operation_writes) / tasks
+        }
+    finally:
+        events.sent_task_signal.disconnect(on_sent)
+        events.on_success_task_signal.disconnect(on_success)
+        executor.close()
+        _release(workflow_context.model)
+        shutil.rmtree(directory)
+
+
+def _release(model_storage):
+    # Contexts log to the storage of the first one that registered the task logger handler
+    logging.getLogger(aria_logger.TASK_LOGGER_NAME).handlers = []
+    model_storage._all_api_kwargs['session'].close()
+    model_storage._all_api_kwargs['engine'].dispose()
+
+
+def main(tasks=1000, max_workers=multiprocessing.cpu_count() * 2, seconds=0.5, bulk_size=50):
+    aria.install_aria_extensions()
+    for name, function, arguments in (('noop', noop, {}),
+                                      ('sleep', sleep, {'seconds': float(seconds)})):
+        workers = 1
+        while True:
+            _report(name, '{0:3} workers'.format(workers),
+                    run(workers, tasks, function, arguments))
+            if workers >= max_workers:
+                break
+            workers = min(workers * 2, max_workers)
+        _report(name, '{0:3} workers, bulk {1}'.format(max_workers, bulk_size),
+                run(max_workers, tasks, function, arguments, bulk_size=bulk_size))
+
+
+def _report(name, configuration, result):
+    print('{0:5} {1}: {2}'.format(name, configuration, ', '.join(
+        '{0}: {1:.3f}'.format(key, value) for key, value in sorted(result.items()))))
+
+
+if __name__ == '__main__':
+    main(*[float(arg) if '.' in arg else int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,140 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Compares dispatching tasks with large inputs as ARIA does (every attempt pickles all the arguments
+into the file the subprocess reads) and with :class:`adapters.inputs.InputStore`.
+
+The input resembles the AWS plugin's ``RunInstancesParameters``, with many block device mappings
+and network interfaces. Every task is dispatched for a first attempt and a number of retries; the
+dispatch time covers encoding and writing the arguments file, and the worker side, measured in a
+fresh process, covers reading and decoding it, with its peak RSS.
+
+Requires ARIA on the Python path. Run from the repository root:
+``python -m benchmarks.input_transport [tasks] [attempts] [input size in KB]``
+"""
+
+import os
+import sys
+import time
+import pickle
+import shutil
+import cPickle
+import resource
+import tempfile
+import multiprocessing
+
+from adapters import inputs
+
+
+def run_instances_parameters(size):
+    parameters = {'ImageId': 'ami-0123456789abcdef0', 'InstanceType': 'm4.large',
+                  'BlockDeviceMappings': [], 'NetworkInterfaces': []}
+    index = 0
+    while index % 100 or len(cPickle.dumps(parameters)) < size:
+        parameters['BlockDeviceMappings'].append({
+            'DeviceName': '/dev/xvd{0}'.format(index),
+            'Ebs': {'DeleteOnTermination': True, 'VolumeSize': 100, 'VolumeType': 'gp2',
+                    'SnapshotId': 'snap-{0:017x}'.format(index)}})
+        parameters['NetworkInterfaces'].append({
+            'DeviceIndex': index, 'SubnetId': 'subnet-{0:017x}'.format(index),
+            'Groups': ['sg-{0:017x}'.format(index)], 'PrivateIpAddress': '10.0.{0}.{1}'.format(
+                index // 256, index % 256)})
+        index += 1
+    return parameters
+
+
+class _Argument(object):
+
+    def __init__(self, value):
+        self.value = value
+
+
+class _Task(object):
+
+    def __init__(self, id, parameters):
+        self.id = id
+        self.arguments = {'parameters': _Argument(parameters), 'instance_name': _Argument(
+            'vm-{0}'.format(id))}
+
+
+def dispatch(tasks, attempts, directory, store=None):
+    """
+    Writes the arguments files of every attempt of ``tasks``; returns their paths and the mean
+    dispatch time.
+    """
+    paths = []
+    start = time.time()
+    for _ in range(attempts):
+        for task in tasks:
+            if store is None:
+                arguments = dict((name, argument.value)
+                                 for name, argument in task.arguments.items())
+            else:
+                arguments = store.arguments(task)
+            fd, path = tempfile.mkstemp(dir=directory, suffix='.json')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pickle.dumps({'operation_arguments': arguments}))
+            paths.append(path)
+    return paths, (time.time() - start) / len(paths)
+
+
+def _receive(path, results):
+    start = time.time()
+    with open(path) as f:
+        arguments = pickle.loads(f.read())['operation_arguments']
+    arguments.update(inputs.load(arguments.pop(inputs.BLOB_INPUTS_ARGUMENT, None)))
+    results.put((time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def receive(path):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_receive, args=(path, results))
+    process.start()
+    process.join()
+    return results.get()
+
+
+def main(task_count=50, attempts=3, size=512):
+    directory = tempfile.mkdtemp()
+    try:
+        parameters = run_instances_parameters(size * 1024)
+        print('{0} tasks, {1} attempts each, {2} KB input'.format(task_count, attempts, size))
+        print('{0:>8} {1:>14} {2:>14} {3:>14} {4:>14}'.format(
+            'mode', 'dispatch', 'written', 'worker', 'worker RSS'))
+        for mode in ('aria', 'blobs'):
+            store = inputs.InputStore(64 * 1024, os.path.join(directory, 'inputs')) \
+                if mode == 'blobs' else None
+            tasks = [_Task(index, parameters) for index in range(task_count)]
+            paths, dispatch_time = dispatch(tasks, attempts, directory, store)
+            written = sum(os.path.getsize(path) for path in paths)
+            if store is not None:
+                written += sum(os.path.getsize(os.path.join(store.directory, name))
+                               for name in os.listdir(store.directory))
+            worker_time, peak = receive(paths[-1])
+            print('{0:>8} {1:11.2f} ms {2:11.1f} MB {3:11.2f} ms {4:11.1f} MB'.format(
+                mode, dispatch_time * 1000, written / 1024.0 / 1024, worker_time * 1000,
+                peak / 1024.0))
+            for path in paths:
+                os.remove(path)
+            if store is not None:
+                store.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,117 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Measures the conflict rate and throughput of concurrent node instance writers.
+
+Every writer process increments a counter in the runtime properties of the same node instance.
+In ``versioned`` mode writers use ``update(on_conflict=...)`` to re-apply their increment on top of
+concurrent writes, in ``overwrite`` mode they write blindly, and lost increments are counted.
+Writers keep node instance versions as the workers of ``CloudifyProcessExecutor`` do.
+
+Requires ARIA and its test package on the Python path (as for the test suite). Run from the
+repository root: ``python -m benchmarks.node_instance_conflicts [writers] [updates per writer]``
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+import aria
+from aria.orchestrator.context import common
+
+from tests import (mock, storage)
+
+from adapters import versions
+from adapters.context_adapter import NodeInstanceAdapter
+
+
+class _Context(object):
+
+    def __init__(self, model):
+        self.model = model
+
+
+def _writer(serialization_dict, node_id, updates, versioned, results):
+    versions.track_writes()
+    model = aria.application_model_storage(**serialization_dict)
+    conflicts = [0]
+
+    def increment(runtime_properties):
+        conflicts[0] += 1
+        runtime_properties['counter'] = runtime_properties.get('counter', 0) + 1
+
+    with model.instrument(*common.BaseContext.INSTRUMENTATION_FIELDS):
+        instance = NodeInstanceAdapter(_Context(model), model.node.get(node_id))
+        for _ in range(updates):
+            instance.refresh()
+            instance.runtime_properties['counter'] = \
+                instance.runtime_properties.get('counter', 0) + 1
+            if versioned:
+                instance.update(on_conflict=increment)
+    results.put(conflicts[0])
+
+
+def run(writers, updates, versioned):
+    directory = tempfile.mkdtemp()
+    workflow_context = mock.context.simple(directory)
+    # Inherited by the writers
+    os.environ[versions.EXECUTOR_VERSIONS_DIR_ENV] = versions.create_directory()
+    try:
+        node = workflow_context.model.node.get_by_name(mock.models.DEPENDENT_NODE_NAME)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=_writer,
+                args=(workflow_context.model.serialization_dict, node.id, updates, versioned,
+                      results))
+            for _ in range(writers)]
+
+        start = time.time()
+        for process in processes:
+            process.start()
+        conflicts = sum(results.get() for _ in processes)
+        for process in processes:
+            process.join()
+        duration = time.time() - start
+
+        node = workflow_context.model.node.refresh(node)
+        counter = node.attributes['counter'].value
+        return {
+            'writes/sec': writers * updates / duration,
+            'conflict rate': float(conflicts) / (writers * updates),
+            'lost updates': writers * updates - counter
+        }
+    finally:
+        storage.release_sqlite_storage(workflow_context.model)
+        shutil.rmtree(directory)
+        shutil.rmtree(os.environ.pop(versions.EXECUTOR_VERSIONS_DIR_ENV))
+
+
+def main():
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    updates = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    for versioned in (False, True):
+        result = run(writers, updates, versioned)
+        print('{0:10} {1}'.format('versioned' if versioned else 'overwrite', ', '.join(
+            '{0}: {1:.2f}'.format(key, value) for key, value in sorted(result.items()))))
+
+
+if __name__ == '__main__':
+    main()
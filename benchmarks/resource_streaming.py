@@ -0,0 +1,114 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Compares the peak memory of rendering a large resource in one piece (as ARIA does) and with
+:func:`adapters.resources.render`.
+
+The resource resembles a big cloud-init template: ``write_files`` payload lines with a template
+expression every 50 lines. Every measurement runs in a fresh process and reports its peak RSS.
+
+Requires ARIA on the Python path. Run from the repository root:
+``python -m benchmarks.resource_streaming [size in MB]...``
+"""
+
+import os
+import sys
+import time
+import base64
+import shutil
+import resource
+import tempfile
+import multiprocessing
+
+import jinja2
+
+from adapters import resources
+
+
+VARIABLES = {'hostname': 'vm-0', 'token': 'secret'}
+
+
+def generate(path, size):
+    line = '      ' + base64.b64encode(os.urandom(54)) + '\n'
+    with open(path, 'wb') as f:
+        f.write('#cloud-config\nhostname: {{ hostname }}\nwrite_files:\n  - content: |\n')
+        written = 0
+        index = 0
+        while written < size:
+            if index % 50 == 0:
+                f.write('      # {{ hostname }}-{{ token | upper }}\n')
+            f.write(line)
+            written += len(line)
+            index += 1
+
+
+def _whole(source, destination):
+    with open(source, 'rb') as f:
+        content = jinja2.Template(f.read().decode('utf-8')).render(VARIABLES)
+    with open(destination, 'wb') as f:
+        f.write(content.encode('utf-8'))
+
+
+def _streaming(source, destination):
+    with open(source, 'rb') as f:
+        with open(destination, 'wb') as target:
+            for chunk in resources.render(f, VARIABLES):
+                target.write(chunk)
+
+
+def _measure(function, source, destination, results):
+    start = time.time()
+    function(source, destination)
+    results.put((time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def measure(function, source, destination):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure,
+                                      args=(function, source, destination, results))
+    process.start()
+    process.join()
+    if process.exitcode:
+        # e.g. killed for running out of memory
+        return None
+    return results.get()
+
+
+def main(sizes=(4, 16, 64)):
+    directory = tempfile.mkdtemp()
+    try:
+        source = os.path.join(directory, 'template')
+        destination = os.path.join(directory, 'rendered')
+        print('{0:>8} {1:>22} {2:>22}'.format('size', 'whole: peak RSS, time',
+                                              'streaming: peak RSS, time'))
+        for size in sizes:
+            generate(source, size * 1024 * 1024)
+            row = ['{0:6} MB'.format(size)]
+            for function in (_whole, _streaming):
+                result = measure(function, source, destination)
+                if result is None:
+                    row.append('{0:>22}'.format('failed'))
+                else:
+                    duration, peak = result
+                    row.append('{0:12.1f} MB {1:6.1f}s'.format(peak / 1024.0, duration))
+            print(' '.join(row))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or (4, 16, 64))
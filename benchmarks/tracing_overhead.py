@@ -0,0 +1,62 @@
+#
+# Copyright (c) 2017 GigaSpaces Technologies Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Measures the per-call overhead of :func:`adapters.tracing.traced` with tracing off and on.
+
+Run from the repository root: ``python -m benchmarks.tracing_overhead``
+"""
+
+import os
+import shutil
+import timeit
+import tempfile
+
+from adapters import tracing
+
+CALLS = 1000000
+
+
+def _plain():
+    pass
+
+
+_traced = tracing.traced('benchmark')(_plain)
+
+
+def _per_call(function):
+    return min(timeit.repeat(function, number=CALLS, repeat=5)) / CALLS * 1e9
+
+
+def main():
+    plain = _per_call(_plain)
+    off = _per_call(_traced)
+
+    directory = tempfile.mkdtemp()
+    try:
+        # Collected spans are only flushed once the operation ends, outside of the timing
+        with tracing.operation_span('benchmark', path=os.path.join(directory, 'trace.jsonl')):
+            on = min(timeit.repeat(_traced, number=CALLS / 10, repeat=3)) / (CALLS / 10) * 1e9
+    finally:
+        shutil.rmtree(directory)
+
+    print('plain call:         {0:8.1f} ns'.format(plain))
+    print('traced, off:        {0:8.1f} ns (+{1:.1f} ns)'.format(off, off - plain))
+    print('traced, on:         {0:8.1f} ns (+{1:.1f} ns)'.format(on, on - plain))
+
+
+if __name__ == '__main__':
+    main()